@@ -0,0 +1,467 @@
+"""
+Minimal stand-in for the Docker Engine API, good enough for the calls the
+docker_challenges plugin makes. Containers only exist in memory.
+
+Every response can be delayed (latency + random jitter) and a share of the
+requests can be answered with a 500 to exercise error paths. Calls are
+counted per endpoint so a benchmark can report Docker API calls per launch.
+
+Run standalone with:
+
+    python benchmarks/fake_docker.py --port 2375 --images 30 --latency-ms 20
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def image_id(tag):
+    return "sha256:" + hashlib.sha256(tag.encode("utf-8")).hexdigest()
+
+
+def label_match(labels, wanted):
+    """
+    Docker label filter: every "key" must be set, every "key=value" equal.
+    """
+    for item in wanted or ():
+        key, sep, value = item.partition("=")
+        if key not in labels or (sep and labels[key] != value):
+            return False
+    return True
+
+
+class FakeDocker(object):
+    def __init__(self, images=(), exposed_ports=("80/tcp",), latency=0.0, jitter=0.0):
+        self.images = dict()
+        for tag in images:
+            self.add_image(tag, exposed_ports)
+        self.containers = dict()
+        self.networks = dict()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = 0.0
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.events = list()
+        self.events_changed = threading.Condition()
+
+    def add_image(self, tag, exposed_ports=("80/tcp",)):
+        self.images[tag] = {
+            "Id": image_id(tag),
+            "RepoTags": [tag],
+            "Config": {"ExposedPorts": dict((p, {}) for p in exposed_ports)},
+        }
+
+    def emit(self, container, action):
+        """
+        Records a container event for /events.
+        """
+        with self.events_changed:
+            self.events.append(
+                {
+                    "Type": "container",
+                    "Action": action,
+                    "status": action,
+                    "id": container["Id"],
+                    "Actor": {"ID": container["Id"], "Attributes": container["Labels"]},
+                    "time": int(time.time()),
+                    "timeNano": time.time_ns(),
+                }
+            )
+            self.events_changed.notify_all()
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+
+    def total_calls(self, prefix=""):
+        with self.lock:
+            return sum(v for k, v in self.calls.items() if k.startswith(prefix))
+
+    # Endpoint handlers return (status, body)
+
+    def list_images(self, query):
+        return 200, [
+            {"Id": i["Id"], "RepoTags": i["RepoTags"]} for i in self.images.values()
+        ]
+
+    def inspect_image(self, name):
+        image = self.images.get(name)
+        if image is None:
+            image = next((i for i in self.images.values() if i["Id"] == name), None)
+        if image is None:
+            return 404, {"message": "No such image: %s" % name}
+        return 200, image
+
+    def list_containers(self, query):
+        result = list()
+        labels = json.loads(query.get("filters", ["{}"])[0]).get("label")
+        with self.lock:
+            containers = list(self.containers.values())
+        for c in containers:
+            if not label_match(c["Labels"], labels):
+                continue
+            ports = list()
+            for private, bindings in c["HostConfig"].get("PortBindings", {}).items():
+                for b in bindings or []:
+                    port, proto = private.split("/")
+                    ports.append(
+                        {
+                            "PrivatePort": int(port),
+                            "PublicPort": int(b["HostPort"]),
+                            "Type": proto,
+                        }
+                    )
+            result.append(
+                {
+                    "Id": c["Id"],
+                    "Names": ["/" + c["Name"]],
+                    "Image": c["Image"],
+                    "Labels": c["Labels"],
+                    "State": "running" if c["State"]["Running"] else "exited",
+                    "Ports": ports if c["State"]["Running"] else [],
+                }
+            )
+        return 200, result
+
+    def create_container(self, query, body):
+        name = query.get("name", [uuid.uuid4().hex[:12]])[0]
+        if body.get("Image") not in self.images:
+            return 404, {"message": "No such image: %s" % body.get("Image")}
+        network = (body.get("HostConfig") or {}).get("NetworkMode")
+        if network not in (None, "default", "bridge") and network not in self.networks:
+            return 404, {"message": "network %s not found" % network}
+        with self.lock:
+            if any(c["Name"] == name for c in self.containers.values()):
+                return 409, {"message": "Conflict. The container name is in use"}
+            container_id = uuid.uuid4().hex + uuid.uuid4().hex
+            self.containers[container_id] = {
+                "Id": container_id,
+                "Name": name,
+                "Image": body.get("Image"),
+                "Labels": body.get("Labels") or {},
+                "HostConfig": body.get("HostConfig") or {},
+                "State": {"Running": False, "Paused": False},
+            }
+        self.emit(self.containers[container_id], "create")
+        return 201, {"Id": container_id, "Warnings": []}
+
+    def container(self, container_id):
+        with self.lock:
+            c = self.containers.get(container_id)
+            if c is None:
+                c = next(
+                    (
+                        x
+                        for x in self.containers.values()
+                        if x["Name"] == container_id or x["Id"].startswith(container_id)
+                    ),
+                    None,
+                )
+        return c
+
+    def container_action(self, container_id, action, query):
+        c = self.container(container_id)
+        if c is None:
+            return 404, {"message": "No such container: %s" % container_id}
+        if action == "json":
+            return 200, c
+        if action == "start":
+            if c["State"]["Running"]:
+                return 304, None
+            c["State"]["Running"] = True
+            self.emit(c, "start")
+        elif action == "stop":
+            if not c["State"]["Running"]:
+                return 304, None
+            c["State"]["Running"] = False
+            c["State"]["Paused"] = False
+            self.emit(c, "die")
+            self.emit(c, "stop")
+        elif action in ("pause", "unpause"):
+            if not c["State"]["Running"] or c["State"]["Paused"] == (action == "pause"):
+                return 409, {"message": "Cannot %s container %s" % (action, c["Id"])}
+            c["State"]["Paused"] = action == "pause"
+            self.emit(c, action)
+        elif action == "stats":
+            # Containers never do anything, so they all look idle.
+            return 200, {
+                "cpu_stats": {"cpu_usage": {"total_usage": 0}, "system_cpu_usage": 0},
+                "precpu_stats": {
+                    "cpu_usage": {"total_usage": 0},
+                    "system_cpu_usage": 0,
+                },
+                "networks": {"eth0": {"rx_bytes": 0, "tx_bytes": 0}},
+                "memory_stats": {
+                    "usage": 8 * 1024 * 1024 if c["State"]["Running"] else 0
+                },
+            }
+        elif action == "restart":
+            if c["State"]["Running"]:
+                self.emit(c, "die")
+            c["State"]["Running"] = True
+            c["State"]["Paused"] = False
+            self.emit(c, "start")
+            self.emit(c, "restart")
+        elif action == "rename":
+            c["Name"] = query.get("name", [c["Name"]])[0]
+        else:
+            return 404, {"message": "page not found"}
+        return 204, None
+
+    def delete_container(self, container_id):
+        c = self.container(container_id)
+        if c is None:
+            return 404, {"message": "No such container: %s" % container_id}
+        with self.lock:
+            self.containers.pop(c["Id"], None)
+        if c["State"]["Running"]:
+            self.emit(c, "kill")
+            self.emit(c, "die")
+        self.emit(c, "destroy")
+        return 204, None
+
+    def create_network(self, body):
+        name = body.get("Name")
+        with self.lock:
+            if name in self.networks:
+                return 409, {"message": "network with name %s already exists" % name}
+            network_id = uuid.uuid4().hex + uuid.uuid4().hex
+            self.networks[name] = {
+                "Id": network_id,
+                "Name": name,
+                "Labels": body.get("Labels") or {},
+            }
+        return 201, {"Id": network_id, "Warning": ""}
+
+    def delete_network(self, network_id):
+        with self.lock:
+            network = next(
+                (
+                    n
+                    for n in self.networks.values()
+                    if network_id in (n["Id"], n["Name"])
+                ),
+                None,
+            )
+            if network is None:
+                return 404, {"message": "network %s not found" % network_id}
+            if any(
+                c["HostConfig"].get("NetworkMode") == network["Name"]
+                for c in self.containers.values()
+            ):
+                return 403, {
+                    "message": "error while removing network: network %s has "
+                    "active endpoints" % network["Name"]
+                }
+            self.networks.pop(network["Name"])
+        return 204, None
+
+    def pull_image(self, query):
+        """
+        Adds the image and streams pull progress, one JSON object per line,
+        for a single fake layer.
+        """
+        tag = "%s:%s" % (
+            query.get("fromImage", [""])[0],
+            query.get("tag", ["latest"])[0],
+        )
+        layer = image_id(tag)[7:19]
+        size = 1024 * 1024
+        self.add_image(tag)
+        messages = [
+            {"status": "Pulling from %s" % tag, "id": tag},
+            {
+                "status": "Downloading",
+                "id": layer,
+                "progressDetail": {"current": size // 2, "total": size},
+            },
+            {"status": "Download complete", "id": layer},
+            {"status": "Pull complete", "id": layer},
+            {"status": "Downloaded newer image for %s" % tag},
+        ]
+        return 200, (json.dumps(m).encode("utf-8") + b"\n" for m in messages)
+
+    def stream_events(self, query):
+        """
+        The events between since and until that pass the filters, one JSON
+        object per line. Without until the stream stays open and follows new
+        events, like the real daemon.
+        """
+        since = float(query.get("since", [0])[0])
+        until = query.get("until", [None])[0]
+        until = float(until) if until is not None else None
+        filters = json.loads(query.get("filters", ["{}"])[0])
+
+        def matches(e):
+            return (
+                e["time"] >= since
+                and ("type" not in filters or e["Type"] in filters["type"])
+                and ("event" not in filters or e["Action"] in filters["event"])
+                and label_match(e["Actor"]["Attributes"], filters.get("label"))
+            )
+
+        def lines():
+            sent = 0
+            while True:
+                with self.events_changed:
+                    while sent == len(self.events):
+                        left = None if until is None else until - time.time()
+                        if left is not None and left <= 0:
+                            return
+                        self.events_changed.wait(left)
+                    new, sent = self.events[sent:], len(self.events)
+                for e in new:
+                    if until is not None and e["time"] > until:
+                        return
+                    if matches(e):
+                        yield json.dumps(e).encode("utf-8") + b"\n"
+
+        return 200, lines()
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        if hasattr(body, "__next__"):
+            return self.stream(status, body)
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, status, lines):
+        """
+        Streams a generator of lines, the end of the body is the end of the
+        connection.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for line in lines:
+                self.wfile.write(line)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def route(self, method):
+        docker = self.server.docker
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", unquote(url.path))
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        m = re.match(r"^/containers/([^/]+)(?:/(\w+))?$", path)
+        if method == "GET" and path == "/images/json":
+            endpoint, handler = "images.list", lambda: docker.list_images(query)
+        elif method == "GET" and path.startswith("/images/") and path.endswith("/json"):
+            name = path[len("/images/") : -len("/json")]
+            endpoint, handler = "images.inspect", lambda: docker.inspect_image(name)
+        elif method == "POST" and path == "/images/create":
+            endpoint, handler = "images.pull", lambda: docker.pull_image(query)
+        elif method == "GET" and path == "/containers/json":
+            endpoint, handler = "containers.list", lambda: docker.list_containers(query)
+        elif method == "POST" and path == "/containers/create":
+            endpoint, handler = "containers.create", lambda: docker.create_container(
+                query, body
+            )
+        elif method == "DELETE" and m and not m.group(2):
+            endpoint, handler = "containers.delete", lambda: docker.delete_container(
+                m.group(1)
+            )
+        elif method == "GET" and path == "/events":
+            endpoint, handler = "events", lambda: docker.stream_events(query)
+        elif method == "POST" and path == "/networks/create":
+            endpoint, handler = "networks.create", lambda: docker.create_network(body)
+        elif method == "DELETE" and path.startswith("/networks/"):
+            network_id = path[len("/networks/") :]
+            endpoint, handler = "networks.delete", lambda: docker.delete_network(
+                network_id
+            )
+        elif m and m.group(2):
+            endpoint = "containers.%s" % m.group(2)
+            handler = lambda: docker.container_action(m.group(1), m.group(2), query)
+        else:
+            endpoint, handler = "unknown", lambda: (404, {"message": "page not found"})
+
+        with docker.lock:
+            docker.calls[endpoint] += 1
+        delay = docker.latency + random.uniform(0, docker.jitter)
+        if delay:
+            time.sleep(delay)
+        if docker.failure_rate and random.random() < docker.failure_rate:
+            return self.reply(500, {"message": "injected failure"})
+        return self.reply(*handler())
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+
+class FakeDockerServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, docker, host="127.0.0.1", port=0):
+        self.docker = docker
+        super().__init__((host, port), FakeDockerHandler)
+
+    @property
+    def hostname(self):
+        return "%s:%s" % self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2375)
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    docker = FakeDocker(
+        images=["bench/challenge:%s" % i for i in range(args.images)],
+        latency=args.latency_ms / 1000.0,
+        jitter=args.jitter_ms / 1000.0,
+    )
+    docker.failure_rate = args.failure_rate
+    server = FakeDockerServer(docker, args.host, args.port)
+    print("Fake Docker API listening on http://%s" % server.hostname)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
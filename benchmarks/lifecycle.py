@@ -0,0 +1,369 @@
+"""
+Load test for the container lifecycle of the docker_challenges plugin.
+
+Boots CTFd against a throwaway SQLite database with the plugin installed,
+points every team at a local FakeDocker daemon and then drives the plugin
+endpoints concurrently:
+
+* launch  - GET /api/v1/container for every (team, challenge) pair, polling
+            the provisioning job until the container is running
+* status  - GET /api/v1/docker_status, cold and with If-None-Match
+* revert  - a second launch of a subset of the containers
+* reap    - one stale container sweep after ageing every tracker row
+* nuke    - "Nuke All Containers" from the admin API
+
+For each phase it prints p50/p95/p99 latency, throughput, SQL queries per
+request and Docker API calls per operation. Everything runs offline; CTFd
+has to be importable with this plugin in CTFd/plugins/docker_challenges.
+
+    python benchmarks/lifecycle.py --teams 500 --challenges 30 --concurrency 32
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_docker import FakeDocker, FakeDockerServer  # noqa: E402
+
+
+class QueryCounter(object):
+    """
+    Counts SQL statements per thread, so request threads can be told apart
+    from the plugin's background workers.
+    """
+
+    def __init__(self, engine):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.total = 0
+        event.listen(engine, "before_cursor_execute", self.count)
+
+    def count(self, *args, **kwargs):
+        self.local.count = getattr(self.local, "count", 0) + 1
+        with self.lock:
+            self.total += 1
+
+    def reset(self):
+        self.local.count = 0
+
+    def value(self):
+        return getattr(self.local, "count", 0)
+
+
+class Phase(object):
+    def __init__(self, name):
+        self.name = name
+        self.latencies = list()
+        self.queries = list()
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.started = None
+        self.finished = None
+        self.docker_calls = 0
+        self.operations = 0
+
+    def add(self, latency, queries, ok=True):
+        with self.lock:
+            self.latencies.append(latency)
+            self.queries.append(queries)
+            if not ok:
+                self.errors += 1
+
+    def percentile(self, p):
+        values = sorted(self.latencies)
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+        return values[index] * 1000
+
+    def report(self):
+        elapsed = (self.finished or time.time()) - self.started
+        count = len(self.latencies)
+        print(
+            "%-8s n=%-6d err=%-4d p50=%8.1fms p95=%8.1fms p99=%8.1fms "
+            "%8.1f req/s  sql/req=%6.1f  docker/op=%5.2f"
+            % (
+                self.name,
+                count,
+                self.errors,
+                self.percentile(50),
+                self.percentile(95),
+                self.percentile(99),
+                count / elapsed if elapsed else 0,
+                sum(self.queries) / float(count) if count else 0,
+                self.docker_calls / float(self.operations or count or 1),
+            )
+        )
+
+
+class Benchmark(object):
+    def __init__(self, args):
+        self.args = args
+        self.docker = FakeDocker(
+            images=["bench/challenge:%s" % i for i in range(args.challenges)],
+            latency=args.latency_ms / 1000.0,
+            jitter=args.jitter_ms / 1000.0,
+        )
+        self.server = FakeDockerServer(self.docker)
+        self.server.start()
+        self.db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        self.app = self.create_app()
+        self.queries = QueryCounter(self.app.db.engine)
+
+    def create_app(self):
+        from CTFd import create_app
+        from CTFd.config import TestingConfig
+
+        class BenchmarkConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///%s" % self.db_file.name
+
+        return create_app(BenchmarkConfig)
+
+    def setup(self):
+        from CTFd.models import Teams, Users, db
+        from CTFd.utils import set_config
+        from CTFd.plugins.docker_challenges import DockerChallenge, DockerConfig
+
+        with self.app.app_context():
+            set_config("setup", True)
+            set_config("user_mode", "teams")
+            set_config("docker_catalog_ttl", 600)
+            set_config("docker_reaper_interval", 0)
+            set_config("docker_reconcile_interval", 0)
+            set_config("docker_events_interval", 0)
+            set_config("docker_idle_interval", 0)
+            set_config("docker_launch_rate", 0)
+
+            admin = Users(name="admin", email="admin@bench.local", type="admin")
+            admin.password = "password"
+            db.session.add(admin)
+            for t in range(self.args.teams):
+                team = Teams(name="team%s" % t, email="team%s@bench.local" % t)
+                db.session.add(team)
+                db.session.flush()
+                user = Users(
+                    name="user%s" % t,
+                    email="user%s@bench.local" % t,
+                    team_id=team.id,
+                )
+                user.password = "password"
+                db.session.add(user)
+                db.session.flush()
+                team.captain_id = user.id
+                db.session.add(
+                    DockerConfig(
+                        owner_id=team.id,
+                        hostname=self.server.hostname,
+                        tls_enabled=False,
+                    )
+                )
+            for c in range(self.args.challenges):
+                db.session.add(
+                    DockerChallenge(
+                        name="challenge%s" % c,
+                        category="bench",
+                        description="bench",
+                        value=100,
+                        state="visible",
+                        type="docker",
+                        docker_image="bench/challenge:%s" % c,
+                    )
+                )
+            db.session.commit()
+            self.users = [
+                (u.id, u.team_id) for u in Users.query.filter(Users.team_id.isnot(None))
+            ]
+            self.admin_id = admin.id
+            self.passwords = dict((u.id, u.password) for u in Users.query)
+
+    def client(self, user_id):
+        """
+        A logged in test client. Test clients are not thread safe, so every
+        operation gets its own.
+        """
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess["id"] = user_id
+            sess["nonce"] = "bench"
+            try:
+                from CTFd.utils.security.signing import hmac
+
+                sess["hash"] = hmac(self.passwords[user_id])
+            except ImportError:
+                pass
+        return client
+
+    def timed(self, phase, func):
+        self.queries.reset()
+        start = time.time()
+        try:
+            ok = func()
+        except Exception:
+            ok = False
+        phase.add(time.time() - start, self.queries.value(), ok)
+        return ok
+
+    def run_phase(self, name, work, operations=None):
+        phase = Phase(name)
+        self.docker.reset_counters()
+        phase.started = time.time()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(lambda item: work(phase, item), operations))
+        phase.finished = time.time()
+        phase.docker_calls = self.docker.total_calls()
+        phase.operations = len(operations)
+        phase.report()
+        return phase
+
+    def launch(self, phase, item):
+        user_id, image = item
+        client = self.client(user_id)
+
+        def request():
+            r = client.get("/api/v1/container", query_string={"name": image})
+            if r.status_code != 202:
+                return False
+            job_id = r.get_json()["data"]["id"]
+            while True:
+                job = client.get("/api/v1/container/jobs/%s" % job_id).get_json()
+                if job["data"]["status"] in ("done", "failed"):
+                    return job["data"]["status"] == "done"
+                time.sleep(0.05)
+
+        self.timed(phase, request)
+
+    def status(self, phase, user_id):
+        client = self.client(user_id)
+        etag = dict()
+
+        def request():
+            r = client.get("/api/v1/docker_status")
+            etag["value"] = r.headers.get("ETag")
+            return r.status_code == 200
+
+        def conditional():
+            r = client.get(
+                "/api/v1/docker_status",
+                headers={"If-None-Match": etag.get("value") or ""},
+            )
+            return r.status_code in (200, 304)
+
+        self.timed(phase, request)
+        self.timed(phase, conditional)
+
+    def reap(self):
+        from CTFd.models import db
+        from CTFd.plugins.docker_challenges import (
+            DockerChallengeTracker,
+            reap_stale_containers,
+        )
+
+        phase = Phase("reap")
+        with self.app.app_context():
+            DockerChallengeTracker.query.update({"timestamp": 0})
+            db.session.commit()
+            count = DockerChallengeTracker.query.count()
+            self.docker.reset_counters()
+            phase.started = time.time()
+            self.timed(phase, lambda: reap_stale_containers() is not None)
+            phase.finished = time.time()
+        phase.docker_calls = self.docker.total_calls()
+        phase.operations = count
+        phase.report()
+
+    def nuke(self):
+        phase = Phase("nuke")
+        client = self.client(self.admin_id)
+        self.docker.reset_counters()
+        phase.started = time.time()
+
+        def request():
+            r = client.get(
+                "/api/v1/nuke", query_string={"all": "true", "container": "null"}
+            )
+            job_id = r.get_json()["data"]["id"]
+            while True:
+                job = client.get("/api/v1/nuke/jobs/%s" % job_id).get_json()["data"]
+                if job["status"] != "running":
+                    phase.operations = job["total"]
+                    return job["status"] == "done"
+                time.sleep(0.1)
+
+        self.timed(phase, request)
+        phase.finished = time.time()
+        phase.docker_calls = self.docker.total_calls()
+        phase.report()
+
+    def run(self):
+        self.setup()
+        images = ["bench/challenge:%s" % c for c in range(self.args.challenges)]
+        launches = [(u, image) for image in images for u, _ in self.users]
+        if self.args.launches:
+            launches = launches[: self.args.launches]
+        users = [u for u, _ in self.users]
+
+        print(
+            "%s teams, %s challenges, %s launches, concurrency %s, "
+            "docker latency %sms (+%sms jitter), failure rate %s"
+            % (
+                self.args.teams,
+                self.args.challenges,
+                len(launches),
+                self.args.concurrency,
+                self.args.latency_ms,
+                self.args.jitter_ms,
+                self.args.failure_rate,
+            )
+        )
+        self.docker.failure_rate = self.args.failure_rate
+        self.run_phase("launch", self.launch, launches)
+        self.run_phase("status", self.status, users)
+        if self.args.reverts:
+            from CTFd.models import db
+            from CTFd.plugins.docker_challenges import DockerChallengeTracker
+
+            # Make every container old enough to be reverted.
+            with self.app.app_context():
+                DockerChallengeTracker.query.update(
+                    {"timestamp": DockerChallengeTracker.timestamp - 600}
+                )
+                db.session.commit()
+            self.run_phase("revert", self.launch, launches[: self.args.reverts])
+        self.reap()
+        self.run_phase("relaunch", self.launch, launches[: len(users)])
+        self.nuke()
+        print("total sql statements: %s" % self.queries.total)
+
+    def close(self):
+        self.server.shutdown()
+        os.unlink(self.db_file.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--teams", type=int, default=500)
+    parser.add_argument("--challenges", type=int, default=30)
+    parser.add_argument("--launches", type=int, default=0, help="0 launches all")
+    parser.add_argument("--reverts", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args)
+    try:
+        benchmark.run()
+    finally:
+        benchmark.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Query plans and timings of the plugin's hot tracker queries on the schema
+before and after the typed owner id / composite index migration.
+
+Builds both schemas in throwaway SQLite databases (no CTFd needed), fills
+them with the same synthetic containers and prints EXPLAIN QUERY PLAN plus
+the mean time of each query, and the cost of inserting and deleting rows.
+
+    python benchmarks/query_plans.py --owners 2000 --challenges 30
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+CERT = "-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n"
+
+# The schema as created by the plugin up to revision 9e3a1d6c2f48.
+BEFORE = """
+CREATE TABLE teams (id INTEGER PRIMARY KEY, name VARCHAR(128));
+CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(128));
+CREATE TABLE docker_config (
+    id INTEGER PRIMARY KEY,
+    hostname VARCHAR(64),
+    tls_enabled BOOLEAN,
+    ca_cert VARCHAR(2200),
+    client_cert VARCHAR(2000),
+    client_key VARCHAR(3300),
+    repositories VARCHAR(1024),
+    owner_id VARCHAR(64)
+);
+CREATE INDEX ix_docker_config_hostname ON docker_config (hostname);
+CREATE INDEX ix_docker_config_tls_enabled ON docker_config (tls_enabled);
+CREATE INDEX ix_docker_config_ca_cert ON docker_config (ca_cert);
+CREATE INDEX ix_docker_config_client_cert ON docker_config (client_cert);
+CREATE INDEX ix_docker_config_client_key ON docker_config (client_key);
+CREATE INDEX ix_docker_config_repositories ON docker_config (repositories);
+CREATE UNIQUE INDEX ix_docker_config_owner_id ON docker_config (owner_id);
+CREATE TABLE docker_challenge_tracker (
+    id INTEGER PRIMARY KEY,
+    team_id VARCHAR(64),
+    user_id VARCHAR(64),
+    docker_image VARCHAR(64),
+    timestamp INTEGER,
+    revert_time INTEGER,
+    instance_id VARCHAR(128),
+    ports VARCHAR(128),
+    host VARCHAR(128),
+    docker_config_id INTEGER
+);
+CREATE INDEX ix_docker_challenge_tracker_team_id ON docker_challenge_tracker (team_id);
+CREATE INDEX ix_docker_challenge_tracker_user_id ON docker_challenge_tracker (user_id);
+CREATE INDEX ix_docker_challenge_tracker_docker_image ON docker_challenge_tracker (docker_image);
+CREATE INDEX ix_docker_challenge_tracker_timestamp ON docker_challenge_tracker (timestamp);
+CREATE INDEX ix_docker_challenge_tracker_revert_time ON docker_challenge_tracker (revert_time);
+CREATE INDEX ix_docker_challenge_tracker_instance_id ON docker_challenge_tracker (instance_id);
+CREATE INDEX ix_docker_challenge_tracker_ports ON docker_challenge_tracker (ports);
+CREATE INDEX ix_docker_challenge_tracker_host ON docker_challenge_tracker (host);
+CREATE INDEX ix_docker_challenge_tracker_docker_config_id ON docker_challenge_tracker (docker_config_id);
+"""
+
+# The schema after revision 7b2d4f8a1c63.
+AFTER = """
+CREATE TABLE teams (id INTEGER PRIMARY KEY, name VARCHAR(128));
+CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(128));
+CREATE TABLE docker_config (
+    id INTEGER PRIMARY KEY,
+    hostname VARCHAR(64),
+    tls_enabled BOOLEAN,
+    ca_cert VARCHAR(2200),
+    client_cert VARCHAR(2000),
+    client_key VARCHAR(3300),
+    repositories VARCHAR(1024),
+    owner_id INTEGER UNIQUE
+);
+CREATE INDEX ix_docker_config_hostname ON docker_config (hostname);
+CREATE TABLE docker_challenge_tracker (
+    id INTEGER PRIMARY KEY,
+    team_id INTEGER REFERENCES teams (id) ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    docker_image VARCHAR(64),
+    timestamp INTEGER,
+    revert_time INTEGER,
+    instance_id VARCHAR(128),
+    host VARCHAR(128),
+    docker_config_id INTEGER REFERENCES docker_config (id) ON DELETE SET NULL
+);
+CREATE INDEX ix_docker_challenge_tracker_team_image ON docker_challenge_tracker (team_id, docker_image);
+CREATE INDEX ix_docker_challenge_tracker_user_image ON docker_challenge_tracker (user_id, docker_image);
+CREATE INDEX ix_docker_challenge_tracker_timestamp ON docker_challenge_tracker (timestamp);
+CREATE INDEX ix_docker_challenge_tracker_instance_id ON docker_challenge_tracker (instance_id);
+CREATE INDEX ix_docker_challenge_tracker_docker_config_id ON docker_challenge_tracker (docker_config_id);
+CREATE TABLE docker_container_port (
+    tracker_id INTEGER REFERENCES docker_challenge_tracker (id) ON DELETE CASCADE,
+    port INTEGER,
+    PRIMARY KEY (tracker_id, port)
+);
+"""
+
+# name: (query before, query after). Parameters are filled by Schema.params.
+QUERIES = {
+    "launch/solve lookup": (
+        "SELECT * FROM docker_challenge_tracker WHERE team_id = :owner_s "
+        "AND docker_image = :image LIMIT 1",
+        "SELECT * FROM docker_challenge_tracker WHERE team_id = :owner "
+        "AND docker_image = :image LIMIT 1",
+    ),
+    "status of one owner": (
+        "SELECT * FROM docker_challenge_tracker WHERE team_id = :owner_s",
+        "SELECT t.*, p.port FROM docker_challenge_tracker t "
+        "LEFT JOIN docker_container_port p ON p.tracker_id = t.id "
+        "WHERE t.team_id = :owner",
+    ),
+    "reaper batch": (
+        "SELECT * FROM docker_challenge_tracker WHERE timestamp < :cutoff "
+        "ORDER BY timestamp LIMIT 100",
+        "SELECT * FROM docker_challenge_tracker WHERE timestamp < :cutoff "
+        "ORDER BY timestamp LIMIT 100",
+    ),
+    "admin page join": (
+        "SELECT t.*, teams.name FROM docker_challenge_tracker t "
+        "LEFT JOIN teams ON teams.id = CAST(t.team_id AS INTEGER) "
+        "ORDER BY t.id LIMIT 50",
+        "SELECT t.*, teams.name FROM docker_challenge_tracker t "
+        "LEFT JOIN teams ON teams.id = t.team_id ORDER BY t.id LIMIT 50",
+    ),
+    "owner config lookup": (
+        "SELECT * FROM docker_config WHERE owner_id = :owner_s",
+        "SELECT * FROM docker_config WHERE owner_id = :owner",
+    ),
+}
+
+
+class Schema(object):
+    def __init__(self, name, ddl, index, args):
+        self.name = name
+        self.index = index
+        self.args = args
+        self.path = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(ddl)
+        self.typed = index == 1
+
+    def owner(self, value):
+        return value if self.typed else str(value)
+
+    def fill(self):
+        rng = random.Random(1)
+        args = self.args
+        owners = range(1, args.owners + 1)
+        self.db.executemany(
+            "INSERT INTO teams (id, name) VALUES (?, ?)",
+            [(i, "team%s" % i) for i in owners],
+        )
+        configs = list()
+        for i in owners:
+            blob = "".join(rng.choice("ABCDEFGH") for _ in range(1600))
+            configs.append(
+                (
+                    i,
+                    "10.0.0.%s:2376" % (i % 8),
+                    True,
+                    CERT % blob,
+                    CERT % blob[::-1],
+                    CERT % (blob * 2),
+                    "bench/challenge",
+                    self.owner(i),
+                )
+            )
+        start = time.perf_counter()
+        self.db.executemany(
+            "INSERT INTO docker_config (id, hostname, tls_enabled, ca_cert, "
+            "client_cert, client_key, repositories, owner_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            configs,
+        )
+        self.db.commit()
+        self.config_insert = time.perf_counter() - start
+
+        now = int(time.time())
+        rows = list()
+        for owner in owners:
+            for c in range(args.challenges):
+                if rng.random() < args.fill:
+                    rows.append((owner, c, now - rng.randint(0, 3 * 3600)))
+        self.rows = len(rows)
+        start = time.perf_counter()
+        for tracker_id, (owner, c, timestamp) in enumerate(rows, 1):
+            ports = [30000 + (tracker_id * 2) % 30000, 30001 + (tracker_id * 2) % 30000]
+            values = [
+                tracker_id,
+                self.owner(owner),
+                "bench/challenge:%s" % c,
+                timestamp,
+                timestamp + 300,
+                "%064x" % tracker_id,
+                "10.0.0.%s" % (owner % 8),
+                owner,
+            ]
+            if self.typed:
+                self.db.execute(
+                    "INSERT INTO docker_challenge_tracker (id, team_id, "
+                    "docker_image, timestamp, revert_time, instance_id, host, "
+                    "docker_config_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    values,
+                )
+                self.db.executemany(
+                    "INSERT INTO docker_container_port (tracker_id, port) "
+                    "VALUES (?, ?)",
+                    [(tracker_id, p) for p in ports],
+                )
+            else:
+                self.db.execute(
+                    "INSERT INTO docker_challenge_tracker (id, team_id, "
+                    "docker_image, timestamp, revert_time, instance_id, host, "
+                    "docker_config_id, ports) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values + [",".join(str(p) for p in ports)],
+                )
+        self.db.commit()
+        self.tracker_insert = time.perf_counter() - start
+        self.db.execute("ANALYZE")
+
+    def params(self):
+        owner = random.randint(1, self.args.owners)
+        return {
+            "owner": owner,
+            "owner_s": str(owner),
+            "image": "bench/challenge:%s" % random.randrange(self.args.challenges),
+            "cutoff": int(time.time()) - 7200,
+        }
+
+    def plan(self, sql):
+        return [
+            row[-1]
+            for row in self.db.execute("EXPLAIN QUERY PLAN " + sql, self.params())
+        ]
+
+    def time(self, sql):
+        start = time.perf_counter()
+        for _ in range(self.args.repeat):
+            self.db.execute(sql, self.params()).fetchall()
+        return (time.perf_counter() - start) / self.args.repeat * 1000
+
+    def delete_all(self):
+        ids = [i for i, in self.db.execute("SELECT id FROM docker_challenge_tracker")]
+        start = time.perf_counter()
+        for i in ids:
+            self.db.execute("DELETE FROM docker_challenge_tracker WHERE id = ?", (i,))
+        self.db.commit()
+        return time.perf_counter() - start
+
+    def size(self):
+        return os.path.getsize(self.path) / 1024.0 / 1024.0
+
+    def close(self):
+        self.db.close()
+        os.unlink(self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--owners", type=int, default=2000)
+    parser.add_argument("--challenges", type=int, default=30)
+    parser.add_argument(
+        "--fill", type=float, default=0.2, help="share of pairs running"
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    schemas = [
+        Schema("before", BEFORE, 0, args),
+        Schema("after", AFTER, 1, args),
+    ]
+    try:
+        for schema in schemas:
+            schema.fill()
+        print("%s owners, %s tracked containers\n" % (args.owners, schemas[0].rows))
+        for name, queries in QUERIES.items():
+            print("== %s" % name)
+            for schema, sql in zip(schemas, queries):
+                print("  %-6s %8.3f ms" % (schema.name, schema.time(sql)))
+                for line in schema.plan(sql):
+                    print("           %s" % line)
+            print()
+        print("== writes")
+        for schema in schemas:
+            print(
+                "  %-6s config insert %7.1f ms  tracker insert %7.1f ms  "
+                "delete all %7.1f ms  file %6.1f MB"
+                % (
+                    schema.name,
+                    schema.config_insert * 1000,
+                    schema.tracker_insert * 1000,
+                    schema.delete_all() * 1000,
+                    schema.size(),
+                )
+            )
+    finally:
+        for schema in schemas:
+            schema.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
-import traceback
+import click
+import logging
+import math
+import re
+import socket
 
 from CTFd.plugins.challenges import BaseChallenge, CHALLENGE_CLASSES
 from CTFd.plugins.flags import get_flag_class
 from CTFd.utils.user import get_ip
 from CTFd.utils.uploads import delete_file
 from CTFd.plugins import register_plugin_assets_directory
+from CTFd.plugins.migrations import upgrade
 from CTFd.models import (
     db,
     Challenges,
@@ -21,9 +26,31 @@ from CTFd.utils.decorators import admins_only, authed_only
 from CTFd.utils.user import get_current_team
 from CTFd.utils.user import get_current_user
 from CTFd.utils.config import is_teams_mode
+from CTFd.utils import get_config, set_config
+from CTFd.cache import cache
 from CTFd.api import CTFd_API_v1
 from flask_restx import Namespace, Resource
-from flask import request, Blueprint, abort, render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import defer, make_transient_to_detached, selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from flask import (
+    request,
+    Blueprint,
+    abort,
+    render_template,
+    redirect,
+    url_for,
+    current_app,
+    jsonify,
+    Response,
+    g,
+    has_app_context,
+    has_request_context,
+    stream_with_context,
+)
 from wtforms import (
     FileField,
     HiddenField,
@@ -33,16 +60,36 @@ from wtforms import (
     SelectMultipleField,
 )
 import requests
+from requests.adapters import HTTPAdapter
 import tempfile
+import threading
+import ssl
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from CTFd.utils.dates import unix_time
 from datetime import datetime
 import json
 import hashlib
+from urllib.parse import quote
 import random
 
 from CTFd.forms import BaseForm
 from CTFd.forms.fields import SubmitField
 
+try:
+    from CTFd.exceptions.challenges import (
+        ChallengeCreateException,
+        ChallengeUpdateException,
+    )
+except ImportError:
+    # CTFd before 3.7 has no way to show plugin errors, the save just fails.
+    ChallengeCreateException = ChallengeUpdateException = ValueError
+
+log = logging.getLogger(__name__)
+
 
 class DockerConfig(db.Model):
     """
@@ -51,19 +98,14 @@ class DockerConfig(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     hostname = db.Column("hostname", db.String(64), index=True)
-    tls_enabled = db.Column(
-        "tls_enabled",
-        db.Boolean,
-        default=False,
-        index=True,
-    )
-    ca_cert = db.Column("ca_cert", db.String(2200), index=True)
-    client_cert = db.Column("client_cert", db.String(2000), index=True)
-    client_key = db.Column("client_key", db.String(3300), index=True)
-    repositories = db.Column("repositories", db.String(1024), index=True)
+    tls_enabled = db.Column("tls_enabled", db.Boolean, default=False)
+    ca_cert = db.Column("ca_cert", db.String(2200))
+    client_cert = db.Column("client_cert", db.String(2000))
+    client_key = db.Column("client_key", db.String(3300))
+    repositories = db.Column("repositories", db.String(1024))
 
     # owner can be a team or user depending on the ctfd mode
-    owner_id = db.Column("owner_id", db.String(64), index=True, unique=True)
+    owner_id = db.Column("owner_id", db.Integer, unique=True)
 
 
 class DockerChallengeTracker(db.Model):
@@ -71,15 +113,110 @@ class DockerChallengeTracker(db.Model):
     Docker Container Tracker. Stores the users/teams active docker containers.
     """
 
+    # Lookups are by owner and image, timestamp ranges (reaper) and
+    # instance_id, so those are the only indexes.
+    __table_args__ = (
+        db.Index("ix_docker_challenge_tracker_team_image", "team_id", "docker_image"),
+        db.Index("ix_docker_challenge_tracker_user_image", "user_id", "docker_image"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column("team_id", db.String(64), index=True)
-    user_id = db.Column("user_id", db.String(64), index=True)
-    docker_image = db.Column("docker_image", db.String(64), index=True)
+    team_id = db.Column(
+        "team_id", db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+    user_id = db.Column(
+        "user_id", db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
+    )
+    docker_image = db.Column("docker_image", db.String(64))
     timestamp = db.Column("timestamp", db.Integer, index=True)
-    revert_time = db.Column("revert_time", db.Integer, index=True)
+    revert_time = db.Column("revert_time", db.Integer)
+    instance_id = db.Column("instance_id", db.String(128), index=True)
+    host = db.Column("host", db.String(128))
+    # The config used to reach the container's daemon
+    docker_config_id = db.Column(
+        "docker_config_id",
+        db.Integer,
+        db.ForeignKey("docker_config.id", ondelete="SET NULL"),
+        index=True,
+    )
+    # Set for multi-container challenges: names the private network and
+    # labels the other containers of the stack.
+    stack_id = db.Column("stack_id", db.String(32))
+    # "pause" or "stop" while the idle monitor has the container hibernated.
+    hibernated = db.Column("hibernated", db.String(8))
+    ports = db.relationship(
+        "DockerContainerPort",
+        order_by="DockerContainerPort.port",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    @property
+    def port_list(self):
+        return [p.port for p in self.ports]
+
+
+class DockerContainerPort(db.Model):
+    """
+    Host ports published by a tracked container, one row per port.
+    """
+
+    tracker_id = db.Column(
+        "tracker_id",
+        db.Integer,
+        db.ForeignKey("docker_challenge_tracker.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    port = db.Column("port", db.Integer, primary_key=True, autoincrement=False)
+
+
+class DockerHost(db.Model):
+    """
+    Docker Host Model. Stores per daemon settings shared by every owner
+    config pointing at the same hostname.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    hostname = db.Column("hostname", db.String(64), unique=True)
+    port_range_start = db.Column("port_range_start", db.Integer, default=30000)
+    port_range_end = db.Column("port_range_end", db.Integer, default=60000)
+    # Scheduling: hosts in the pool receive containers in proportion to
+    # their weight, up to max_containers when it is set.
+    pooled = db.Column("pooled", db.Boolean, default=False)
+    weight = db.Column("weight", db.Float, default=1.0)
+    max_containers = db.Column("max_containers", db.Integer)
+    # Admission control: launches are refused once the limits of the
+    # containers on the host would add up to more than this. None is
+    # unlimited.
+    cpu_capacity = db.Column("cpu_capacity", db.Float)
+    memory_capacity = db.Column("memory_capacity", db.Integer)
+
+
+class DockerPortLease(db.Model):
+    """
+    Docker Port Lease. One row per published host port, so concurrent
+    launches on the same daemon can never be handed the same port.
+    """
+
+    host = db.Column("host", db.String(64), primary_key=True)
+    port = db.Column("port", db.Integer, primary_key=True, autoincrement=False)
     instance_id = db.Column("instance_id", db.String(128), index=True)
-    ports = db.Column("ports", db.String(128), index=True)
-    host = db.Column("host", db.String(128), index=True)
+    timestamp = db.Column("timestamp", db.Integer)
+
+
+class DockerWarmContainer(db.Model):
+    """
+    Docker Warm Container. A started container waiting in a challenge's warm
+    pool to be handed to the next team/user launching that image.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    docker_image = db.Column("docker_image", db.String(128), index=True)
+    hostname = db.Column("hostname", db.String(64), index=True)
+    docker_config_id = db.Column("docker_config_id", db.Integer)
+    instance_id = db.Column("instance_id", db.String(128), unique=True)
+    ports = db.Column("ports", db.String(128))
+    timestamp = db.Column("timestamp", db.Integer)
 
 
 class DockerConfigForm(BaseForm):
@@ -94,9 +231,298 @@ class DockerConfigForm(BaseForm):
     client_cert = FileField("Client Cert")
     client_key = FileField("Client Key")
     repositories = SelectMultipleField("Repositories")
+    port_range_start = StringField("Port Range Start")
+    port_range_end = StringField("Port Range End")
+    pooled = RadioField("In Host Pool?")
+    weight = StringField("Weight")
+    max_containers = StringField("Max Containers")
+    cpu_capacity = StringField("CPU Capacity")
+    memory_capacity = StringField("Memory Capacity (MB)")
     submit = SubmitField("Submit")
 
 
+# Plugin wide settings, stored in CTFd's config table.
+# key: (label, default). The default also decides the type of the setting.
+DOCKER_SETTINGS = {
+    "docker_catalog_ttl": ("Image Catalog TTL (seconds)", 60),
+    "docker_scheduler": ("Host Scheduler (owner or pool)", "owner"),
+    "docker_scheduler_affinity": ("Keep Teams/Users on One Pool Host (1 or 0)", 1),
+    "docker_reconcile_interval": ("Port Reconcile Interval (seconds)", 300),
+    "docker_reaper_interval": ("Stale Container Reaper Interval (seconds)", 60),
+    "docker_stale_threshold": ("Stale Container Age (seconds)", 7200),
+    "docker_reaper_batch_size": ("Reaper Batch Size", 100),
+    "docker_warm_pool_interval": ("Warm Pool Refill Interval (seconds)", 30),
+    "docker_warm_pool_batch": ("Warm Containers Started per Refill", 10),
+    "docker_metrics_interval": ("Metrics Publish Interval (seconds)", 15),
+    "docker_events_interval": ("Docker Event Watcher Check Interval (seconds)", 30),
+    "docker_connect_timeout": ("Docker API Connect Timeout (seconds)", 3.0),
+    "docker_read_timeout": ("Docker API Read Timeout (seconds)", 30.0),
+    "docker_retries": ("Docker API Retries for GET/DELETE", 2),
+    "docker_retry_backoff": ("Docker API Retry Backoff (seconds)", 0.25),
+    "docker_breaker_threshold": ("Failures Before a Docker Host is Cut Off", 5),
+    "docker_breaker_cooldown": ("Seconds Before Probing a Cut Off Host", 30),
+    "docker_owner_max_containers": ("Max Containers per Team/User (0 unlimited)", 0),
+    "docker_launch_rate": ("Container Launches per Team/User per Minute", 6.0),
+    "docker_launch_burst": ("Container Launch Burst per Team/User", 3),
+    "docker_stream_timeout": ("Player Event Stream Duration (seconds, 0 polls)", 55),
+    "docker_teardown_workers": ("Teardown Workers (restart required)", 2),
+    "docker_teardown_retries": ("Teardown Retries", 3),
+    "docker_pull_concurrency": ("Concurrent Image Pulls per Host", 2),
+    "docker_pull_timeout": ("Image Pull Timeout (seconds)", 900),
+    "docker_idle_interval": ("Idle Container Check Interval (seconds)", 120),
+    "docker_idle_threshold": ("Hibernate Containers Idle For (seconds, 0 never)", 1800),
+    "docker_idle_action": ("Hibernate Idle Containers By (pause or stop)", "pause"),
+    "docker_idle_batch_size": ("Idle Check Batch Size", 100),
+    "docker_provision_workers": ("Provisioning Workers (restart required)", 8),
+    "docker_host_concurrency": (
+        "Concurrent Docker Operations per Host (restart required)",
+        4,
+    ),
+}
+
+
+def docker_setting(key):
+    default = DOCKER_SETTINGS[key][1]
+    value = get_config(key)
+    if value is None or value == "":
+        return default
+    try:
+        return type(default)(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Metrics(object):
+    """
+    Minimal Prometheus style registry for counters, gauges and histograms.
+
+    Every worker process keeps its own registry and periodically publishes a
+    snapshot to the CTFd cache, the metrics endpoint merges the snapshots of
+    all live workers.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    WORKER_TIMEOUT = 120
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+        self.worker = "%s-%s" % (socket.gethostname(), os.getpid())
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = Metrics.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[Metrics.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = Metrics.key(name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * len(Metrics.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(Metrics.BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+                "gauges": [[n, list(l), v] for (n, l), v in self.gauges.items()],
+                "histograms": [
+                    [n, list(l), list(h)] for (n, l), h in self.histograms.items()
+                ],
+            }
+
+    def publish(self):
+        now = time.time()
+        cache.set("docker_metrics_%s" % self.worker, self.snapshot(), timeout=300)
+        workers = cache.get("docker_metrics_workers") or dict()
+        workers[self.worker] = now
+        for worker, seen in list(workers.items()):
+            if now - seen > Metrics.WORKER_TIMEOUT:
+                del workers[worker]
+        cache.set("docker_metrics_workers", workers, timeout=0)
+
+    def collect(self):
+        """
+        Merges the live registry of this worker with the published snapshots
+        of the others. Returns (counters, gauges, histograms) dicts.
+        """
+        snapshots = [self.snapshot()]
+        for worker in cache.get("docker_metrics_workers") or dict():
+            if worker != self.worker:
+                snapshot = cache.get("docker_metrics_%s" % worker)
+                if snapshot:
+                    snapshots.append(snapshot)
+        counters, gauges, histograms = dict(), dict(), dict()
+        for snapshot in snapshots:
+            for n, l, v in snapshot["counters"]:
+                key = (n, tuple(tuple(x) for x in l))
+                counters[key] = counters.get(key, 0) + v
+            for n, l, v in snapshot["gauges"]:
+                key = (n, tuple(tuple(x) for x in l))
+                gauges[key] = gauges.get(key, 0) + v
+            for n, l, h in snapshot["histograms"]:
+                key = (n, tuple(tuple(x) for x in l))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], h)]
+                else:
+                    histograms[key] = list(h)
+        return counters, gauges, histograms
+
+    @staticmethod
+    def labels(labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"'
+            % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "))
+            for k, v in labels
+        )
+
+    def render(self, gauges=None):
+        counters, merged_gauges, histograms = self.collect()
+        merged_gauges.update(gauges or dict())
+        lines = list()
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s %s" % (name, kind))
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append("%s%s %s" % (name, Metrics.labels(labels), value))
+        for (name, labels), value in sorted(merged_gauges.items()):
+            declare(name, "gauge")
+            lines.append("%s%s %s" % (name, Metrics.labels(labels), value))
+        for (name, labels), h in sorted(histograms.items()):
+            declare(name, "histogram")
+            for bound, count in zip(Metrics.BUCKETS, h):
+                lines.append(
+                    "%s_bucket%s %s" % (name, Metrics.labels(labels, le=bound), count)
+                )
+            lines.append(
+                "%s_bucket%s %s" % (name, Metrics.labels(labels, le="+Inf"), h[-1])
+            )
+            lines.append("%s_sum%s %s" % (name, Metrics.labels(labels), h[-2]))
+            lines.append("%s_count%s %s" % (name, Metrics.labels(labels), h[-1]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+try:
+    from opentelemetry import trace as _otel_trace
+
+    tracer = _otel_trace.get_tracer("docker_challenges")
+except ImportError:
+    tracer = None
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times one phase of a container launch into docker_phase_seconds and,
+    when opentelemetry is installed, wraps it in a tracing span.
+    """
+    if tracer is None:
+        with metrics.timer("docker_phase_seconds", phase=name):
+            yield
+        return
+    with tracer.start_as_current_span("docker_challenges.%s" % name) as s:
+        for key, value in attributes.items():
+            s.set_attribute(key, str(value))
+        with metrics.timer("docker_phase_seconds", phase=name):
+            yield
+
+
+_DOCKER_ENDPOINTS = (
+    (re.compile(r"^/containers/(json|create)$"), r"/containers/\1"),
+    (re.compile(r"^/containers/[^/]+/(\w+)$"), r"/containers/{id}/\1"),
+    (re.compile(r"^/containers/[^/]+$"), "/containers/{id}"),
+    (re.compile(r"^/images/(json|create)$"), r"/images/\1"),
+    (re.compile(r"^/images/.+/json$"), "/images/{name}/json"),
+    (re.compile(r"^/networks/create$"), "/networks/create"),
+    (re.compile(r"^/networks/[^/]+$"), "/networks/{id}"),
+)
+
+
+def docker_endpoint(url):
+    """
+    Turns a Docker API URL into a low cardinality label.
+    """
+    path = url.split("?", 1)[0]
+    for pattern, replacement in _DOCKER_ENDPOINTS:
+        if pattern.match(path):
+            return pattern.sub(replacement, path)
+    return path
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("docker_query_start", list()).append(time.monotonic())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("docker_query_start")
+    if not started:
+        return
+    elapsed = time.monotonic() - started.pop()
+    if has_request_context():
+        g.docker_db_time = g.get("docker_db_time", 0.0) + elapsed
+        g.docker_db_queries = g.get("docker_db_queries", 0) + 1
+
+
+PLUGIN_ROUTES = (
+    "/api/v1/container",
+    "/api/v1/docker",
+    "/api/v1/nuke",
+    "/admin/docker_",
+)
+
+
+def _observe_plugin_request(response):
+    if request.url_rule is not None and request.path.startswith(PLUGIN_ROUTES):
+        route = request.url_rule.rule
+        metrics.observe(
+            "docker_route_db_seconds", g.get("docker_db_time", 0.0), route=route
+        )
+        metrics.inc(
+            "docker_route_db_queries_total", g.get("docker_db_queries", 0), route=route
+        )
+        metrics.inc(
+            "docker_route_requests_total",
+            route=route,
+            status=response.status_code,
+        )
+    return response
+
+
 def define_docker_admin(app):
     admin_docker_config = Blueprint(
         "admin_docker_config",
@@ -105,32 +531,45 @@ def define_docker_admin(app):
         static_folder="assets",
     )
 
+    def owner_choices():
+        if is_teams_mode():
+            return db.session.query(Teams.id, Teams.name).order_by(Teams.id).all()
+        return db.session.query(Users.id, Users.name).order_by(Users.id).all()
+
+    def saved_configs(docker_ids):
+        """
+        Drops cached clients and owner lookups of changed configs.
+        """
+        for docker_id in docker_ids:
+            invalidate_docker_client(docker_id)
+        owner_configs.invalidate()
+
     @admin_docker_config.route("/admin/docker_config", methods=["GET", "POST"])
     @admins_only
     def docker_config():
         form = DockerConfigForm()
 
-        if is_teams_mode():
-            owners = Teams.query.all()
-        else:
-            owners = Users.query.all()
+        owners = owner_choices()
         form.owner_id.choices = [(o.id, o.name) for o in owners]
 
         if request.method == "POST":
-            docker = DockerConfig.query.filter_by(
-                owner_id=request.form["owner_id"]
-            ).first()
+            owner_id = int(request.form["owner_id"])
+            docker = DockerConfig.query.filter_by(owner_id=owner_id).first()
             if docker:
                 b = docker
             else:
                 b = DockerConfig()
 
-            b.owner_id = request.form["owner_id"]
+            b.owner_id = owner_id
             b.hostname = request.form["hostname"]
 
-            b.ca_cert = request.files["ca_cert"].stream.read()
-            b.client_cert = request.files["client_cert"].stream.read()
-            b.client_key = request.files["client_key"].stream.read()
+            # An empty upload keeps the stored file, so saving the form does not
+            # wipe certificates the admin did not pick again
+            for field in ("ca_cert", "client_cert", "client_key"):
+                upload = request.files.get(field)
+                data = upload.stream.read() if upload else None
+                if data:
+                    setattr(b, field, data)
             b.tls_enabled = request.form["tls_enabled"] == "True"
             if not b.tls_enabled:
                 b.ca_cert = None
@@ -142,11 +581,35 @@ def define_docker_admin(app):
             )
 
             db.session.add(b)
+
+            host = get_docker_host(b.hostname)
+            try:
+                host.port_range_start = int(request.form["port_range_start"])
+                host.port_range_end = int(request.form["port_range_end"])
+            except (KeyError, ValueError):
+                pass
+            host.pooled = request.form.get("pooled") == "True"
+            try:
+                host.weight = float(request.form["weight"])
+            except (KeyError, ValueError):
+                pass
+            try:
+                host.max_containers = int(request.form["max_containers"]) or None
+            except (KeyError, ValueError):
+                host.max_containers = None
+            try:
+                host.cpu_capacity = float(request.form["cpu_capacity"]) or None
+            except (KeyError, ValueError):
+                host.cpu_capacity = None
+            try:
+                host.memory_capacity = int(request.form["memory_capacity"]) or None
+            except (KeyError, ValueError):
+                host.memory_capacity = None
             db.session.commit()
+            saved_configs([b.id])
+            image_catalog.invalidate(b.hostname)
 
-            docker = DockerConfig.query.filter_by(
-                owner_id=request.form["owner_id"]
-            ).first()
+            docker = b
         else:
             docker = DockerConfig.query.filter_by(id=1).first()
             if docker is None:
@@ -155,7 +618,7 @@ def define_docker_admin(app):
         try:
             repos = get_repositories(docker)
         except Exception:
-            print(traceback.print_exc())
+            log.exception("Could not list images of %s", docker.hostname)
             repos = list()
         if len(repos) == 0:
             form.repositories.choices = [
@@ -168,41 +631,196 @@ def define_docker_admin(app):
         if selected_repos is None:
             selected_repos = list()
 
-        all_configs = []
-        for owner in owners:
-            source_config = DockerConfig.query.filter_by(
-                owner_id=owner.id,
-            ).first()
-            config = dict(
-                owner_id=owner.id,
-                hostname="",
-                tls_enabled=False,
-                ca_cert="",
-                client_cert="",
-                client_key="",
-                repositories=[],
-            )
-            if source_config:
-                config["hostname"] = source_config.hostname
-                config["tls_enabled"] = source_config.tls_enabled
-                config["ca_cert"] = source_config.ca_cert
-                config["client_cert"] = source_config.client_cert
-                config["client_key"] = source_config.client_key
-                config["repositories"] = source_config.repositories
-
-            all_configs.append(config)
+        # One query for every owner's hostname, the certificates stay in the
+        # database. The details of one owner come from docker_config_owner.
+        hostnames = dict(
+            db.session.query(DockerConfig.owner_id, DockerConfig.hostname).filter(
+                DockerConfig.owner_id.isnot(None)
+            )
+        )
 
+        host = DockerHost.query.filter_by(hostname=docker.hostname).first()
         return render_template(
             "docker_config.html",
             config=docker,
-            all_configs=all_configs,
+            host=host
+            or DockerHost(
+                port_range_start=30000, port_range_end=60000, pooled=False, weight=1.0
+            ),
+            owners=[(o.id, o.name, hostnames.get(o.id) or "") for o in owners],
+            hosts=sorted(set(h for h in hostnames.values() if h)),
             form=form,
             repos=selected_repos,
+            settings=[
+                (key, label, docker_setting(key))
+                for key, (label, _) in DOCKER_SETTINGS.items()
+            ],
+            catalog_stats=image_catalog.stats(),
+            pulls=image_puller.report(),
+        )
+
+    @admin_docker_config.route("/admin/docker_config/owners/<int:owner_id>")
+    @admins_only
+    def docker_config_owner(owner_id):
+        """
+        The config of one owner for the config form. Only says whether TLS
+        material is stored, never returns it.
+        """
+        docker = (
+            DockerConfig.query.options(
+                defer(DockerConfig.ca_cert),
+                defer(DockerConfig.client_cert),
+                defer(DockerConfig.client_key),
+            )
+            .filter_by(owner_id=owner_id)
+            .first()
+        )
+        if docker is None:
+            return jsonify({"success": True, "data": None})
+        tls_material = (
+            db.session.query(
+                DockerConfig.ca_cert.isnot(None),
+                DockerConfig.client_cert.isnot(None),
+                DockerConfig.client_key.isnot(None),
+            )
+            .filter_by(id=docker.id)
+            .first()
+        )
+        host = DockerHost.query.filter_by(hostname=docker.hostname).first()
+        data = dict(
+            owner_id=docker.owner_id,
+            hostname=docker.hostname or "",
+            tls_enabled=bool(docker.tls_enabled),
+            has_ca_cert=bool(tls_material[0]),
+            has_client_cert=bool(tls_material[1]),
+            has_client_key=bool(tls_material[2]),
+            repositories=[r for r in (docker.repositories or "").split(",") if r],
+            host=None,
+        )
+        if host is not None:
+            data["host"] = dict(
+                port_range_start=host.port_range_start,
+                port_range_end=host.port_range_end,
+                pooled=bool(host.pooled),
+                weight=host.weight,
+                max_containers=host.max_containers,
+                cpu_capacity=host.cpu_capacity,
+                memory_capacity=host.memory_capacity,
+            )
+        return jsonify({"success": True, "data": data})
+
+    @admin_docker_config.route("/admin/docker_config/assign", methods=["POST"])
+    @admins_only
+    def docker_config_assign():
+        """
+        Points many owners at one host. TLS settings and repositories are
+        copied from the first config already using that hostname, so the
+        host has to be set up for one owner first when it needs TLS.
+        """
+        hostname = request.form.get("hostname", "").strip()
+        owner_ids = list()
+        for value in request.form.getlist("owner_ids"):
+            try:
+                owner_ids.append(int(value))
+            except ValueError:
+                continue
+        if not hostname or not owner_ids:
+            return redirect(url_for("admin_docker_config.docker_config"))
+
+        template = (
+            DockerConfig.query.filter_by(hostname=hostname)
+            .order_by(DockerConfig.id)
+            .first()
         )
+        values = dict(hostname=hostname)
+        if template is not None:
+            values.update(
+                tls_enabled=template.tls_enabled,
+                ca_cert=template.ca_cert,
+                client_cert=template.client_cert,
+                client_key=template.client_key,
+                repositories=template.repositories,
+            )
+
+        changed = list()
+        for i in range(0, len(owner_ids), 500):
+            chunk = owner_ids[i : i + 500]
+            existing = dict(
+                db.session.query(DockerConfig.owner_id, DockerConfig.id).filter(
+                    DockerConfig.owner_id.in_(chunk)
+                )
+            )
+            if existing:
+                DockerConfig.query.filter(
+                    DockerConfig.id.in_(list(existing.values()))
+                ).update(values, synchronize_session=False)
+                changed.extend(existing.values())
+            db.session.bulk_insert_mappings(
+                DockerConfig,
+                [dict(values, owner_id=o) for o in chunk if o not in existing],
+            )
+        get_docker_host(hostname)
+        db.session.commit()
+        saved_configs(changed)
+        image_catalog.invalidate(hostname)
+        log.info("Assigned %s owners to %s", len(owner_ids), hostname)
+        return redirect(url_for("admin_docker_config.docker_config"))
+
+    @admin_docker_config.route("/admin/docker_config/settings", methods=["POST"])
+    @admins_only
+    def docker_settings():
+        for key in DOCKER_SETTINGS:
+            if key in request.form:
+                set_config(key, request.form[key])
+        return redirect(url_for("admin_docker_config.docker_config"))
+
+    @admin_docker_config.route("/admin/docker_config/pull", methods=["GET", "POST"])
+    @admins_only
+    def docker_pull_images():
+        """
+        POST starts pulling every challenge image onto every host, GET
+        reports the progress of the last run.
+        """
+        if request.method == "POST":
+            image_puller.start(current_app._get_current_object())
+            return redirect(url_for("admin_docker_config.docker_config"))
+        return jsonify({"success": True, "data": image_puller.report()})
+
+    @admin_docker_config.route("/admin/docker_config/refresh", methods=["POST"])
+    @admins_only
+    def docker_refresh_catalog():
+        image_catalog.invalidate()
+        return redirect(url_for("admin_docker_config.docker_config"))
 
     app.register_blueprint(admin_docker_config)
 
 
+def define_docker_cli(app):
+    @app.cli.command("docker-pull")
+    @click.option(
+        "--host", "hostnames", multiple=True, help="Only pull onto this host."
+    )
+    @click.argument("images", nargs=-1)
+    def docker_pull(hostnames, images):
+        """
+        Pull challenge images (default: all of them) onto every Docker host.
+        """
+
+        def progress(hostname, image, error):
+            click.echo(
+                "%s %s: %s"
+                % (hostname, image, "failed (%s)" % error if error else "ok")
+            )
+
+        results = image_puller.prepull(
+            list(images) or None, list(hostnames) or None, progress
+        )
+        failed = len([e for e in results.values() if e])
+        click.echo("%s pulls, %s failed" % (len(results), failed))
+        if failed:
+            raise SystemExit(1)
+
+
 def define_docker_status(app):
     admin_docker_status = Blueprint(
         "admin_docker_status",
@@ -214,24 +832,150 @@ def define_docker_status(app):
     @admin_docker_status.route("/admin/docker_status", methods=["GET", "POST"])
     @admins_only
     def docker_admin():
-        docker_tracker = DockerChallengeTracker.query.all()
-        for i in docker_tracker:
-            if is_teams_mode():
-                team = Teams.query.filter_by(id=i.team_id).first()
-                i.team_id = team.name
-                i.owner_id = team.id
-            else:
-                user = Users.query.filter_by(id=i.user_id).first()
-                i.user_id = user.name
-                i.owner_id = user.id
+        args = docker_status_args(request.args)
+        page = docker_status_page(**args)
         return render_template(
             "admin_docker_status.html",
-            dockers=docker_tracker,
+            dockers=page["data"],
+            pagination=page["meta"],
+            filters=dict((k, "" if v is None else v) for k, v in args.items()),
+            teams_mode=is_teams_mode(),
+            provisioning=provisioner.stats(),
+            teardown=teardown_queue.stats(),
+            reaper=cache.get("docker_reaper_report"),
+            idle=idle_monitor.stats(),
+            warm_pools=warm_pool.stats(),
+            breakers=breaker.stats(
+                sorted(set(h for h, in db.session.query(DockerConfig.hostname) if h))
+            ),
         )
 
     app.register_blueprint(admin_docker_status)
 
 
+DOCKER_STATUS_SORTS = ("id", "owner", "image", "age", "instance")
+
+
+def docker_status_args(args):
+    """
+    Reads the paging, sorting and filtering parameters of the status views
+    from a request's query string.
+    """
+
+    def integer(name, default=None):
+        try:
+            return int(args.get(name))
+        except (TypeError, ValueError):
+            return default
+
+    sort = args.get("sort", "id")
+    return {
+        "page": max(integer("page", 1), 1),
+        "per_page": min(max(integer("per_page", 50), 1), 500),
+        "sort": sort if sort in DOCKER_STATUS_SORTS else "id",
+        "order": "desc" if args.get("order") == "desc" else "asc",
+        "owner": args.get("owner") or None,
+        "image": args.get("image") or None,
+        "min_age": integer("min_age"),
+        "max_age": integer("max_age"),
+    }
+
+
+def contains_pattern(value):
+    """
+    LIKE pattern matching value anywhere, with its wildcards escaped by a
+    backslash.
+    """
+    value = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%" + value + "%"
+
+
+def docker_status_page(
+    page=1,
+    per_page=50,
+    sort="id",
+    order="asc",
+    owner=None,
+    image=None,
+    min_age=None,
+    max_age=None,
+):
+    """
+    One page of tracked containers joined with their owner's name, as plain
+    dicts. Ages are in minutes.
+    """
+    if is_teams_mode():
+        Owner = Teams
+        owner_column = DockerChallengeTracker.team_id
+    else:
+        Owner = Users
+        owner_column = DockerChallengeTracker.user_id
+    query = (
+        db.session.query(DockerChallengeTracker, Owner.id, Owner.name)
+        .outerjoin(Owner, Owner.id == owner_column)
+        .options(selectinload(DockerChallengeTracker.ports))
+    )
+
+    now = unix_time(datetime.utcnow())
+    if owner:
+        query = query.filter(Owner.name.ilike(contains_pattern(owner), escape="\\"))
+    if image:
+        query = query.filter(
+            DockerChallengeTracker.docker_image.ilike(
+                contains_pattern(image), escape="\\"
+            )
+        )
+    if min_age is not None:
+        query = query.filter(DockerChallengeTracker.timestamp <= now - min_age * 60)
+    if max_age is not None:
+        query = query.filter(DockerChallengeTracker.timestamp >= now - max_age * 60)
+
+    column = {
+        "id": DockerChallengeTracker.id,
+        "owner": Owner.name,
+        "image": DockerChallengeTracker.docker_image,
+        "age": DockerChallengeTracker.timestamp,
+        "instance": DockerChallengeTracker.instance_id,
+    }[sort]
+    # Ascending age is descending timestamp.
+    if (order == "desc") != (sort == "age"):
+        column = column.desc()
+    total = query.count()
+    rows = (
+        query.order_by(column, DockerChallengeTracker.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+        .all()
+    )
+
+    data = list()
+    for tracker, owner_id, owner_name in rows:
+        data.append(
+            {
+                "id": tracker.id,
+                "owner_id": owner_id,
+                "owner_name": owner_name,
+                "docker_image": tracker.docker_image,
+                "instance_id": tracker.instance_id,
+                "timestamp": tracker.timestamp,
+                "age": (now - int(tracker.timestamp)) // 60,
+                "revert_time": tracker.revert_time,
+                "ports": tracker.port_list,
+                "host": tracker.host,
+            }
+        )
+    return {
+        "data": data,
+        "meta": {
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "pages": (total + per_page - 1) // per_page,
+            "next": page + 1 if page * per_page < total else None,
+        },
+    }
+
+
 kill_container = Namespace("nuke", description="Endpoint to nuke containers")
 
 
@@ -240,36 +984,43 @@ class KillContainerAPI(Resource):
     @admins_only
     def get(self):
         container = request.args.get("container")
-        owner_id = request.args.get("owner_id")
         full = request.args.get("all")
-        docker_tracker = DockerChallengeTracker.query.all()
+        tracked = None
+        if container and container != "null":
+            tracked = DockerChallengeTracker.query.filter_by(
+                instance_id=container
+            ).first()
 
         if full == "true":
-            docker_configs = DockerConfig.query.all()
-            for c in docker_tracker:
-                if is_teams_mode():
-                    owner_id = c.team_id
-                else:
-                    owner_id = c.user_id
-                delete_container(
-                    next(d for d in docker_configs if d.owner_id == owner_id),
-                    c.instance_id,
-                )
-                DockerChallengeTracker.query.filter_by(
-                    instance_id=c.instance_id
-                ).delete()
-                db.session.commit()
+            job = {
+                "id": uuid.uuid4().hex,
+                "status": "running",
+                "total": DockerChallengeTracker.query.count(),
+                "done": 0,
+                "failed": 0,
+                "failures": [],
+            }
+            cache.set("docker_nuke_%s" % job["id"], job, timeout=3600)
+            threading.Thread(
+                target=nuke_all_containers,
+                args=(current_app._get_current_object(), job),
+                name="docker-nuke",
+                daemon=True,
+            ).start()
+            return {"success": True, "data": job}
 
-        elif container != "null" and container in [
-            c.instance_id for c in docker_tracker
-        ]:
-            docker_config = DockerConfig.query.filter_by(
-                owner_id=owner_id,
-            ).first()
-            delete_container(docker_config, container)
-            DockerChallengeTracker.query.filter_by(
-                instance_id=container,
-            ).delete()
+        elif tracked is not None:
+            # Same as the bulk path: without a config there is nothing to
+            # talk to, and a host that fails keeps the row for another try.
+            docker = tracker_docker_config(tracked)
+            client = get_docker_client(docker) if docker is not None else None
+            if not force_delete_container(client, container, tracked.stack_id):
+                return {
+                    "success": False,
+                    "message": "Could not delete %s, the Docker host did not "
+                    "answer." % container,
+                }, 502
+            remove_tracked_container(container)
             db.session.commit()
 
         else:
@@ -277,191 +1028,2463 @@ class KillContainerAPI(Resource):
         return True
 
 
-def do_request(docker, url, headers=None, method="GET", data=None):
-    tls = docker.tls_enabled
-    prefix = "https" if tls else "http"
-    host = docker.hostname
-    URL_TEMPLATE = "%s://%s" % (prefix, host)
-    r = []
-    args = {
-        "headers": headers,
-        "url": f"%s{url}" % URL_TEMPLATE,
-    }
+@kill_container.route("/jobs/<job_id>", methods=["GET"])
+class KillContainerJobAPI(Resource):
+    """
+    Progress of a "Nuke All Containers" run, polled by the status page.
+    """
 
-    if method == "POST":
-        args["data"] = data
-
-    handles = []
-    if tls:
-        ca = docker.ca_cert
-        client = docker.client_cert
-        ckey = docker.client_key
-
-        ca_file = tempfile.NamedTemporaryFile(delete=False)
-        ca_file.write(ca)
-        ca_file.seek(0)
-        client_file = tempfile.NamedTemporaryFile(delete=False)
-        client_file.write(client)
-        client_file.seek(0)
-        key_file = tempfile.NamedTemporaryFile(delete=False)
-        key_file.write(ckey)
-        
-        key_file.seek(0)
-        args["cert"] = (client_file.name, key_file.name)
-        args["verify"] = ca_file.name
-        handles = [ca_file, client_file, key_file]
-
-    if method == "GET":
-        r = requests.get(**args)
-    elif method == "DELETE":
-        r = requests.delete(**args)
-    elif method == "POST":
-        r = requests.post(**args)
-
-    # close files so tempfile can clean them up
-    for x in handles:
-        x.close()
-
-    return r
+    @admins_only
+    def get(self, job_id):
+        job = cache.get("docker_nuke_%s" % job_id)
+        if job is None:
+            return {"success": False, "errors": ["No such job"]}, 404
+        return {"success": True, "data": job}
 
 
-# For the Docker Config Page. Gets the available repositories on the server.
-def get_repositories(docker, tags=False, repos=False):
-    r = do_request(docker, "/images/json?all=1")
-    result = list()
-    for i in r.json():
-        if not i["RepoTags"] is None:
-            if not i["RepoTags"][0].split(":")[0] == "<none>":
-                if repos:
-                    if not i["RepoTags"][0].split(":")[0] in repos:
-                        continue
-                if not tags:
-                    result.append(i["RepoTags"][0].split(":")[0])
-                else:
-                    result.append(i["RepoTags"][0])
-    return list(set(result))
+NUKE_MAX_FAILURES = 50
+NUKE_PROGRESS_EVERY = 25
+NUKE_PROGRESS_INTERVAL = 1.0
 
 
-def get_unavailable_ports(docker):
-    r = do_request(docker, "/containers/json?all=1")
-    result = list()
-    for i in r.json():
-        if not i["Ports"] == []:
-            for p in i["Ports"]:
-                result.append(p["PublicPort"])
-    return result
+def nuke_all_containers(app, job):
+    """
+    Tears down every tracked container, grouped by Docker host, and removes
+    the tracker rows of the deleted containers in one batch.
 
+    The job in the cache only keeps counters and the first failures, and
+    progress is written every NUKE_PROGRESS_EVERY containers or
+    NUKE_PROGRESS_INTERVAL seconds rather than once per container.
+    """
+    with app.app_context():
+        try:
+            rows = DockerChallengeTracker.query.all()
+            targets = resolve_docker_clients(rows)
+            job["total"] = len(rows)
+            removed = list()
+            written = dict(count=0, at=time.monotonic())
 
-def get_required_ports(docker, image):
-    r = do_request(docker, f"/images/{image}/json?all=1")
-    result = r.json()["ContainerConfig"]["ExposedPorts"].keys()
-    return result
+            def progress(index, ok):
+                row = targets[index][0]
+                if ok:
+                    job["done"] += 1
+                    removed.append(row.instance_id)
+                else:
+                    job["failed"] += 1
+                    if len(job["failures"]) < NUKE_MAX_FAILURES:
+                        job["failures"].append(
+                            {
+                                "instance_id": row.instance_id,
+                                "docker_image": row.docker_image,
+                            }
+                        )
+                finished = job["done"] + job["failed"]
+                now = time.monotonic()
+                if (
+                    finished - written["count"] >= NUKE_PROGRESS_EVERY
+                    or now - written["at"] >= NUKE_PROGRESS_INTERVAL
+                ):
+                    written.update(count=finished, at=now)
+                    cache.set("docker_nuke_%s" % job["id"], job, timeout=3600)
 
+            delete_containers_concurrently(targets, progress)
+            remove_tracked_containers(removed)
+            db.session.commit()
+            job["status"] = "done"
+        except Exception as e:
+            db.session.rollback()
+            log.exception("Nuke job %s failed", job["id"])
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            db.session.remove()
+            cache.set("docker_nuke_%s" % job["id"], job, timeout=3600)
 
-def create_container(docker, image, team, portbl):
-    tls = docker.tls_enabled
-    CERT = None
-    if not tls:
-        prefix = 'http'
-    else:
-        prefix = 'https'
-        try:
-            ca = docker.ca_cert
-            client = docker.client_cert
-            ckey = docker.client_key
-            ca_file = tempfile.NamedTemporaryFile(delete=False)
-            ca_file.write(ca)
-            ca_file.seek(0)
-            client_file = tempfile.NamedTemporaryFile(delete=False)
-            client_file.write(client)
-            client_file.seek(0)
-            key_file = tempfile.NamedTemporaryFile(delete=False)
-            key_file.write(ckey)
-            key_file.seek(0)
-            CERT = (client_file.name, key_file.name)
-        except:
-            print(traceback.print_exc())
-            return []
-    host = docker.hostname
-    URL_TEMPLATE = '%s://%s' % (prefix, host)
-
-    needed_ports = get_required_ports(docker, image)
-    team = hashlib.md5(team.encode("utf-8")).hexdigest()[:10]
-    container_name = "%s_%s" % (image.split(":")[0], team)
-    assigned_ports = dict()
-    for i in needed_ports:
-        while True:
-            assigned_port = random.choice(range(30000, 60000))
-            if assigned_port not in portbl:
-                assigned_ports["%s/tcp" % assigned_port] = {}
-                break
-    ports = dict()
-    bindings = dict()
-    tmp_ports = list(assigned_ports.keys())
-    for i in needed_ports:
-        ports[i] = {}
-        bindings[i] = [{"HostPort": tmp_ports.pop()}]
-    headers = {"Content-Type": "application/json"}
-    data = json.dumps(
-        {
-            "Image": image,
-            "ExposedPorts": ports,
-            "HostConfig": {"PortBindings": bindings},
-        }
-    )
-    r = do_request(
-        docker,
-        f"/containers/create?name={container_name}",
-        headers,
-        "POST",
-        data,
-    )
-    result = r.json()
-    r = do_request(
-        docker,
-        f"/containers/{result['Id']}/start",
-        headers,
-        "POST",
-    )
 
-    return result, data
+def _as_bytes(value):
+    if value is None:
+        return b""
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return bytes(value)
 
 
-def delete_container(docker, instance_id):
-    headers = {"Content-Type": "application/json"}
-    do_request(
-        docker,
-        f"/containers/{instance_id}?force=true",
-        headers=headers,
-        method="DELETE",
-    )
-    return True
+class _SSLContextAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that hands a prebuilt SSLContext to its connection pools so
+    the TLS material is parsed once per client instead of once per request.
+    """
 
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
 
-class DockerChallengeType(BaseChallenge):
-    id = "docker"
-    name = "docker"
-    templates = {
-        "create": "/plugins/docker_challenges/assets/create.html",
-        "update": "/plugins/docker_challenges/assets/update.html",
-        "view": "/plugins/docker_challenges/assets/view.html",
-    }
-    scripts = {
-        "create": "/plugins/docker_challenges/assets/create.js",
-        "update": "/plugins/docker_challenges/assets/update.js",
-        "view": "/plugins/docker_challenges/assets/view.js",
-    }
-    route = "/plugins/docker_challenges/assets"
-    blueprint = Blueprint(
-        "docker_challenges",
-        __name__,
-        template_folder="templates",
-        static_folder="assets",
-    )
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
 
-    @staticmethod
-    def update(challenge, request):
-        """
+    def cert_verify(self, conn, url, verify, cert):
+        # Verification is fully described by the SSLContext.
+        if self.ssl_context is None:
+            return super().cert_verify(conn, url, verify, cert)
+
+
+class DockerUnavailable(requests.ConnectionError):
+    """
+    Raised instead of calling a Docker host whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breaker for the Docker API. A host that fails
+    `docker_breaker_threshold` calls in a row (connection errors and
+    timeouts) is cut off for `docker_breaker_cooldown` seconds, after which a
+    single probe call is let through: success closes the breaker again,
+    failure reopens it.
+
+    State lives in each worker process and is copied to the CTFd cache for
+    the admin status page whenever an app context is available.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = dict()
+        self.threshold = DOCKER_SETTINGS["docker_breaker_threshold"][1]
+        self.cooldown = DOCKER_SETTINGS["docker_breaker_cooldown"][1]
+
+    def configure(self):
+        self.threshold = max(1, docker_setting("docker_breaker_threshold"))
+        self.cooldown = max(1, docker_setting("docker_breaker_cooldown"))
+
+    def host(self, hostname):
+        state = self.hosts.get(hostname)
+        if state is None:
+            state = self.hosts[hostname] = {
+                "state": CircuitBreaker.CLOSED,
+                "failures": 0,
+                "opened": None,
+                "probing": False,
+            }
+        return state
+
+    def available(self, hostname):
+        """
+        Whether a call to hostname would currently be let through, without
+        claiming the half-open probe.
+        """
+        with self.lock:
+            state = self.host(hostname)
+            if state["state"] == CircuitBreaker.CLOSED:
+                return True
+            if state["probing"]:
+                return False
+            return time.time() - state["opened"] >= self.cooldown
+
+    def before_call(self, hostname):
+        with self.lock:
+            state = self.host(hostname)
+            if state["state"] == CircuitBreaker.CLOSED:
+                return
+            if not state["probing"] and time.time() - state["opened"] >= self.cooldown:
+                state["state"] = CircuitBreaker.HALF_OPEN
+                state["probing"] = True
+                changed = True
+            else:
+                changed = False
+        if changed:
+            self.publish(hostname)
+            return
+        raise DockerUnavailable("Docker host %s is unavailable" % hostname)
+
+    def success(self, hostname):
+        with self.lock:
+            state = self.host(hostname)
+            changed = state["state"] != CircuitBreaker.CLOSED
+            state.update(
+                state=CircuitBreaker.CLOSED, failures=0, opened=None, probing=False
+            )
+        if changed:
+            log.info("Docker host %s recovered", hostname)
+            self.publish(hostname)
+
+    def failure(self, hostname):
+        with self.lock:
+            state = self.host(hostname)
+            state["failures"] += 1
+            state["probing"] = False
+            changed = state["state"] == CircuitBreaker.HALF_OPEN or (
+                state["state"] == CircuitBreaker.CLOSED
+                and state["failures"] >= self.threshold
+            )
+            if changed:
+                state["state"] = CircuitBreaker.OPEN
+                state["opened"] = time.time()
+        if changed:
+            log.warning("Docker host %s is unhealthy, cutting it off", hostname)
+            metrics.inc("docker_breaker_trips_total", host=hostname)
+            self.publish(hostname)
+
+    def publish(self, hostname):
+        if not has_app_context():
+            return
+        with self.lock:
+            state = dict(self.host(hostname))
+        states = cache.get("docker_breaker_%s" % hostname) or dict()
+        states[metrics.worker] = state
+        cache.set("docker_breaker_%s" % hostname, states, timeout=3600)
+
+    def stats(self, hostnames):
+        """
+        Worst breaker state of every worker for each of hostnames.
+        """
+        order = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+        result = list()
+        for hostname in hostnames:
+            states = list(
+                (cache.get("docker_breaker_%s" % hostname) or dict()).values()
+            )
+            with self.lock:
+                if hostname in self.hosts:
+                    states.append(dict(self.hosts[hostname]))
+            worst = max(
+                states or [{"state": CircuitBreaker.CLOSED, "failures": 0}],
+                key=lambda x: order.index(x["state"]),
+            )
+            result.append(
+                {
+                    "hostname": hostname,
+                    "state": worst["state"],
+                    "failures": worst["failures"],
+                    "opened": worst.get("opened"),
+                }
+            )
+        return result
+
+
+breaker = CircuitBreaker()
+
+
+class DockerClient(object):
+    """
+    Keep-alive connection to a single Docker API host. One client is kept per
+    DockerConfig and rebuilt whenever that config changes.
+    """
+
+    POOL_MAXSIZE = 10
+    IDEMPOTENT = ("GET", "HEAD", "DELETE")
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, docker):
+        self.config_id = docker.id
+        self.hostname = docker.hostname
+        self.fingerprint = DockerClient.fingerprint_for(docker)
+        self.tls = bool(docker.tls_enabled)
+        prefix = "https" if self.tls else "http"
+        self.base_url = "%s://%s" % (prefix, docker.hostname)
+
+        ssl_context = None
+        if self.tls:
+            ssl_context = DockerClient.build_ssl_context(docker)
+        adapter = _SSLContextAdapter(
+            ssl_context=ssl_context,
+            pool_connections=1,
+            pool_maxsize=DockerClient.POOL_MAXSIZE,
+        )
+        self.session = requests.Session()
+        self.session.mount("%s://" % prefix, adapter)
+        self.timeout = (
+            DOCKER_SETTINGS["docker_connect_timeout"][1],
+            DOCKER_SETTINGS["docker_read_timeout"][1],
+        )
+        self.retries = DOCKER_SETTINGS["docker_retries"][1]
+        self.backoff = DOCKER_SETTINGS["docker_retry_backoff"][1]
+
+    def configure(self):
+        """
+        Picks up the timeout and retry settings. Needs an app context, so it
+        is done when the client is handed out rather than on every call.
+        """
+        self.timeout = (
+            docker_setting("docker_connect_timeout"),
+            docker_setting("docker_read_timeout"),
+        )
+        self.retries = max(0, docker_setting("docker_retries"))
+        self.backoff = docker_setting("docker_retry_backoff")
+
+    @staticmethod
+    def fingerprint_for(docker):
+        h = hashlib.sha1()
+        for value in (
+            docker.hostname,
+            str(bool(docker.tls_enabled)),
+            docker.ca_cert,
+            docker.client_cert,
+            docker.client_key,
+        ):
+            h.update(_as_bytes(value))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def build_ssl_context(docker):
+        ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        ctx.load_verify_locations(cadata=_as_bytes(docker.ca_cert).decode())
+        # The ssl module can only read a client keypair from disk, so the
+        # files only live for as long as it takes to load them.
+        with tempfile.TemporaryDirectory() as tmp:
+            cert_path = os.path.join(tmp, "cert.pem")
+            key_path = os.path.join(tmp, "key.pem")
+            for path, value in (
+                (cert_path, docker.client_cert),
+                (key_path, docker.client_key),
+            ):
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(_as_bytes(value))
+            ctx.load_cert_chain(cert_path, key_path)
+        return ctx
+
+    def request(self, url, headers=None, method="GET", data=None):
+        """
+        Calls the Docker API through the host's circuit breaker. Idempotent
+        calls are retried with jittered exponential backoff on connection
+        errors, timeouts and gateway errors; the breaker sees one outcome per
+        call, not one per attempt.
+        """
+        retries = self.retries if method in DockerClient.IDEMPOTENT else 0
+        attempt = 0
+        breaker.before_call(self.hostname)
+        while True:
+            try:
+                r = self.send(url, headers, method, data)
+            except requests.RequestException:
+                if attempt >= retries:
+                    breaker.failure(self.hostname)
+                    raise
+            else:
+                if r.status_code not in DockerClient.RETRY_STATUSES or (
+                    attempt >= retries
+                ):
+                    breaker.success(self.hostname)
+                    return r
+                # Hands the connection back to the pool before the retry.
+                r.close()
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    def send(self, url, headers, method, data):
+        status = "error"
+        start = time.monotonic()
+        try:
+            r = self.session.request(
+                method,
+                f"{self.base_url}{url}",
+                headers=headers,
+                data=data if method == "POST" else None,
+                timeout=self.timeout,
+            )
+            status = r.status_code
+            return r
+        finally:
+            metrics.observe(
+                "docker_api_request_seconds",
+                time.monotonic() - start,
+                method=method,
+                endpoint=docker_endpoint(url),
+                host=self.hostname,
+                status=status,
+            )
+
+    def close(self):
+        self.session.close()
+
+
+_docker_clients = dict()
+_docker_clients_lock = threading.Lock()
+
+
+def get_docker_client(docker):
+    fingerprint = DockerClient.fingerprint_for(docker)
+    with _docker_clients_lock:
+        client = _docker_clients.get(docker.id)
+        if client is None or client.fingerprint != fingerprint:
+            if client is not None:
+                client.close()
+            client = DockerClient(docker)
+            _docker_clients[docker.id] = client
+    if has_app_context():
+        client.configure()
+        breaker.configure()
+    return client
+
+
+def invalidate_docker_client(config_id):
+    with _docker_clients_lock:
+        client = _docker_clients.pop(config_id, None)
+    if client is not None:
+        client.close()
+
+
+def do_request(docker, url, headers=None, method="GET", data=None):
+    return get_docker_client(docker).request(url, headers, method, data)
+
+
+class OwnerConfigCache(object):
+    """
+    In-process owner_id -> DockerConfig map for the player endpoints, which
+    would otherwise look the config up on every request.
+
+    Only column values are kept; each lookup merges them into the current
+    session without a query. Saving configs bumps a version in the shared
+    cache, so the other workers drop their copies on their next lookup.
+    """
+
+    VERSION_KEY = "docker_config_version"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configs = dict()
+        self.version = None
+
+    def sync(self):
+        version = cache.get(self.VERSION_KEY)
+        with self.lock:
+            if version is None or version != self.version:
+                self.configs.clear()
+                self.version = version
+
+    def invalidate(self):
+        cache.set(self.VERSION_KEY, uuid.uuid4().hex, timeout=0)
+        with self.lock:
+            self.configs.clear()
+            self.version = None
+
+    def attach(self, values):
+        if values is None:
+            return None
+        docker = DockerConfig(**values)
+        make_transient_to_detached(docker)
+        return db.session.merge(docker, load=False)
+
+    def remember(self, owner_id, docker):
+        values = None
+        if docker is not None:
+            values = dict(
+                (c.key, getattr(docker, c.key)) for c in DockerConfig.__table__.columns
+            )
+        with self.lock:
+            self.configs[owner_id] = values
+
+    def get_many(self, owner_ids):
+        """
+        Returns {owner_id: DockerConfig or None}, querying only the owners
+        that are not cached yet.
+        """
+        self.sync()
+        result = dict()
+        missing = list()
+        with self.lock:
+            for owner_id in owner_ids:
+                if owner_id in self.configs:
+                    result[owner_id] = self.configs[owner_id]
+                else:
+                    missing.append(owner_id)
+        metrics.inc("docker_owner_config_lookups_total", len(result), result="hit")
+        metrics.inc("docker_owner_config_lookups_total", len(missing), result="miss")
+        result = dict((o, self.attach(v)) for o, v in result.items())
+
+        found = dict()
+        for i in range(0, len(missing), 500):
+            for c in DockerConfig.query.filter(
+                DockerConfig.owner_id.in_(missing[i : i + 500])
+            ):
+                found[c.owner_id] = c
+        for owner_id in missing:
+            self.remember(owner_id, found.get(owner_id))
+            result[owner_id] = found.get(owner_id)
+        return result
+
+    def get(self, owner_id):
+        return self.get_many([owner_id])[owner_id]
+
+
+owner_configs = OwnerConfigCache()
+
+
+class ImageCatalog(object):
+    """
+    Snapshot of the images available on one Docker host, keyed by repository.
+    """
+
+    def __init__(self, images, fetched_at):
+        self.fetched_at = fetched_at
+        self.repositories = dict()
+        self.tags = set()
+        self.image_ids = dict()
+        for i in images:
+            for tag in i.get("RepoTags") or []:
+                repo = tag.rsplit(":", 1)[0]
+                if repo == "<none>":
+                    continue
+                self.repositories.setdefault(repo, set()).add(tag)
+                self.tags.add(tag)
+                self.image_ids[tag] = i.get("Id")
+
+
+class ImageCatalogCache(object):
+    """
+    Per-host cache of ImageCatalog objects so image validation does not have
+    to list every image on the daemon for each launch.
+    """
+
+    def __init__(self):
+        self.catalogs = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.fetch_count = 0
+        self.fetch_time = 0.0
+        self.last_fetch_time = 0.0
+
+    def fetch(self, docker):
+        start = time.monotonic()
+        try:
+            r = do_request(docker, "/images/json?all=1")
+            catalog = ImageCatalog(r.json(), time.time())
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.fetch_count += 1
+            self.fetch_time += elapsed
+            self.last_fetch_time = elapsed
+            self.catalogs[docker.hostname] = catalog
+        return catalog
+
+    def get(self, docker, refresh=False):
+        ttl = docker_setting("docker_catalog_ttl")
+        with self.lock:
+            catalog = self.catalogs.get(docker.hostname)
+            fresh = catalog is not None and time.time() - catalog.fetched_at < ttl
+            if fresh and not refresh:
+                self.hits += 1
+                return catalog
+            self.misses += 1
+        return self.fetch(docker)
+
+    def has_tag(self, docker, tag):
+        return tag in self.get(docker).tags
+
+    def image_id(self, docker, tag):
+        return self.get(docker).image_ids.get(tag)
+
+    def invalidate(self, hostname=None):
+        with self.lock:
+            if hostname is None:
+                self.catalogs.clear()
+            else:
+                self.catalogs.pop(hostname, None)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "fetches": self.fetch_count,
+                "last_fetch_ms": round(self.last_fetch_time * 1000, 2),
+                "avg_fetch_ms": (
+                    round(self.fetch_time * 1000 / self.fetch_count, 2)
+                    if self.fetch_count
+                    else 0
+                ),
+                "hosts": {
+                    host: {
+                        "age": round(now - c.fetched_at, 1),
+                        "repositories": len(c.repositories),
+                        "tags": len(c.tags),
+                    }
+                    for host, c in self.catalogs.items()
+                },
+            }
+
+
+image_catalog = ImageCatalogCache()
+
+
+# For the Docker Config Page. Gets the available repositories on the server.
+def get_repositories(docker, tags=False, repos=False):
+    catalog = image_catalog.get(docker)
+    if isinstance(repos, str):
+        repos = repos.split(",")
+    result = list()
+    for repo, repo_tags in catalog.repositories.items():
+        if repos and repo not in repos:
+            continue
+        if not tags:
+            result.append(repo)
+        else:
+            result.extend(repo_tags)
+    return result
+
+
+def split_image(image):
+    """
+    "repo/name:tag" -> ("repo/name", "tag"). The colon of a registry port
+    is not a tag separator.
+    """
+    name, _, tag = image.rpartition(":")
+    if not name or "/" in tag:
+        return image, "latest"
+    return name, tag
+
+
+class ImagePuller(object):
+    """
+    Pulls challenge images onto Docker hosts.
+
+    Pulls are single-flight per host and image: launches in this or any
+    other worker that find an image missing wait for the pull already
+    running instead of starting their own. Each host gets at most
+    docker_pull_concurrency pulls at a time. Progress read from the
+    /images/create stream is kept in the CTFd cache for the config page.
+    """
+
+    REPORT_KEY = "docker_pull_report"
+    RUNNING_KEY = "docker_pull_running"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = dict()
+        self.host_slots = dict()
+
+    @staticmethod
+    def key(hostname, image):
+        return "docker_pull_%s_%s" % (
+            hostname,
+            hashlib.sha1(image.encode("utf-8")).hexdigest()[:16],
+        )
+
+    def host_slot(self, hostname):
+        with self.lock:
+            slot = self.host_slots.get(hostname)
+            if slot is None:
+                slot = threading.BoundedSemaphore(
+                    max(1, docker_setting("docker_pull_concurrency"))
+                )
+                self.host_slots[hostname] = slot
+            return slot
+
+    def progress(self, hostname, image):
+        return cache.get(ImagePuller.key(hostname, image) + "_progress")
+
+    def set_progress(self, hostname, image, **progress):
+        progress.update(host=hostname, image=image, updated=time.time())
+        cache.set(
+            ImagePuller.key(hostname, image) + "_progress",
+            progress,
+            timeout=ProvisioningQueue.JOB_TIMEOUT,
+        )
+
+    def ensure(self, docker, image):
+        """
+        Makes sure image is on the host of docker, pulling it once if not.
+        """
+        if image_catalog.has_tag(docker, image):
+            return False
+        self.pull(docker, image)
+        return True
+
+    def pull(self, docker, image):
+        """
+        Pulls image onto the host of docker, or waits for the pull of it
+        that is already running.
+        """
+        flight = (docker.hostname, image)
+        with self.lock:
+            future = self.flights.get(flight)
+            leader = future is None
+            if leader:
+                future = self.flights[flight] = Future()
+        if not leader:
+            metrics.inc("docker_image_pulls_coalesced_total", host=docker.hostname)
+            return future.result(timeout=docker_setting("docker_pull_timeout"))
+        try:
+            self.pull_once(docker, image)
+            future.set_result(True)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.flights.pop(flight, None)
+        return True
+
+    def pull_once(self, docker, image):
+        timeout = docker_setting("docker_pull_timeout")
+        lock = ImagePuller.key(docker.hostname, image)
+        if not cache.add(lock, metrics.worker, timeout=timeout):
+            # Another worker is pulling it, wait for that one to finish.
+            metrics.inc("docker_image_pulls_coalesced_total", host=docker.hostname)
+            deadline = time.time() + timeout
+            while cache.get(lock) is not None and time.time() < deadline:
+                time.sleep(1)
+            if image not in image_catalog.get(docker, refresh=True).tags:
+                raise RuntimeError(
+                    "Could not pull %s onto %s" % (image, docker.hostname)
+                )
+            return
+        try:
+            with self.host_slot(docker.hostname):
+                with span("image_pull", host=docker.hostname, image=image):
+                    self.download(docker, image)
+        finally:
+            cache.delete(lock)
+            image_catalog.invalidate(docker.hostname)
+
+    def download(self, docker, image):
+        repo, tag = split_image(image)
+        client = get_docker_client(docker)
+        layers = dict()
+        start = time.monotonic()
+        last = 0
+        self.set_progress(docker.hostname, image, status="pulling", current=0, total=0)
+        breaker.before_call(docker.hostname)
+        try:
+            r = client.session.post(
+                "%s/images/create" % client.base_url,
+                params={"fromImage": repo, "tag": tag},
+                stream=True,
+                timeout=client.timeout,
+            )
+        except requests.RequestException:
+            breaker.failure(docker.hostname)
+            raise
+        breaker.success(docker.hostname)
+        try:
+            with r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if message.get("error"):
+                        raise RuntimeError(message["error"])
+                    layer = message.get("id")
+                    detail = message.get("progressDetail") or dict()
+                    if layer and message.get("status") == "Downloading":
+                        layers[layer] = (
+                            detail.get("current", 0),
+                            detail.get("total", 0),
+                        )
+                    elif layer and message.get("status") in (
+                        "Download complete",
+                        "Pull complete",
+                        "Already exists",
+                    ):
+                        total = layers.get(layer, (0, 0))[1]
+                        layers[layer] = (total, total)
+                    if time.monotonic() - last >= 1:
+                        last = time.monotonic()
+                        self.set_progress(
+                            docker.hostname,
+                            image,
+                            status="pulling",
+                            current=sum(c for c, _ in layers.values()),
+                            total=sum(t for _, t in layers.values()),
+                        )
+        except Exception as e:
+            metrics.inc(
+                "docker_image_pulls_total", host=docker.hostname, status="failed"
+            )
+            self.set_progress(docker.hostname, image, status="failed", error=str(e))
+            raise
+        elapsed = time.monotonic() - start
+        metrics.inc("docker_image_pulls_total", host=docker.hostname, status="done")
+        metrics.observe("docker_image_pull_seconds", elapsed, host=docker.hostname)
+        total = sum(t for _, t in layers.values())
+        self.set_progress(
+            docker.hostname,
+            image,
+            status="done",
+            current=total,
+            total=total,
+            seconds=round(elapsed, 1),
+        )
+
+    def prepull(self, images=None, hostnames=None, progress=None):
+        """
+        Pulls images (default: every DockerChallenge image) onto every
+        configured host (or the given hostnames) in parallel. Calls
+        progress(hostname, image, error) as pulls finish and returns
+        {(hostname, image): error or None}.
+        """
+        if images is None:
+            images = set()
+            for image, stack in db.session.query(
+                DockerChallenge.docker_image, DockerChallenge.stack
+            ):
+                images.update(s["image"] for s in json.loads(stack or "[]"))
+                if image:
+                    images.add(image)
+            images = sorted(images)
+        hosts = dict()
+        for docker in DockerConfig.query.order_by(DockerConfig.id):
+            if not docker.hostname:
+                continue
+            if hostnames and docker.hostname not in hostnames:
+                continue
+            hosts.setdefault(docker.hostname, docker.id)
+        pulls = [(h, i) for h in sorted(hosts) for i in images]
+        report = {"started": time.time(), "finished": None, "pulls": pulls}
+        cache.set(ImagePuller.REPORT_KEY, report, timeout=0)
+
+        app = current_app._get_current_object()
+        results = dict()
+        workers = max(1, len(hosts) * docker_setting("docker_pull_concurrency"))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="docker-pull"
+        ) as pool:
+            futures = dict(
+                (pool.submit(self.pull_in_context, app, hosts[h], i), (h, i))
+                for h, i in pulls
+            )
+            for future in as_completed(futures):
+                hostname, image = futures[future]
+                error = future.exception()
+                results[(hostname, image)] = str(error) if error else None
+                if progress is not None:
+                    progress(hostname, image, results[(hostname, image)])
+        report["finished"] = time.time()
+        cache.set(ImagePuller.REPORT_KEY, report, timeout=0)
+        return results
+
+    def pull_in_context(self, app, docker_id, image):
+        with app.app_context():
+            try:
+                docker = DockerConfig.query.filter_by(id=docker_id).first()
+                self.pull(docker, image)
+            finally:
+                db.session.remove()
+
+    def start(self, app):
+        """
+        Runs prepull() on a background thread unless one is running already
+        in any worker. Returns whether it was started.
+        """
+        timeout = docker_setting("docker_pull_timeout")
+        if not cache.add(ImagePuller.RUNNING_KEY, metrics.worker, timeout=timeout):
+            return False
+
+        def run():
+            with app.app_context():
+                try:
+                    self.prepull()
+                except Exception:
+                    log.exception("Image pre-pull failed")
+                finally:
+                    cache.delete(ImagePuller.RUNNING_KEY)
+                    db.session.remove()
+
+        threading.Thread(target=run, name="docker-prepull", daemon=True).start()
+        return True
+
+    def report(self):
+        report = cache.get(ImagePuller.REPORT_KEY)
+        if report is None:
+            return None
+        return dict(
+            started=report["started"],
+            finished=report["finished"],
+            pulls=[
+                self.progress(h, i) or dict(host=h, image=i, status="queued")
+                for h, i in report["pulls"]
+            ],
+        )
+
+
+image_puller = ImagePuller()
+
+
+def get_docker_host(hostname):
+    host = DockerHost.query.filter_by(hostname=hostname).first()
+    if host is None:
+        host = DockerHost(
+            hostname=hostname,
+            port_range_start=30000,
+            port_range_end=60000,
+        )
+        db.session.add(host)
+    return host
+
+
+class PortAllocator(object):
+    """
+    Hands out host ports from the DockerPortLease table.
+
+    Leases are added to the current session and become visible to other
+    workers only when the caller commits them together with the matching
+    DockerChallengeTracker row. A port already leased elsewhere fails the
+    primary key on flush, so picking random candidates is O(1) on average
+    while the range is not close to full.
+    """
+
+    MAX_ATTEMPTS = 100
+
+    def allocate(self, docker, count, instance_id=None):
+        host = DockerHost.query.filter_by(hostname=docker.hostname).first()
+        low = (host and host.port_range_start) or 30000
+        high = (host and host.port_range_end) or 60000
+        now = unix_time(datetime.utcnow())
+        leases = list()
+        attempts = 0
+        while len(leases) < count:
+            attempts += 1
+            if attempts > PortAllocator.MAX_ATTEMPTS:
+                raise RuntimeError(
+                    "No free ports left on %s between %s and %s"
+                    % (docker.hostname, low, high)
+                )
+            port = random.randint(low, high)
+            if any(lease.port == port for lease in leases):
+                continue
+            lease = DockerPortLease(
+                host=docker.hostname,
+                port=port,
+                instance_id=instance_id,
+                timestamp=now,
+            )
+            try:
+                with db.session.begin_nested():
+                    db.session.add(lease)
+            except IntegrityError:
+                continue
+            leases.append(lease)
+        return leases
+
+    def release(self, instance_id):
+        DockerPortLease.query.filter_by(instance_id=instance_id).delete(
+            synchronize_session=False
+        )
+
+    def reconcile(self, docker):
+        """
+        Syncs the leases of one host with the ports its daemon actually
+        publishes. Ports used by containers the plugin does not know about are
+        leased to them, leases of vanished containers are dropped.
+        """
+        r = do_request(docker, "/containers/json?all=1")
+        published = dict()
+        for c in r.json():
+            for p in c.get("Ports") or []:
+                if p.get("PublicPort"):
+                    published[int(p["PublicPort"])] = c["Id"]
+        tracked = set(
+            i for (i,) in db.session.query(DockerChallengeTracker.instance_id)
+        )
+        tracked.update(i for (i,) in db.session.query(DockerWarmContainer.instance_id))
+        leases = DockerPortLease.query.filter_by(host=docker.hostname).all()
+        leased = set()
+        for lease in leases:
+            leased.add(lease.port)
+            if lease.port not in published and lease.instance_id not in tracked:
+                db.session.delete(lease)
+        now = unix_time(datetime.utcnow())
+        for port, instance_id in published.items():
+            if port not in leased:
+                db.session.add(
+                    DockerPortLease(
+                        host=docker.hostname,
+                        port=port,
+                        instance_id=instance_id,
+                        timestamp=now,
+                    )
+                )
+        db.session.commit()
+
+
+port_allocator = PortAllocator()
+
+
+class HostScheduler(object):
+    """
+    Chooses the Docker host for a new container.
+
+    In "owner" mode every team/user uses the DockerConfig assigned to them on
+    the config page. In "pool" mode containers are spread over the hosts
+    marked as pooled: the host with the fewest containers per unit of weight
+    wins, hosts at max_containers or without free ports are skipped, and
+    with affinity enabled a team/user stays on the host already running
+    their other containers.
+    """
+
+    def pool(self):
+        """
+        The pooled hosts with one DockerConfig each to reach them with.
+        """
+        hosts = dict((h.hostname, h) for h in DockerHost.query.filter_by(pooled=True))
+        configs = dict()
+        if hosts:
+            for c in (
+                DockerConfig.query.filter(DockerConfig.hostname.in_(list(hosts)))
+                .order_by(DockerConfig.id)
+                .all()
+            ):
+                configs.setdefault(c.hostname, c)
+        return [(hosts[name], c) for name, c in configs.items()]
+
+    def load(self):
+        """
+        Returns (containers per hostname, leased ports per hostname).
+        """
+        containers = dict(
+            db.session.query(DockerConfig.hostname, db.func.count())
+            .join(
+                DockerChallengeTracker,
+                DockerChallengeTracker.docker_config_id == DockerConfig.id,
+            )
+            .group_by(DockerConfig.hostname)
+        )
+        leases = dict(
+            db.session.query(DockerPortLease.host, db.func.count()).group_by(
+                DockerPortLease.host
+            )
+        )
+        return containers, leases
+
+    def place(self, owner_id):
+        owned = owner_configs.get(owner_id)
+        if docker_setting("docker_scheduler") != "pool":
+            return owned
+
+        pool = self.pool()
+        if not pool:
+            return owned
+        if docker_setting("docker_scheduler_affinity"):
+            if is_teams_mode():
+                current = DockerChallengeTracker.query.filter_by(team_id=owner_id)
+            else:
+                current = DockerChallengeTracker.query.filter_by(user_id=owner_id)
+            current = current.filter(
+                DockerChallengeTracker.docker_config_id.isnot(None)
+            ).first()
+            if current is not None:
+                docker = DockerConfig.query.filter_by(
+                    id=current.docker_config_id
+                ).first()
+                if docker is not None and any(
+                    docker.hostname == h.hostname for h, _ in pool
+                ):
+                    return docker
+
+        containers, leases = self.load()
+        best = None
+        for host, docker in pool:
+            count = containers.get(host.hostname, 0)
+            if host.max_containers and count >= host.max_containers:
+                continue
+            low = host.port_range_start or 30000
+            high = host.port_range_end or 60000
+            free_ports = high - low + 1 - leases.get(host.hostname, 0)
+            if free_ports <= 0:
+                continue
+            score = (count / (host.weight or 1.0), -free_ports)
+            if best is None or score < best[0]:
+                best = (score, docker)
+        return best[1] if best else None
+
+
+host_scheduler = HostScheduler()
+
+
+def reconcile_ports():
+    seen = set()
+    for docker in DockerConfig.query.all():
+        if not docker.hostname or docker.hostname in seen:
+            continue
+        seen.add(docker.hostname)
+        try:
+            port_allocator.reconcile(docker)
+        except Exception:
+            db.session.rollback()
+            log.exception("Could not reconcile ports of %s", docker.hostname)
+
+
+def mark_owners_changed(owner_ids):
+    """
+    Queues a bump of the status version of the given teams/users. The bump
+    happens once the current session commits, so a version is never paired
+    with data from before the change.
+    """
+    changed = db.session.info.setdefault("docker_changed_owners", set())
+    changed.update(str(o) for o in owner_ids if o is not None)
+
+
+def bump_owner_status_version(owner_id):
+    cache.set("docker_status_version_%s" % owner_id, uuid.uuid4().hex, timeout=0)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_owner_status_versions(session):
+    for owner_id in session.info.pop("docker_changed_owners", ()):
+        bump_owner_status_version(owner_id)
+
+
+def owner_status_version(owner_id):
+    key = "docker_status_version_%s" % owner_id
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, timeout=0)
+    return version
+
+
+def _tracked_owners(query):
+    return [
+        team_id or user_id
+        for team_id, user_id in query.with_entities(
+            DockerChallengeTracker.team_id, DockerChallengeTracker.user_id
+        )
+    ]
+
+
+def remove_tracked_container(instance_id):
+    """
+    Deletes the tracker row of a container and releases its port leases.
+    The caller is responsible for committing.
+    """
+    query = DockerChallengeTracker.query.filter_by(instance_id=instance_id)
+    mark_owners_changed(_tracked_owners(query))
+    DockerContainerPort.query.filter(
+        DockerContainerPort.tracker_id.in_(
+            query.with_entities(DockerChallengeTracker.id)
+        )
+    ).delete(synchronize_session=False)
+    query.delete(synchronize_session=False)
+    port_allocator.release(instance_id)
+
+
+def remove_tracked_containers(instance_ids, chunk_size=500):
+    """
+    Batched remove_tracked_container. The caller is responsible for
+    committing.
+    """
+    instance_ids = list(instance_ids)
+    for i in range(0, len(instance_ids), chunk_size):
+        chunk = instance_ids[i : i + chunk_size]
+        query = DockerChallengeTracker.query.filter(
+            DockerChallengeTracker.instance_id.in_(chunk)
+        )
+        mark_owners_changed(_tracked_owners(query))
+        DockerContainerPort.query.filter(
+            DockerContainerPort.tracker_id.in_(
+                query.with_entities(DockerChallengeTracker.id)
+            )
+        ).delete(synchronize_session=False)
+        query.delete(synchronize_session=False)
+        DockerPortLease.query.filter(DockerPortLease.instance_id.in_(chunk)).delete(
+            synchronize_session=False
+        )
+
+
+def resolve_docker_configs(rows):
+    """
+    Pairs every tracker row with the DockerConfig of the daemon running its
+    container, using at most two DockerConfig queries. Rows placed before
+    containers were scheduled fall back to their owner's config, rows
+    without any config get None.
+    """
+    teams = is_teams_mode()
+    config_ids = list(set(r.docker_config_id for r in rows if r.docker_config_id))
+    owners = list(
+        set(r.team_id if teams else r.user_id for r in rows if not r.docker_config_id)
+    )
+    by_id = dict()
+    for i in range(0, len(config_ids), 500):
+        for c in DockerConfig.query.filter(
+            DockerConfig.id.in_(config_ids[i : i + 500])
+        ):
+            by_id[c.id] = c
+    by_owner = owner_configs.get_many(owners)
+    result = list()
+    for row in rows:
+        if row.docker_config_id:
+            docker = by_id.get(row.docker_config_id)
+        else:
+            docker = by_owner.get(row.team_id if teams else row.user_id)
+        result.append((row, docker))
+    return result
+
+
+def tracker_docker_config(row):
+    return resolve_docker_configs([row])[0][1]
+
+
+def resolve_docker_clients(rows):
+    """
+    Pairs every tracker row with the client of the Docker host running its
+    container. Rows without a config get None.
+    """
+    return [
+        (row, get_docker_client(docker) if docker else None)
+        for row, docker in resolve_docker_configs(rows)
+    ]
+
+
+def force_delete_container(client, instance_id, stack_id=None):
+    if client is None:
+        # Nothing to talk to, just forget about it.
+        return True
+    try:
+        r = client.request(f"/containers/{instance_id}?force=true", method="DELETE")
+    except requests.RequestException:
+        return False
+    if r.status_code < 400 or r.status_code == 404:
+        metrics.inc("docker_containers_deleted_total", host=client.hostname)
+        return force_delete_stack(client, stack_id)
+    return False
+
+
+def stack_containers(client, stack_id):
+    """
+    Ids of all containers of a stack, the exposed one included.
+    """
+    label = json.dumps({"label": ["%s=%s" % (STACK_LABEL, stack_id)]})
+    r = client.request("/containers/json?all=1&filters=%s" % quote(label))
+    r.raise_for_status()
+    return [c["Id"] for c in r.json()]
+
+
+def force_delete_stack(client, stack_id):
+    """
+    Force deletes the containers and the network of a stack, found by their
+    label. Only talks to Docker, like force_delete_container.
+    """
+    if client is None or not stack_id:
+        return True
+    try:
+        for instance_id in stack_containers(client, stack_id):
+            d = client.request(f"/containers/{instance_id}?force=true", method="DELETE")
+            if d.status_code >= 400 and d.status_code != 404:
+                return False
+            metrics.inc("docker_containers_deleted_total", host=client.hostname)
+        r = client.request(f"/networks/{stack_network(stack_id)}", method="DELETE")
+    except requests.RequestException:
+        return False
+    return r.status_code < 400 or r.status_code == 404
+
+
+def run_per_host(calls, callback=None):
+    """
+    Runs (client, func, args) calls with func(*args). Hosts are worked on in
+    parallel with at most docker_host_concurrency calls in flight per host.
+    callback(index, result) is called from this thread as calls finish.
+    Returns the results in the order of calls.
+    """
+    per_host = docker_setting("docker_host_concurrency")
+    pools = dict()
+    futures = dict()
+    try:
+        for index, (client, func, args) in enumerate(calls):
+            key = client.base_url if client else None
+            if key not in pools:
+                pools[key] = ThreadPoolExecutor(
+                    max_workers=per_host, thread_name_prefix="docker-host"
+                )
+            futures[pools[key].submit(func, *args)] = index
+        results = [None] * len(calls)
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            if callback is not None:
+                callback(index, results[index])
+        return results
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=False)
+
+
+def delete_containers_concurrently(targets, callback=None):
+    """
+    Force deletes the containers of (row, client) pairs with run_per_host.
+    callback(index, ok) is called as deletes finish. Returns a list of
+    booleans in the order of targets.
+    """
+    return run_per_host(
+        [
+            (client, force_delete_container, (client, row.instance_id, row.stack_id))
+            for row, client in targets
+        ],
+        callback,
+    )
+
+
+class PeriodicTask(object):
+    """
+    Runs func every `interval_key` seconds in a daemon thread with an app
+    context. Unless the task is not exclusive, a short lived cache key makes
+    sure only one worker process runs it per interval. An interval of 0
+    disables the task.
+    """
+
+    def __init__(self, app, name, func, interval_key, exclusive=True):
+        self.app = app
+        self.name = name
+        self.func = func
+        self.interval_key = interval_key
+        self.exclusive = exclusive
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.loop, name="docker-%s" % self.name, daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def interval(self):
+        with self.app.app_context():
+            return docker_setting(self.interval_key)
+
+    def loop(self):
+        while not self.stopped.is_set():
+            interval = self.interval()
+            if interval <= 0:
+                self.stopped.wait(60)
+                continue
+            if self.stopped.wait(interval):
+                break
+            self.run_once(interval)
+
+    def run_once(self, interval=None):
+        with self.app.app_context():
+            if (
+                self.exclusive
+                and interval
+                and not cache.add(
+                    "docker_task_%s" % self.name, 1, timeout=max(interval - 1, 1)
+                )
+            ):
+                return None
+            try:
+                return self.func()
+            except Exception:
+                log.exception("Background task %s failed", self.name)
+            finally:
+                db.session.remove()
+
+
+# Exposed ports per image ID. Image IDs are content addressed, so a re-pushed
+# tag resolves to a new ID and never hits a stale entry.
+_image_ports = dict()
+_image_ports_lock = threading.Lock()
+
+
+def inspect_required_ports(docker, image):
+    r = do_request(docker, f"/images/{image}/json")
+    info = r.json()
+    # Newer engines no longer fill in ContainerConfig for built images.
+    config = info.get("ContainerConfig") or dict()
+    exposed = config.get("ExposedPorts")
+    if not exposed:
+        exposed = (info.get("Config") or dict()).get("ExposedPorts")
+    result = tuple((exposed or dict()).keys())
+    with _image_ports_lock:
+        _image_ports[info["Id"]] = result
+    return info["Id"], result
+
+
+def get_required_ports(docker, image):
+    image_id = image_catalog.image_id(docker, image)
+    with _image_ports_lock:
+        result = _image_ports.get(image_id)
+    if result is not None:
+        return result
+    return inspect_required_ports(docker, image)[1]
+
+
+def warm_image_metadata(image):
+    """
+    Pre-populates the exposed port cache for an image on every configured
+    host, on a background thread so saving a challenge never waits for a
+    Docker host. Failures are not fatal, the ports are looked up on launch
+    instead.
+    """
+    if not image:
+        return
+    threading.Thread(
+        target=_warm_image_metadata,
+        args=(current_app._get_current_object(), image),
+        name="docker-warm-metadata",
+        daemon=True,
+    ).start()
+
+
+def _warm_image_metadata(app, image):
+    with app.app_context():
+        try:
+            # One config per host, so only those TLS blobs are loaded.
+            first = [
+                i
+                for i, in db.session.query(db.func.min(DockerConfig.id))
+                .filter(DockerConfig.hostname.isnot(None), DockerConfig.hostname != "")
+                .group_by(DockerConfig.hostname)
+            ]
+            for docker in DockerConfig.query.filter(DockerConfig.id.in_(first)):
+                if not breaker.available(docker.hostname):
+                    continue
+                try:
+                    image_id = image_catalog.image_id(docker, image)
+                    if image_id is None:
+                        continue
+                    with _image_ports_lock:
+                        cached = image_id in _image_ports
+                    if not cached:
+                        inspect_required_ports(docker, image)
+                except Exception:
+                    log.exception("Could not warm metadata of %s", image)
+        finally:
+            db.session.remove()
+
+
+PLUGIN_LABEL = "ctfd.docker_challenges"
+STACK_LABEL = "ctfd.docker_challenges.stack"
+
+
+def container_spec(docker, image, bindings=None, resources=None, stack=None):
+    """
+    Builds the create body of a container. Port leases for it are left in
+    the session for the caller to commit with the tracker row; bindings
+    skips the allocation (a reset passes the PortBindings of the container
+    it replaces, stack services that are not exposed pass {}). stack is
+    (stack_id, service) to put the container on the stack's network.
+    Returns (data, leases).
+    """
+    if bindings is None:
+        needed_ports = get_required_ports(docker, image)
+        with span("allocate_ports", host=docker.hostname):
+            leases = port_allocator.allocate(docker, len(needed_ports))
+        bindings = dict()
+        for i, lease in zip(needed_ports, leases):
+            bindings[i] = [{"HostPort": str(lease.port)}]
+    else:
+        leases = list()
+    if resources is None:
+        resources = challenge_resources(image)
+    host_config = resource_host_config(resources)
+    host_config["PortBindings"] = bindings
+    data = {
+        "Image": image,
+        "ExposedPorts": dict((i, {}) for i in bindings),
+        "Labels": {PLUGIN_LABEL: "1"},
+        "HostConfig": host_config,
+    }
+    if stack is not None:
+        stack_id, service = stack
+        network = stack_network(stack_id)
+        data["Labels"][STACK_LABEL] = stack_id
+        data["Env"] = service["env"]
+        data["HostConfig"]["NetworkMode"] = network
+        data["NetworkingConfig"] = {
+            "EndpointsConfig": {network: {"Aliases": [service["alias"]]}}
+        }
+    return json.dumps(data), leases
+
+
+def run_container(docker, name, data):
+    """
+    Creates and starts a container from a container_spec body. Only talks
+    to Docker, so it can run on a thread without an app context.
+    """
+    headers = {"Content-Type": "application/json"}
+    image = json.loads(data)["Image"]
+    with span("container_create", host=docker.hostname, image=image):
+        r = do_request(
+            docker,
+            f"/containers/create?name={name}",
+            headers,
+            "POST",
+            data,
+        )
+        result = r.json()
+    if "Id" not in result:
+        raise RuntimeError(
+            "Could not create %s: %s" % (name, result.get("message", r.status_code))
+        )
+    metrics.inc("docker_containers_created_total", host=docker.hostname)
+    with span("container_start", host=docker.hostname, image=image):
+        r = do_request(
+            docker,
+            f"/containers/{result['Id']}/start",
+            headers,
+            "POST",
+        )
+    # 304: already started
+    if r.status_code not in (204, 304):
+        force_delete_container(get_docker_client(docker), result["Id"])
+        raise RuntimeError("Could not start %s: %s" % (name, r.text or r.status_code))
+    return result
+
+
+def create_container(docker, image, team, bindings=None):
+    """
+    Creates and starts a container. The port leases for it are left in the
+    session for the caller to commit with the tracker row. A reset passes
+    the PortBindings of the container it replaces, which keep their leases.
+    """
+    data, leases = container_spec(docker, image, bindings)
+    result = run_container(docker, container_name(image, team), data)
+    for lease in leases:
+        lease.instance_id = result["Id"]
+    return result, data
+
+
+def stack_network(stack_id):
+    return "ctfd_stack_%s" % stack_id
+
+
+def create_stack(docker, image, team, services):
+    """
+    Creates the private network of a stack and creates and starts all of its
+    containers concurrently on it. Only the exposed service, the container
+    the tracker row points at, publishes ports; the others are reachable
+    from it by their alias. The create bodies are built before anything is
+    made on the host, and if the network or any container fails the whole
+    stack and its port leases are removed again. Returns (result, data,
+    stack_id) of the exposed container.
+    """
+    stack_id = uuid.uuid4().hex[:16]
+    # The limits of the challenge apply to every container of the stack.
+    resources = challenge_resources(image)
+    name = container_name(image, team)
+    specs = list()
+    try:
+        for service in services:
+            exposed = service.get("expose")
+            data, leases = container_spec(
+                docker,
+                service["image"],
+                bindings=None if exposed else dict(),
+                resources=resources,
+                stack=(stack_id, service),
+            )
+            specs.append(
+                (
+                    name if exposed else "%s_%s" % (name, service["alias"]),
+                    data,
+                    leases,
+                )
+            )
+        main = next(i for i, s in enumerate(services) if s.get("expose"))
+
+        r = do_request(
+            docker,
+            "/networks/create",
+            {"Content-Type": "application/json"},
+            "POST",
+            json.dumps(
+                {
+                    "Name": stack_network(stack_id),
+                    "CheckDuplicate": True,
+                    "Labels": {PLUGIN_LABEL: "1", STACK_LABEL: stack_id},
+                }
+            ),
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(
+                "Could not create the network of %s: %s" % (image, r.text)
+            )
+
+        with span("stack_create", host=docker.hostname, image=image):
+            with ThreadPoolExecutor(
+                max_workers=len(specs), thread_name_prefix="docker-stack"
+            ) as pool:
+                futures = [
+                    pool.submit(run_container, docker, spec_name, data)
+                    for spec_name, data, _ in specs
+                ]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+    except Exception:
+        force_delete_stack(get_docker_client(docker), stack_id)
+        for _, _, leases in specs:
+            for lease in leases:
+                db.session.delete(lease)
+        raise
+    result = futures[main].result()
+    for lease in specs[main][2]:
+        lease.instance_id = result["Id"]
+    return result, specs[main][1], stack_id
+
+
+def delete_container(docker, instance_id, stack_id=None):
+    headers = {"Content-Type": "application/json"}
+    do_request(
+        docker,
+        f"/containers/{instance_id}?force=true",
+        headers=headers,
+        method="DELETE",
+    )
+    metrics.inc("docker_containers_deleted_total", host=docker.hostname)
+    if stack_id and not force_delete_stack(get_docker_client(docker), stack_id):
+        raise RuntimeError("Could not delete the stack of %s" % instance_id)
+    return True
+
+
+class ProvisioningQueue(object):
+    """
+    Runs container launches on a bounded thread pool instead of the web
+    worker. Job state is kept in the CTFd cache so any worker process can
+    answer a status poll. Jobs wait in a queue per Docker host and are only
+    handed to the pool while their host has fewer than
+    docker_host_concurrency jobs running, so a burst of launches cannot
+    flood a single daemon and a slow host never ties up the pool's threads.
+
+    The teardown queue is a second instance with its own workers and stats.
+    """
+
+    JOB_TIMEOUT = 3600
+    INFLIGHT_TIMEOUT = 600
+
+    def __init__(self, name="provision", workers_key="docker_provision_workers"):
+        self.name = name
+        self.workers_key = workers_key
+        self.app = None
+        self.executor = None
+        self.lock = threading.Lock()
+        self.host_queues = dict()
+        self.host_running = dict()
+        self.host_limits = dict()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.last_latency = 0.0
+        self.last_error = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=docker_setting(self.workers_key),
+                    thread_name_prefix="docker-%s" % self.name,
+                )
+            return self.executor
+
+    def dispatch(self, hostname):
+        """
+        Hands queued jobs of hostname to the pool while the host has free
+        slots.
+        """
+        executor = self.get_executor()
+        ready = list()
+        with self.lock:
+            queue = self.host_queues.get(hostname)
+            while queue and (
+                self.host_running.get(hostname, 0) < self.host_limits[hostname]
+            ):
+                self.host_running[hostname] = self.host_running.get(hostname, 0) + 1
+                ready.append(queue.popleft())
+        for job, func, kwargs in ready:
+            executor.submit(self.run, hostname, job, func, kwargs)
+
+    def save(self, job):
+        job["updated"] = time.time()
+        cache.set("docker_job_%s" % job["id"], job, timeout=self.JOB_TIMEOUT)
+        if job["owner_id"] is not None:
+            # Wakes up the owner's event stream.
+            bump_owner_status_version(job["owner_id"])
+
+    def owner_jobs(self, owner_id):
+        """
+        The latest job of each image launched by owner_id.
+        """
+        jobs = dict()
+        for image, job_id in (
+            cache.get("docker_owner_jobs_%s" % owner_id) or dict()
+        ).items():
+            job = self.job(job_id)
+            if job is not None:
+                jobs[image] = job
+        return jobs
+
+    def job(self, job_id):
+        return cache.get("docker_job_%s" % job_id)
+
+    @staticmethod
+    def public(job):
+        """
+        The fields of a job players may see. The raw error can name internal
+        Docker hosts, they only get the message meant for them.
+        """
+        return dict((k, v) for k, v in job.items() if k not in ("error", "key"))
+
+    def inflight(self, key):
+        """
+        The queued or running job submitted under key, if there is one.
+        """
+        job_id = cache.get("docker_inflight_%s" % key)
+        job = self.job(job_id) if job_id else None
+        if job is not None and job["status"] in ("queued", "running"):
+            return job
+        return None
+
+    def submit(self, func, hostname, key=None, **kwargs):
+        """
+        Queues func(**kwargs). Submissions sharing a key are coalesced: while
+        a job for key is in flight, that job is returned instead of starting
+        another one.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "owner_id": kwargs.get("owner_id"),
+            "image": kwargs.get("image"),
+            "key": key,
+            "error": None,
+            "created": time.time(),
+        }
+        if key is not None:
+            inflight = "docker_inflight_%s" % key
+            if not cache.add(inflight, job["id"], timeout=self.INFLIGHT_TIMEOUT):
+                current = self.inflight(key)
+                if current is not None:
+                    metrics.inc("docker_provision_coalesced_total")
+                    return current
+                cache.set(inflight, job["id"], timeout=self.INFLIGHT_TIMEOUT)
+        if job["owner_id"] is not None and job["image"] is not None:
+            key = "docker_owner_jobs_%s" % job["owner_id"]
+            jobs = cache.get(key) or dict()
+            jobs[job["image"]] = job["id"]
+            cache.set(key, jobs, timeout=self.JOB_TIMEOUT)
+        self.save(job)
+        limit = max(1, docker_setting("docker_host_concurrency"))
+        with self.lock:
+            self.queued += 1
+            self.host_limits[hostname] = limit
+            self.host_queues.setdefault(hostname, deque()).append((job, func, kwargs))
+        self.dispatch(hostname)
+        return job
+
+    def run(self, hostname, job, func, kwargs):
+        try:
+            self.execute(job, func, kwargs)
+        finally:
+            with self.lock:
+                self.host_running[hostname] -= 1
+            self.dispatch(hostname)
+
+    def execute(self, job, func, kwargs):
+        started = time.time()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        job["status"] = "running"
+        with self.app.app_context():
+            self.save(job)
+            try:
+                with span(self.name):
+                    func(**kwargs)
+                job["status"] = "done"
+            except Exception as e:
+                db.session.rollback()
+                log.exception("Docker %s job %s failed", self.name, job["id"])
+                metrics.inc("docker_%s_failures_total" % self.name)
+                job["status"] = "failed"
+                job["error"] = str(e)
+                with self.lock:
+                    self.last_error = "%s: %s" % (job.get("image") or job["id"], e)
+                if isinstance(e, AdmissionError):
+                    job["message"] = str(e)
+            finally:
+                db.session.remove()
+            self.save(job)
+            if job["key"] is not None:
+                cache.delete("docker_inflight_%s" % job["key"])
+        finished = time.time()
+        with self.lock:
+            self.running -= 1
+            if job["status"] == "done":
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.wait_time += started - job["created"]
+            self.run_time += finished - started
+            self.last_latency = finished - job["created"]
+
+    def stats(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": (
+                    round(self.wait_time * 1000 / finished, 2) if finished else 0
+                ),
+                "avg_provision_ms": (
+                    round(self.run_time * 1000 / finished, 2) if finished else 0
+                ),
+                "last_latency_ms": round(self.last_latency * 1000, 2),
+                "last_error": self.last_error,
+            }
+
+
+provisioner = ProvisioningQueue()
+teardown_queue = ProvisioningQueue("teardown", "docker_teardown_workers")
+
+
+def teardown_container(instance_id):
+    """
+    Force deletes the container of a solved challenge and forgets it. Runs
+    on the teardown queue, retrying with backoff; the tracker row and the
+    port leases stay until the container is really gone.
+    """
+    row = DockerChallengeTracker.query.filter_by(instance_id=instance_id).first()
+    if row is None:
+        return
+    docker = tracker_docker_config(row)
+    client = get_docker_client(docker) if docker is not None else None
+    retries = docker_setting("docker_teardown_retries")
+    attempt = 0
+    while not force_delete_container(client, instance_id, row.stack_id):
+        if attempt >= retries:
+            raise RuntimeError("Could not delete container %s" % instance_id)
+        time.sleep(2**attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+    remove_tracked_container(instance_id)
+    db.session.commit()
+
+
+def rename_container(docker, instance_id, name):
+    do_request(
+        docker,
+        f"/containers/{instance_id}/rename?name={name}",
+        method="POST",
+    )
+
+
+def container_name(image, owner_name):
+    owner = hashlib.md5(owner_name.encode("utf-8")).hexdigest()[:10]
+    return "%s_%s" % (image.split(":")[0], owner)
+
+
+class WarmPool(object):
+    """
+    Keeps DockerChallenge.warm_pool_size started containers of each image on
+    every host that can receive launches, so a launch only has to rename a
+    container instead of creating and booting one.
+
+    Hit/miss counters and the refill lag (time from the first claim until
+    the pool is full again) are kept in the CTFd cache.
+    """
+
+    def hosts(self):
+        """
+        One DockerConfig per host that warm containers are kept on.
+        """
+        if docker_setting("docker_scheduler") == "pool":
+            pool = host_scheduler.pool()
+            if pool:
+                return [docker for _, docker in pool]
+        hosts = dict()
+        for docker in DockerConfig.query.order_by(DockerConfig.id):
+            if docker.hostname:
+                hosts.setdefault(docker.hostname, docker)
+        return list(hosts.values())
+
+    def targets(self):
+        return dict(
+            db.session.query(
+                DockerChallenge.docker_image,
+                db.func.max(DockerChallenge.warm_pool_size),
+            )
+            .filter(DockerChallenge.warm_pool_size > 0)
+            .filter(DockerChallenge.stack.is_(None))
+            .group_by(DockerChallenge.docker_image)
+        )
+
+    def record(self, image, **values):
+        stats = cache.get("docker_warm_stats") or dict()
+        entry = stats.setdefault(image, {"hits": 0, "misses": 0, "refill_lag": None})
+        for key, value in values.items():
+            if key in ("hits", "misses"):
+                entry[key] += value
+            else:
+                entry[key] = value
+        cache.set("docker_warm_stats", stats, timeout=0)
+
+    def claim(self, docker, image):
+        """
+        Takes a running warm container of image on the docker host out of the
+        pool. Returns (instance_id, ports) or None on a miss.
+        """
+        while True:
+            warm = (
+                DockerWarmContainer.query.filter_by(
+                    docker_image=image, hostname=docker.hostname
+                )
+                .order_by(DockerWarmContainer.id)
+                .first()
+            )
+            if warm is None:
+                if image in self.targets():
+                    self.record(image, misses=1)
+                return None
+            instance_id, ports = warm.instance_id, warm.ports
+            # Whoever deletes the row owns the container.
+            claimed = DockerWarmContainer.query.filter_by(id=warm.id).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            if not claimed:
+                continue
+            cache.add(
+                "docker_warm_claimed_%s_%s" % (image, docker.hostname),
+                time.time(),
+                timeout=0,
+            )
+            r = do_request(docker, f"/containers/{instance_id}/json")
+            if r.status_code == 200 and r.json()["State"].get("Running"):
+                self.record(image, hits=1)
+                return instance_id, ports
+            # It died while waiting, throw it away and try the next one.
+            force_delete_container(get_docker_client(docker), instance_id)
+            port_allocator.release(instance_id)
+            db.session.commit()
+
+    def refill(self):
+        targets = self.targets()
+        hosts = self.hosts()
+        budget = docker_setting("docker_warm_pool_batch")
+        pools = dict()
+        for warm in DockerWarmContainer.query.order_by(DockerWarmContainer.id):
+            pools.setdefault((warm.docker_image, warm.hostname), list()).append(warm)
+
+        # Drain pools of images and hosts that no longer want them.
+        hostnames = set(docker.hostname for docker in hosts)
+        extra = list()
+        for (image, hostname), warm in pools.items():
+            keep = targets.get(image, 0) if hostname in hostnames else 0
+            extra.extend(warm[keep:])
+        if extra:
+            clients = dict(
+                (docker.hostname, get_docker_client(docker))
+                for docker in DockerConfig.query.filter(
+                    DockerConfig.id.in_(list(set(w.docker_config_id for w in extra)))
+                )
+            )
+            for warm in extra:
+                force_delete_container(clients.get(warm.hostname), warm.instance_id)
+                port_allocator.release(warm.instance_id)
+                db.session.delete(warm)
+            db.session.commit()
+
+        for image, size in targets.items():
+            for docker in hosts:
+                missing = size - len(pools.get((image, docker.hostname), []))
+                while missing > 0 and budget > 0:
+                    try:
+                        if not image_catalog.has_tag(docker, image):
+                            break
+                        admit(docker, image)
+                        create = create_container(
+                            docker, image, "warm-%s" % uuid.uuid4().hex
+                        )
+                    except AdmissionError:
+                        break
+                    except Exception:
+                        db.session.rollback()
+                        log.exception("Could not warm a container of %s", image)
+                        break
+                    ports = json.loads(create[1])["HostConfig"]["PortBindings"]
+                    db.session.add(
+                        DockerWarmContainer(
+                            docker_image=image,
+                            hostname=docker.hostname,
+                            docker_config_id=docker.id,
+                            instance_id=create[0]["Id"],
+                            ports=",".join([p[0]["HostPort"] for p in ports.values()]),
+                            timestamp=unix_time(datetime.utcnow()),
+                        )
+                    )
+                    db.session.commit()
+                    missing -= 1
+                    budget -= 1
+                if missing <= 0:
+                    key = "docker_warm_claimed_%s_%s" % (image, docker.hostname)
+                    claimed = cache.get(key)
+                    if claimed is not None:
+                        self.record(image, refill_lag=round(time.time() - claimed, 1))
+                        cache.delete(key)
+
+    def stats(self):
+        ready = dict(
+            db.session.query(
+                DockerWarmContainer.docker_image, db.func.count()
+            ).group_by(DockerWarmContainer.docker_image)
+        )
+        recorded = cache.get("docker_warm_stats") or dict()
+        result = list()
+        for image, size in sorted(self.targets().items()):
+            entry = recorded.get(image, {"hits": 0, "misses": 0, "refill_lag": None})
+            launches = entry["hits"] + entry["misses"]
+            result.append(
+                {
+                    "docker_image": image,
+                    "size": size,
+                    "ready": ready.get(image, 0),
+                    "hits": entry["hits"],
+                    "misses": entry["misses"],
+                    "hit_rate": (
+                        round(100.0 * entry["hits"] / launches, 1) if launches else None
+                    ),
+                    "refill_lag": entry["refill_lag"],
+                }
+            )
+        return result
+
+
+warm_pool = WarmPool()
+
+
+def challenge_revert_strategy(image):
+    strategy = (
+        db.session.query(DockerChallenge.revert_strategy)
+        .filter_by(docker_image=image)
+        .order_by(DockerChallenge.id)
+        .first()
+    )
+    if strategy is None or strategy[0] not in REVERT_STRATEGIES:
+        return "recreate"
+    return strategy[0]
+
+
+def restart_container(docker, row, image, owner_name):
+    """
+    Reverts by restarting the container, or every container of its stack,
+    in place.
+    """
+    instance_ids = [row.instance_id]
+    if row.stack_id:
+        instance_ids = stack_containers(get_docker_client(docker), row.stack_id)
+    for instance_id in instance_ids:
+        r = do_request(docker, f"/containers/{instance_id}/restart?t=1", method="POST")
+        if r.status_code >= 300:
+            raise RuntimeError("Could not restart %s: %s" % (instance_id, r.text))
+
+
+def reset_container(docker, row, image, owner_name):
+    """
+    Reverts by replacing the container with a fresh one from the image that
+    publishes the same host ports. The tracker row and the port leases move
+    over to the new container. Stacks are recreated instead.
+    """
+    if row.stack_id:
+        raise RuntimeError("Stacks are reset by recreating them")
+    image_puller.ensure(docker, image)
+    r = do_request(docker, f"/containers/{row.instance_id}/json")
+    if r.status_code != 200:
+        raise RuntimeError("Could not inspect %s" % row.instance_id)
+    bindings = (r.json().get("HostConfig") or dict()).get("PortBindings") or dict()
+    if set(bindings) != set(get_required_ports(docker, image)):
+        raise RuntimeError("The ports of %s changed" % image)
+    old_id = row.instance_id
+    delete_container(docker, old_id)
+    create = create_container(docker, image, owner_name, bindings=bindings)
+    DockerPortLease.query.filter_by(instance_id=old_id).update(
+        {"instance_id": create[0]["Id"]}, synchronize_session=False
+    )
+    row.instance_id = create[0]["Id"]
+
+
+FAST_REVERTS = {"restart": restart_container, "reset": reset_container}
+
+
+def fast_revert(row, image, owner_name):
+    """
+    Reverts the container of row with the restart or reset strategy of its
+    challenge. Returns False when the strategy is recreate or the container
+    cannot be reverted in place, so the caller recreates it instead.
+    """
+    strategy = challenge_revert_strategy(image)
+    docker = tracker_docker_config(row)
+    if strategy not in FAST_REVERTS or docker is None:
+        return False
+    # The event watcher must not drop the row on the die or destroy event
+    # of the revert.
+    cache.set("docker_reverting_%s" % row.instance_id, True, timeout=300)
+    try:
+        with span("revert_%s" % strategy, host=docker.hostname, image=image):
+            FAST_REVERTS[strategy](docker, row, image, owner_name)
+    except Exception:
+        db.session.rollback()
+        log.exception("Could not %s %s, recreating it", strategy, row.instance_id)
+        return False
+    now = unix_time(datetime.utcnow())
+    row.timestamp = now
+    row.revert_time = now + 300
+    mark_owners_changed([row.team_id or row.user_id])
+    db.session.commit()
+    metrics.inc("docker_containers_reverted_total", image=image, strategy=strategy)
+    return True
+
+
+def provision_container(docker_id, owner_id, owner_name, image):
+    """
+    Launches (or reverts) the container of one team/user. Runs on the
+    provisioning pool with its own app context.
+    """
+    docker = DockerConfig.query.filter_by(id=docker_id).first()
+    if is_teams_mode():
+        tracker = DockerChallengeTracker.query.filter_by(team_id=owner_id)
+    else:
+        tracker = DockerChallengeTracker.query.filter_by(user_id=owner_id)
+    old = tracker.filter_by(docker_image=image).all()
+    if len(old) == 1 and fast_revert(old[0], image, owner_name):
+        return old[0]
+    now = unix_time(datetime.utcnow())
+    services = stack_services(image)
+    for service in services or [{"image": image}]:
+        image_puller.ensure(docker, service["image"])
+    # A refused revert must leave the running container alone, so admission
+    # runs first and does not count the containers being replaced.
+    old_configs = resolve_docker_configs(old) if old else []
+    admit(
+        docker,
+        image,
+        owner_id,
+        replacing=sum(
+            1
+            for _, old_docker in old_configs
+            if old_docker is not None and old_docker.hostname == docker.hostname
+        ),
+    )
+    # If we are reverting, the old container goes first.
+    if old:
+        with span("revert", image=image):
+            for i, old_docker in old_configs:
+                if old_docker is not None:
+                    delete_container(old_docker, i.instance_id, i.stack_id)
+                remove_tracked_container(i.instance_id)
+                db.session.commit()
+        metrics.inc(
+            "docker_containers_reverted_total", image=image, strategy="recreate"
+        )
+
+    stack_id = None
+    warm = None
+    if services:
+        with span("create", host=docker.hostname, image=image):
+            create = create_stack(docker, image, owner_name, services)
+        stack_id = create[2]
+    else:
+        with span("warm_claim", host=docker.hostname, image=image):
+            warm = warm_pool.claim(docker, image)
+    if warm is not None:
+        instance_id, ports = warm
+        try:
+            rename_container(docker, instance_id, container_name(image, owner_name))
+        except requests.RequestException:
+            log.exception("Could not rename warm container %s", instance_id)
+    else:
+        if not services:
+            with span("create", host=docker.hostname, image=image):
+                create = create_container(docker, image, owner_name)
+        instance_id = create[0]["Id"]
+        ports = json.loads(create[1])["HostConfig"]["PortBindings"].values()
+        ports = ",".join([p[0]["HostPort"] for p in ports])
+    entry = DockerChallengeTracker(
+        team_id=owner_id if is_teams_mode() else None,
+        user_id=owner_id if not is_teams_mode() else None,
+        docker_image=image,
+        timestamp=now,
+        revert_time=now + 300,
+        instance_id=instance_id,
+        ports=[DockerContainerPort(port=int(p)) for p in ports.split(",") if p],
+        host=str(docker.hostname).split(":")[0],
+        docker_config_id=docker.id,
+        stack_id=stack_id,
+    )
+    with span("record"):
+        db.session.add(entry)
+        mark_owners_changed([owner_id])
+        db.session.commit()
+    return entry
+
+
+def reap_stale_containers():
+    """
+    Removes every container older than the stale threshold. Rows are picked
+    by the indexed timestamp column in batches, the containers of a batch are
+    deleted concurrently and the batch is committed at once.
+    """
+    now = unix_time(datetime.utcnow())
+    cutoff = now - docker_setting("docker_stale_threshold")
+    batch_size = docker_setting("docker_reaper_batch_size")
+    teams = is_teams_mode()
+    report = {"timestamp": now, "reaped": 0, "failed": 0, "containers": []}
+    failed = set()
+
+    while True:
+        query = DockerChallengeTracker.query.filter(
+            DockerChallengeTracker.timestamp < cutoff
+        )
+        if failed:
+            query = query.filter(~DockerChallengeTracker.instance_id.in_(failed))
+        rows = query.order_by(DockerChallengeTracker.timestamp).limit(batch_size).all()
+        if not rows:
+            break
+
+        reaped = list()
+        targets = resolve_docker_clients(rows)
+        results = delete_containers_concurrently(targets)
+
+        for (row, _), ok in zip(targets, results):
+            if not ok:
+                failed.add(row.instance_id)
+                report["failed"] += 1
+                continue
+            report["reaped"] += 1
+            if len(report["containers"]) < 100:
+                report["containers"].append(
+                    {
+                        "instance_id": row.instance_id,
+                        "docker_image": row.docker_image,
+                        "owner_id": row.team_id if teams else row.user_id,
+                        "age": now - int(row.timestamp),
+                    }
+                )
+            reaped.append(row.instance_id)
+        remove_tracked_containers(reaped)
+        db.session.commit()
+
+    metrics.inc("docker_containers_reaped_total", report["reaped"])
+    metrics.inc("docker_reaper_failures_total", report["failed"])
+    if report["reaped"] or report["failed"]:
+        log.info(
+            "Reaped %s stale containers, %s failed",
+            report["reaped"],
+            report["failed"],
+        )
+    cache.set("docker_reaper_report", report)
+    return report
+
+
+def forget_container(docker, instance_id):
+    """
+    Drops everything the plugin tracks for a container that is gone or has
+    died: the container itself, its tracker or warm pool row and its ports.
+    """
+    warm = DockerWarmContainer.query.filter_by(instance_id=instance_id)
+    tracked = DockerChallengeTracker.query.filter_by(instance_id=instance_id)
+    stacks = [i for i, in tracked.with_entities(DockerChallengeTracker.stack_id)]
+    if not warm.count() and not stacks:
+        return False
+    client = get_docker_client(docker)
+    force_delete_container(client, instance_id)
+    for stack_id in stacks:
+        force_delete_stack(client, stack_id)
+    warm.delete(synchronize_session=False)
+    remove_tracked_container(instance_id)
+    db.session.commit()
+    return True
+
+
+def handle_container_event(docker, event):
+    instance_id = (event.get("Actor") or dict()).get("ID") or event.get("id")
+    action = event.get("Action") or event.get("status")
+    if not instance_id or cache.get("docker_reverting_%s" % instance_id):
+        return
+    if action == "oom":
+        metrics.inc("docker_containers_oom_total", host=docker.hostname)
+        return
+    if action == "die":
+        if DockerChallengeTracker.query.filter(
+            DockerChallengeTracker.instance_id == instance_id,
+            DockerChallengeTracker.hibernated.isnot(None),
+        ).count():
+            # Stopped by the idle monitor.
+            return
+        # A die is also part of restarts, only act on containers that stay down.
+        r = do_request(docker, f"/containers/{instance_id}/json")
+        if r.status_code == 200:
+            state = r.json().get("State") or dict()
+            if state.get("Running") or state.get("Restarting"):
+                return
+    if forget_container(docker, instance_id):
+        metrics.inc(
+            "docker_containers_vanished_total", host=docker.hostname, action=action
+        )
+        log.info("Container %s %s, dropped it", instance_id, action)
+
+
+class EventWatcher(object):
+    """
+    Follows the Docker /events stream of every configured host, filtered by
+    the plugin label, so containers that crash, are OOM killed or are removed
+    out of band leave the tracker (and free their ports) right away instead
+    of at the next reaper run.
+
+    Each host gets one stream across all workers: a cache key names the
+    worker currently following it. Streams are opened for one window at a
+    time with `since` set to the last event seen, so a reconnect (or another
+    worker taking over) resumes where the previous stream stopped.
+    """
+
+    WINDOW = 60
+    FILTERS = {
+        "type": ["container"],
+        "label": [PLUGIN_LABEL],
+        "event": ["die", "oom", "destroy"],
+    }
+
+    def __init__(self):
+        self.app = None
+        self.lock = threading.Lock()
+        self.threads = dict()
+        self.stopped = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+
+    def sync(self):
+        """
+        Starts a follower thread for each configured host lacking one.
+        """
+        hostnames = set(h for h, in db.session.query(DockerConfig.hostname) if h)
+        with self.lock:
+            for hostname in hostnames:
+                thread = self.threads.get(hostname)
+                if thread is None or not thread.is_alive():
+                    thread = threading.Thread(
+                        target=self.follow,
+                        args=(hostname,),
+                        name="docker-events-%s" % hostname,
+                        daemon=True,
+                    )
+                    self.threads[hostname] = thread
+                    thread.start()
+
+    def follow(self, hostname):
+        failures = 0
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    docker = (
+                        DockerConfig.query.filter_by(hostname=hostname)
+                        .order_by(DockerConfig.id)
+                        .first()
+                    )
+                    if docker is None or not docker_setting("docker_events_interval"):
+                        break
+                    if self.claim(hostname):
+                        self.stream(docker)
+                        failures = 0
+                    else:
+                        self.stopped.wait(EventWatcher.WINDOW)
+                except Exception:
+                    db.session.rollback()
+                    failures += 1
+                    log.exception("Event stream of %s failed", hostname)
+                finally:
+                    db.session.remove()
+            if failures:
+                self.stopped.wait(min(60, 2**failures) * random.uniform(0.5, 1))
+        with self.lock:
+            if self.threads.get(hostname) is threading.current_thread():
+                del self.threads[hostname]
+
+    def claim(self, hostname):
+        key = "docker_events_%s" % hostname
+        timeout = EventWatcher.WINDOW * 2
+        if cache.add(key, metrics.worker, timeout=timeout):
+            return True
+        if cache.get(key) == metrics.worker:
+            cache.set(key, metrics.worker, timeout=timeout)
+            return True
+        return False
+
+    def stream(self, docker):
+        key = "docker_events_since_%s" % docker.hostname
+        since = cache.get(key) or int(time.time())
+        until = int(time.time()) + EventWatcher.WINDOW
+        client = get_docker_client(docker)
+        breaker.before_call(docker.hostname)
+        try:
+            r = client.session.get(
+                "%s/events" % client.base_url,
+                params={
+                    "since": since,
+                    "until": until,
+                    "filters": json.dumps(EventWatcher.FILTERS),
+                },
+                stream=True,
+                timeout=(client.timeout[0], EventWatcher.WINDOW + client.timeout[1]),
+            )
+        except requests.RequestException:
+            breaker.failure(docker.hostname)
+            raise
+        breaker.success(docker.hostname)
+        with r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                handle_container_event(docker, event)
+                since = max(since, int(event.get("time") or since))
+                cache.set(key, since, timeout=0)
+        cache.set(key, max(since, until - 1), timeout=0)
+
+
+event_watcher = EventWatcher()
+
+
+class DockerChallengeType(BaseChallenge):
+    id = "docker"
+    name = "docker"
+    templates = {
+        "create": "/plugins/docker_challenges/assets/create.html",
+        "update": "/plugins/docker_challenges/assets/update.html",
+        "view": "/plugins/docker_challenges/assets/view.html",
+    }
+    scripts = {
+        "create": "/plugins/docker_challenges/assets/create.js",
+        "update": "/plugins/docker_challenges/assets/update.js",
+        "view": "/plugins/docker_challenges/assets/view.js",
+    }
+    route = "/plugins/docker_challenges/assets"
+    blueprint = Blueprint(
+        "docker_challenges",
+        __name__,
+        template_folder="templates",
+        static_folder="assets",
+    )
+
+    @staticmethod
+    def update(challenge, request):
+        """
         Updates the information associated with a challenge. This should be
         kept strictly to the Challenges table and any child tables.
 
@@ -469,11 +3492,15 @@ class DockerChallengeType(BaseChallenge):
         :param request:
         :return:
         """
-        data = request.form or request.get_json()
+        try:
+            data = clean_challenge_fields(request.form or request.get_json())
+        except StackError as e:
+            raise ChallengeUpdateException(str(e))
         for attr, value in data.items():
             setattr(challenge, attr, value)
 
         db.session.commit()
+        warm_image_metadata(challenge.docker_image)
         return challenge
 
     @staticmethod
@@ -512,6 +3539,13 @@ class DockerChallengeType(BaseChallenge):
             "name": challenge.name,
             "value": challenge.value,
             "docker_image": challenge.docker_image,
+            "warm_pool_size": challenge.warm_pool_size,
+            "cpu_limit": challenge.cpu_limit,
+            "memory_limit": challenge.memory_limit,
+            "pids_limit": challenge.pids_limit,
+            "ulimits": challenge.ulimits,
+            "revert_strategy": challenge.revert_strategy or "recreate",
+            "stack": challenge.stack,
             "description": challenge.description,
             "category": challenge.category,
             "state": challenge.state,
@@ -534,10 +3568,14 @@ class DockerChallengeType(BaseChallenge):
         :param request:
         :return:
         """
-        data = request.form or request.get_json()
+        try:
+            data = clean_challenge_fields(request.form or request.get_json())
+        except StackError as e:
+            raise ChallengeCreateException(str(e))
         challenge = DockerChallenge(**data)
         db.session.add(challenge)
         db.session.commit()
+        warm_image_metadata(challenge.docker_image)
         return challenge
 
     @staticmethod
@@ -554,8 +3592,6 @@ class DockerChallengeType(BaseChallenge):
         """
 
         data = request.form or request.get_json()
-        print(request.get_json())
-        print(data)
         submission = data["submission"].strip()
         flags = Flags.query.filter_by(challenge_id=challenge.id).all()
         for flag in flags:
@@ -576,69 +3612,447 @@ class DockerChallengeType(BaseChallenge):
         data = request.form or request.get_json()
         submission = data["submission"].strip()
         if is_teams_mode():
-            docker_containers = (
-                DockerChallengeTracker.query.filter_by(
-                    docker_image=challenge.docker_image
-                )
-                .filter_by(team_id=team.id)
-                .first()
-            )
-            owner_id = team.id
+            docker_containers = (
+                DockerChallengeTracker.query.filter_by(
+                    docker_image=challenge.docker_image
+                )
+                .filter_by(team_id=team.id)
+                .first()
+            )
+            owner_id = team.id
+        else:
+            docker_containers = (
+                DockerChallengeTracker.query.filter_by(
+                    docker_image=challenge.docker_image
+                )
+                .filter_by(user_id=user.id)
+                .first()
+            )
+            owner_id = user.id
+
+        solve = Solves(
+            user_id=user.id,
+            team_id=team.id if team else None,
+            challenge_id=challenge.id,
+            ip=get_ip(req=request),
+            provided=submission,
+        )
+        db.session.add(solve)
+        if docker_containers is not None:
+            # The container goes away in the background, the solve must not
+            # wait for (or fail with) the Docker host.
+            instance_id = docker_containers.instance_id
+            docker = tracker_docker_config(docker_containers)
+        db.session.commit()
+        if docker_containers is not None:
+            teardown_queue.submit(
+                teardown_container,
+                docker.hostname if docker is not None else None,
+                instance_id=instance_id,
+            )
+
+    @staticmethod
+    def fail(user, team, challenge, request):
+        """
+        Marks an answer incorrect.
+
+        :param team: The Team object from the database
+        :param chal: The Challenge object from the database
+        :param request: The request the user submitted
+        :return:
+        """
+        data = request.form or request.get_json()
+        submission = data["submission"].strip()
+        wrong = Fails(
+            user_id=user.id,
+            team_id=team.id if team else None,
+            challenge_id=challenge.id,
+            ip=get_ip(request),
+            provided=submission,
+        )
+        db.session.add(wrong)
+        db.session.commit()
+        # db.session.close()
+
+
+class DockerChallenge(Challenges):
+    __mapper_args__ = {"polymorphic_identity": "docker"}
+    id = db.Column(None, db.ForeignKey("challenges.id"), primary_key=True)
+    docker_image = db.Column(db.String(128), index=True)
+    warm_pool_size = db.Column(db.Integer, default=0)
+    # Resource limits of every container of this challenge. None is
+    # unlimited. ulimits is a list like "nofile=1024:2048,nproc=256".
+    cpu_limit = db.Column(db.Float)
+    memory_limit = db.Column(db.Integer)
+    pids_limit = db.Column(db.Integer)
+    ulimits = db.Column(db.String(256))
+    # How a revert resets the container, one of REVERT_STRATEGIES.
+    revert_strategy = db.Column(db.String(16), default="recreate")
+    # JSON list of the containers of a multi-container challenge, see
+    # clean_stack. None for single container challenges.
+    stack = db.Column(db.Text)
+
+
+# recreate: delete the container and launch a new one with new ports.
+# restart:  restart the same container, its filesystem is kept.
+# reset:    recreate the container from the image on the same host ports,
+#           keeping the tracker row and the port leases.
+REVERT_STRATEGIES = ("recreate", "restart", "reset")
+
+
+# name: type of the resource limit fields of a DockerChallenge
+RESOURCE_FIELDS = {
+    "cpu_limit": float,
+    "memory_limit": int,
+    "pids_limit": int,
+    "ulimits": str,
+}
+
+
+def clean_resource_fields(data):
+    """
+    Casts the resource limit fields of a challenge form. Blank, zero or
+    malformed values mean unlimited.
+    """
+    data = dict(data)
+    for name, cast in RESOURCE_FIELDS.items():
+        if name not in data:
+            continue
+        try:
+            value = cast(data[name]) if data[name] not in (None, "") else None
+        except (TypeError, ValueError):
+            value = None
+        if name == "ulimits" and value is not None:
+            value = ",".join(
+                "%s=%s:%s" % (u["Name"], u["Soft"], u["Hard"])
+                for u in parse_ulimits(value)
+            )
+        data[name] = value or None
+    return data
+
+
+class StackError(ValueError):
+    """
+    Raised by clean_stack for a stack definition that cannot be launched.
+    The message is shown to the admin saving the challenge.
+    """
+
+
+def clean_challenge_fields(data):
+    """
+    clean_resource_fields plus the warm pool size, which is never negative
+    and 0 when blank or malformed, the revert strategy, which falls back to
+    recreate when it is unknown, and the stack definition, which raises
+    StackError when it is invalid.
+    """
+    data = clean_resource_fields(data)
+    if "warm_pool_size" in data:
+        try:
+            data["warm_pool_size"] = max(int(data["warm_pool_size"] or 0), 0)
+        except (TypeError, ValueError):
+            data["warm_pool_size"] = 0
+    if "revert_strategy" in data and data["revert_strategy"] not in REVERT_STRATEGIES:
+        data["revert_strategy"] = "recreate"
+    if "stack" in data:
+        services = clean_stack(data["stack"])
+        data["stack"] = json.dumps(services) if services else None
+        if services:
+            data["docker_image"] = services[0]["image"]
+    return data
+
+
+def clean_stack(value):
+    """
+    Parses a stack definition, a JSON list of services like
+
+        [{"image": "web:1", "expose": true, "env": {"DB_HOST": "db"}},
+         {"image": "mysql:8", "alias": "db", "env": ["MYSQL_ROOT_PASSWORD=x"]}]
+
+    into a list of {"image", "alias", "env"} with the exposed service first.
+    Exactly one service must be marked "expose"; only it publishes ports.
+    Services without an image are dropped, fewer than two services is not a
+    stack and gives an empty list. Raises StackError when the definition is
+    not a JSON list or does not expose exactly one service.
+    """
+    if not value:
+        return list()
+    try:
+        services = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        raise StackError("The stack is not valid JSON.")
+    if not isinstance(services, list):
+        raise StackError("The stack must be a JSON list of services.")
+    result = list()
+    exposed = list()
+    for service in services:
+        if not isinstance(service, dict) or not service.get("image"):
+            continue
+        env = service.get("env") or list()
+        if isinstance(env, dict):
+            env = ["%s=%s" % (k, v) for k, v in env.items()]
+        alias = service.get("alias") or split_image(service["image"])[0]
+        clean = {
+            "image": str(service["image"]),
+            "alias": re.sub(r"[^a-zA-Z0-9_.-]", "-", alias.rsplit("/", 1)[-1]),
+            "env": [str(e) for e in env],
+        }
+        if service.get("expose") is True:
+            exposed.append(clean)
+        result.append(clean)
+    if len(result) < 2:
+        return list()
+    if len(exposed) != 1:
+        raise StackError(
+            'Exactly one service of the stack needs "expose": true, found %s.'
+            % len(exposed)
+        )
+    result.remove(exposed[0])
+    exposed[0]["expose"] = True
+    return exposed + result
+
+
+def stack_services(image):
+    """
+    The services of the stack of the challenge using image, exposed service
+    first, or None when it is a single container challenge.
+    """
+    stack = (
+        db.session.query(DockerChallenge.stack)
+        .filter_by(docker_image=image)
+        .order_by(DockerChallenge.id)
+        .first()
+    )
+    if stack is None or not stack[0]:
+        return None
+    return json.loads(stack[0])
+
+
+def parse_ulimits(value):
+    """
+    "nofile=1024:2048,nproc=256" to the Ulimits list of a HostConfig. A
+    single number sets both the soft and the hard limit.
+    """
+    result = list()
+    for item in re.split(r"[,\s]+", value or ""):
+        name, _, limits = item.partition("=")
+        soft, _, hard = limits.partition(":")
+        try:
+            soft = int(soft)
+            hard = int(hard) if hard else soft
+        except ValueError:
+            continue
+        if name.strip():
+            result.append({"Name": name.strip(), "Soft": soft, "Hard": hard})
+    return result
+
+
+def challenge_resources(image):
+    """
+    Resource limits of the challenge using image, as {"cpu": CPUs,
+    "memory": MB, "pids": count, "ulimits": str}.
+    """
+    challenge = (
+        DockerChallenge.query.filter_by(docker_image=image)
+        .order_by(DockerChallenge.id)
+        .first()
+    )
+    if challenge is None:
+        return {"cpu": None, "memory": None, "pids": None, "ulimits": None}
+    return {
+        "cpu": challenge.cpu_limit,
+        "memory": challenge.memory_limit,
+        "pids": challenge.pids_limit,
+        "ulimits": challenge.ulimits,
+    }
+
+
+def resource_host_config(resources):
+    """
+    HostConfig entries for the limits returned by challenge_resources.
+    """
+    config = dict()
+    if resources["cpu"]:
+        config["NanoCpus"] = int(resources["cpu"] * 1e9)
+    if resources["memory"]:
+        config["Memory"] = resources["memory"] * 1024 * 1024
+        # No swap on top of the memory limit.
+        config["MemorySwap"] = config["Memory"]
+    if resources["pids"]:
+        config["PidsLimit"] = resources["pids"]
+    ulimits = parse_ulimits(resources["ulimits"])
+    if ulimits:
+        config["Ulimits"] = ulimits
+    return config
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a launch would exceed an owner quota or the capacity of a
+    Docker host. The message is shown to the player.
+    """
+
+    def __init__(self, message, status=503):
+        super(AdmissionError, self).__init__(message)
+        self.status = status
+
+
+def host_reservations(hostname):
+    """
+    (containers, CPUs, memory MB) reserved by the tracked and warm
+    containers on hostname.
+    """
+    images = dict()
+    tracked = (
+        db.session.query(DockerChallengeTracker.docker_image, db.func.count())
+        .join(DockerConfig, DockerChallengeTracker.docker_config_id == DockerConfig.id)
+        .filter(DockerConfig.hostname == hostname)
+        .group_by(DockerChallengeTracker.docker_image)
+    )
+    # Containers stopped by the idle monitor keep their slot, but not their
+    # CPU and memory.
+    stopped = dict(
+        tracked.filter(DockerChallengeTracker.hibernated == "stop").with_entities(
+            DockerChallengeTracker.docker_image, db.func.count()
+        )
+    )
+    warm = (
+        db.session.query(DockerWarmContainer.docker_image, db.func.count())
+        .filter(DockerWarmContainer.hostname == hostname)
+        .group_by(DockerWarmContainer.docker_image)
+    )
+    for image, count in list(tracked) + list(warm):
+        images[image] = images.get(image, 0) + count
+    limits = dict()
+    sizes = dict()
+    if images:
+        limits = dict(
+            (image, (cpu or 0, memory or 0))
+            for image, cpu, memory in db.session.query(
+                DockerChallenge.docker_image,
+                db.func.max(DockerChallenge.cpu_limit),
+                db.func.max(DockerChallenge.memory_limit),
+            )
+            .filter(DockerChallenge.docker_image.in_(list(images)))
+            .group_by(DockerChallenge.docker_image)
+        )
+        # Every container of a stack counts, and gets the challenge's limits.
+        for image, stack in db.session.query(
+            DockerChallenge.docker_image, DockerChallenge.stack
+        ).filter(
+            DockerChallenge.docker_image.in_(list(images)),
+            DockerChallenge.stack.isnot(None),
+        ):
+            sizes[image] = len(json.loads(stack))
+    running = dict((i, n - stopped.get(i, 0)) for i, n in images.items())
+    containers = sum(n * sizes.get(i, 1) for i, n in images.items())
+    cpus = sum(
+        limits.get(i, (0, 0))[0] * n * sizes.get(i, 1) for i, n in running.items()
+    )
+    memory = sum(
+        limits.get(i, (0, 0))[1] * n * sizes.get(i, 1) for i, n in running.items()
+    )
+    return containers, cpus, memory
+
+
+def admit(docker, image, owner_id=None, replacing=0):
+    """
+    Raises AdmissionError if one more container of image for owner_id (None
+    for warm containers) does not fit the owner quota or docker's host.
+    `replacing` containers of image on docker's host are about to be deleted
+    by a revert and do not count against the host.
+    """
+    quota = docker_setting("docker_owner_max_containers")
+    if owner_id is not None and quota > 0:
+        if is_teams_mode():
+            owned = DockerChallengeTracker.query.filter_by(team_id=owner_id)
         else:
-            docker_containers = (
-                DockerChallengeTracker.query.filter_by(
-                    docker_image=challenge.docker_image
-                )
-                .filter_by(user_id=user.id)
-                .first()
+            owned = DockerChallengeTracker.query.filter_by(user_id=owner_id)
+        if owned.filter(DockerChallengeTracker.docker_image != image).count() >= quota:
+            raise AdmissionError(
+                "You can run at most %s containers at once, stop one first." % quota,
+                status=403,
             )
-            owner_id = user.id
-        docker = DockerConfig.query.filter_by(owner_id=owner_id).first()
-        delete_container(docker, docker_containers.instance_id)
-        DockerChallengeTracker.query.filter_by(
-            instance_id=docker_containers.instance_id
-        ).delete()
 
-        solve = Solves(
-            user_id=user.id,
-            team_id=team.id if team else None,
-            challenge_id=challenge.id,
-            ip=get_ip(req=request),
-            provided=submission,
+    host = DockerHost.query.filter_by(hostname=docker.hostname).first()
+    if host is None or not (
+        host.max_containers or host.cpu_capacity or host.memory_capacity
+    ):
+        return
+    resources = challenge_resources(image)
+    size = len(stack_services(image) or [image])
+    containers, cpus, memory = host_reservations(docker.hostname)
+    containers -= replacing * size
+    cpus -= replacing * (resources["cpu"] or 0) * size
+    memory -= replacing * (resources["memory"] or 0) * size
+    if (
+        (host.max_containers and containers + size > host.max_containers)
+        or (
+            host.cpu_capacity
+            and cpus + (resources["cpu"] or 0) * size > host.cpu_capacity
         )
-        db.session.add(solve)
-        db.session.commit()
-        # trying if this solces the detached instance error...
-        # db.session.close()
+        or (
+            host.memory_capacity
+            and memory + (resources["memory"] or 0) * size > host.memory_capacity
+        )
+    ):
+        metrics.inc("docker_admission_refused_total", host=docker.hostname)
+        raise AdmissionError("The Docker host is at capacity, please try again later.")
 
-    @staticmethod
-    def fail(user, team, challenge, request):
-        """
-        Marks an answer incorrect.
 
-        :param team: The Team object from the database
-        :param chal: The Challenge object from the database
-        :param request: The request the user submitted
-        :return:
+class TokenBucket(object):
+    """
+    Token bucket rate limiter kept in the CTFd cache, so the limit holds
+    across worker processes. `rate_key` tokens per minute refill a bucket of
+    `burst_key` tokens; a rate of 0 disables the limit. Each bucket update
+    holds a short cache.add lock, so concurrent launches of one owner on
+    different workers cannot both spend the same token.
+    """
+
+    LOCK_TIMEOUT = 2
+    LOCK_WAIT = 0.5
+
+    def __init__(self, name, rate_key, burst_key):
+        self.name = name
+        self.rate_key = rate_key
+        self.burst_key = burst_key
+
+    def take(self, key):
         """
-        data = request.form or request.get_json()
-        submission = data["submission"].strip()
-        wrong = Fails(
-            user_id=user.id,
-            team_id=team.id if team else None,
-            challenge_id=challenge.id,
-            ip=get_ip(request),
-            provided=submission,
-        )
-        db.session.add(wrong)
-        db.session.commit()
-        # db.session.close()
+        Takes a token for key. Returns 0 when one was available, otherwise
+        the number of seconds until there is one.
+        """
+        rate = docker_setting(self.rate_key) / 60.0
+        if rate <= 0:
+            return 0
+        burst = max(1, docker_setting(self.burst_key))
+        cache_key = "docker_bucket_%s_%s" % (self.name, key)
+        lock = cache_key + "_lock"
+        deadline = time.time() + TokenBucket.LOCK_WAIT
+        while not cache.add(lock, metrics.worker, timeout=TokenBucket.LOCK_TIMEOUT):
+            if time.time() >= deadline:
+                # Someone else is spending tokens of this bucket right now.
+                return 1.0 / rate
+            time.sleep(0.01)
+        try:
+            now = time.time()
+            tokens, updated = cache.get(cache_key) or (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            cache.set(cache_key, (tokens - 1, now), timeout=int(burst / rate) + 60)
+            return 0
+        finally:
+            cache.delete(lock)
 
 
-class DockerChallenge(Challenges):
-    __mapper_args__ = {"polymorphic_identity": "docker"}
-    id = db.Column(None, db.ForeignKey("challenges.id"), primary_key=True)
-    docker_image = db.Column(db.String(128), index=True)
+launch_limiter = TokenBucket("launch", "docker_launch_rate", "docker_launch_burst")
+
+
+def launch_key(owner_id, image):
+    """
+    Coalescing key of the launch jobs of one team/user and image.
+    """
+    return "%s_%s" % (owner_id, hashlib.sha1(image.encode()).hexdigest())
 
 
 # API
@@ -658,80 +4072,115 @@ class ContainerAPI(Resource):
 
         if is_teams_mode():
             session = get_current_team()
+            check = DockerChallengeTracker.query.filter_by(team_id=session.id)
         else:
             session = get_current_user()
-        docker = DockerConfig.query.filter_by(owner_id=session.id).first()
+            check = DockerChallengeTracker.query.filter_by(user_id=session.id)
 
-        containers = DockerChallengeTracker.query.all()
-        if container not in get_repositories(docker, tags=True):
-            return abort(403)
-        now = unix_time(datetime.utcnow())
-        if is_teams_mode():
-            # First we'll delete all old docker containers (+2 hours)
-            for i in containers:
-                if (
-                    int(session.id) == int(i.team_id)
-                    and (now - int(i.timestamp)) >= 7200
-                ):
-                    delete_container(docker, i.instance_id)
-                    DockerChallengeTracker.query.filter_by(
-                        instance_id=i.instance_id
-                    ).delete()
-                    db.session.commit()
-            check = (
-                DockerChallengeTracker.query.filter_by(team_id=session.id)
-                .filter_by(docker_image=container)
-                .first()
-            )
-        else:
-            for i in containers:
-                if (
-                    int(session.id) == int(i.user_id)
-                    and (now - int(i.timestamp)) >= 7200
-                ):
-                    delete_container(docker, i.instance_id)
-                    DockerChallengeTracker.query.filter_by(
-                        instance_id=i.instance_id
-                    ).delete()
-                    db.session.commit()
-            check = (
-                DockerChallengeTracker.query.filter_by(user_id=session.id)
-                .filter_by(docker_image=container)
-                .first()
+        idle_monitor.resume(session.id)
+        # Everything up to the scheduler is answered from the cache or one
+        # indexed lookup, so repeated clicks never reach a Docker host.
+        key = launch_key(session.id, container)
+        job = provisioner.inflight(key)
+        if job is not None:
+            return {"success": True, "data": provisioner.public(job)}, 202
+        wait = launch_limiter.take(session.id)
+        if wait:
+            metrics.inc("docker_launches_rate_limited_total")
+            response = jsonify(
+                {
+                    "success": False,
+                    "errors": ["Too many container launches, slow down."],
+                }
             )
+            response.status_code = 429
+            response.headers["Retry-After"] = str(int(math.ceil(wait)))
+            return response
         # If this container is already created, we don't need another one.
-        if check is not None and not (now - int(check.timestamp)) >= 300:
+        # Reverting is allowed once it has been around for 5 minutes.
+        now = unix_time(datetime.utcnow())
+        started = (
+            check.filter_by(docker_image=container)
+            .with_entities(DockerChallengeTracker.timestamp)
+            .first()
+        )
+        if started is not None and not (now - int(started[0])) >= 300:
             return abort(403)
-        # The exception would be if we are reverting a box. So we'll delete it
-        # if it exists and has been around for more than 5 minutes.
-        elif check is not None:
-            delete_container(docker, check.instance_id)
-            if is_teams_mode():
-                DockerChallengeTracker.query.filter_by(
-                    team_id=session.id,
-                ).filter_by(docker_image=container).delete()
-            else:
-                DockerChallengeTracker.query.filter_by(
-                    user_id=session.id,
-                ).filter_by(docker_image=container).delete()
-            db.session.commit()
-        portsbl = get_unavailable_ports(docker)
-        create = create_container(docker, container, session.name, portsbl)
-        ports = json.loads(create[1])["HostConfig"]["PortBindings"].values()
-        entry = DockerChallengeTracker(
-            team_id=session.id if is_teams_mode() else None,
-            user_id=session.id if not is_teams_mode() else None,
-            docker_image=container,
-            timestamp=now,
-            revert_time=now + 300,
-            instance_id=create[0]["Id"],
-            ports=",".join([p[0]["HostPort"] for p in ports]),
-            host=str(docker.hostname).split(":")[0],
+
+        docker = host_scheduler.place(session.id)
+        if docker is None:
+            return abort(503)
+        unavailable = {
+            "success": False,
+            "errors": ["The Docker host is unavailable, please try again shortly."],
+        }, 503
+        if not breaker.available(docker.hostname):
+            return unavailable
+
+        try:
+            # Images missing from the host are pulled by the launch job, as
+            # long as a challenge uses them.
+            if not image_catalog.has_tag(docker, container) and (
+                DockerChallenge.query.filter_by(docker_image=container).first() is None
+            ):
+                return abort(403)
+        except requests.RequestException:
+            return unavailable
+        replacing = 0
+        if started is not None:
+            replacing = (
+                check.filter_by(docker_image=container)
+                .join(
+                    DockerConfig,
+                    DockerChallengeTracker.docker_config_id == DockerConfig.id,
+                )
+                .filter(DockerConfig.hostname == docker.hostname)
+                .count()
+            )
+        try:
+            admit(docker, container, session.id, replacing=replacing)
+        except AdmissionError as e:
+            return {"success": False, "errors": [str(e)]}, e.status
+
+        job = provisioner.submit(
+            provision_container,
+            docker.hostname,
+            key=key,
+            owner_id=session.id,
+            image=container,
+            docker_id=docker.id,
+            owner_name=session.name,
         )
-        db.session.add(entry)
-        db.session.commit()
-        # db.session.close()
-        return
+        return {"success": True, "data": provisioner.public(job)}, 202
+
+
+@container_namespace.route("/jobs/<job_id>", methods=["GET"])
+class ContainerJobAPI(Resource):
+    """
+    Status of a container provisioning job, polled by view.js.
+    """
+
+    @authed_only
+    def get(self, job_id):
+        if is_teams_mode():
+            session = get_current_team()
+        else:
+            session = get_current_user()
+        job = provisioner.job(job_id)
+        if job is None or str(job["owner_id"]) != str(session.id):
+            return {"success": False, "errors": ["No such job"]}, 404
+        return {"success": True, "data": provisioner.public(job)}
+
+
+@container_namespace.route("/jobs", methods=["GET"])
+class ContainerJobStatsAPI(Resource):
+    """
+    Provisioning queue statistics for the admin panel.
+    """
+
+    @admins_only
+    def get(self):
+        return {"success": True, "data": provisioner.stats()}
 
 
 active_docker_namespace = Namespace(
@@ -739,6 +4188,124 @@ active_docker_namespace = Namespace(
 )
 
 
+def owner_container_states(owner_id):
+    """
+    The current state of each image of one team/user: running containers
+    from the tracker, launches in progress or failed from the provisioner.
+    """
+    if is_teams_mode():
+        tracker = DockerChallengeTracker.query.filter_by(team_id=owner_id)
+    else:
+        tracker = DockerChallengeTracker.query.filter_by(user_id=owner_id)
+    states = dict()
+    for t in tracker.options(selectinload(DockerChallengeTracker.ports)):
+        states[t.docker_image] = {
+            "type": "running",
+            "docker_image": t.docker_image,
+            "instance_id": t.instance_id,
+            "ports": t.port_list,
+            "host": t.host,
+            "revert_time": t.revert_time,
+            "hibernated": t.hibernated,
+        }
+    for image, job in provisioner.owner_jobs(owner_id).items():
+        if job["status"] in ("queued", "running"):
+            states[image] = {"type": "provisioning", "docker_image": image}
+        elif job["status"] == "failed" and image not in states:
+            states[image] = {
+                "type": "failed",
+                "docker_image": image,
+                "message": job.get("message"),
+            }
+    return states
+
+
+def container_events(before, after, first=False):
+    """
+    Lifecycle events turning the states `before` into `after`. On the first
+    snapshot of a stream, old failures are not replayed.
+    """
+    for image, state in after.items():
+        if state == before.get(image):
+            continue
+        if state["type"] == "failed" and (first or image not in before):
+            continue
+        yield state
+    for image, state in before.items():
+        if image not in after:
+            yield {
+                "type": "removed",
+                "docker_image": image,
+                "instance_id": state.get("instance_id"),
+            }
+
+
+def owner_event_stream(owner_id, duration):
+    """
+    Server-Sent Events for one team/user. The owner's status version is
+    checked every second, the database is only read when it changes.
+    Streams end after `duration` seconds and EventSource reconnects.
+    """
+    yield "retry: %d\n\n" % (2000 if duration else 5000)
+    states = dict()
+    version = None
+    announced = set()
+    started = time.monotonic()
+    last_sent = started
+    while True:
+        current = owner_status_version(owner_id)
+        messages = list()
+        if current != version:
+            after = owner_container_states(owner_id)
+            db.session.close()
+            messages.extend(container_events(states, after, first=version is None))
+            states, version = after, current
+        now = unix_time(datetime.utcnow())
+        for state in states.values():
+            if (
+                state["type"] == "running"
+                and state["instance_id"] not in announced
+                and int(state["revert_time"]) <= now
+            ):
+                announced.add(state["instance_id"])
+                messages.append(dict(state, type="revert-available"))
+        for message in messages:
+            last_sent = time.monotonic()
+            yield "event: container\ndata: %s\n\n" % json.dumps(message)
+        if time.monotonic() - started >= duration:
+            return
+        if time.monotonic() - last_sent >= 15:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        time.sleep(1)
+
+
+@active_docker_namespace.route("/stream", methods=["GET"])
+class DockerStatusStream(Resource):
+    """
+    Pushes the container lifecycle events (provisioning, running,
+    revert-available, failed, removed) of the current team/user to view.js.
+    """
+
+    @authed_only
+    def get(self):
+        if is_teams_mode():
+            session = get_current_team()
+        else:
+            session = get_current_user()
+        response = Response(
+            stream_with_context(
+                owner_event_stream(
+                    session.id, max(0, docker_setting("docker_stream_timeout"))
+                )
+            ),
+            mimetype="text/event-stream",
+        )
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+
 @active_docker_namespace.route("", methods=["POST", "GET"])
 class DockerStatus(Resource):
     """
@@ -748,33 +4315,61 @@ class DockerStatus(Resource):
 
     @authed_only
     def get(self):
+        image = request.args.get("image")
         if is_teams_mode():
             session = get_current_team()
-            tracker = DockerChallengeTracker.query.filter_by(
-                team_id=session.id,
-            )
         else:
             session = get_current_user()
-            tracker = DockerChallengeTracker.query.filter_by(
-                user_id=session.id,
-            )
-        docker = DockerConfig.query.filter_by(owner_id=session.id).first()
-        data = list()
-        for i in tracker:
-            data.append(
-                {
-                    "id": i.id,
-                    "team_id": i.team_id,
-                    "user_id": i.user_id,
-                    "docker_image": i.docker_image,
-                    "timestamp": i.timestamp,
-                    "revert_time": i.revert_time,
-                    "instance_id": i.instance_id,
-                    "ports": i.ports.split(","),
-                    "host": str(docker.hostname).split(":")[0],
-                }
-            )
-        return {"success": True, "data": data}
+
+        idle_monitor.resume(session.id)
+        # The version only changes when this owner's tracker rows do, so an
+        # unchanged status can be answered without touching the database.
+        etag = hashlib.md5(
+            ("%s:%s" % (owner_status_version(session.id), image)).encode("utf-8")
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            if is_teams_mode():
+                tracker = DockerChallengeTracker.query.filter_by(team_id=session.id)
+            else:
+                tracker = DockerChallengeTracker.query.filter_by(user_id=session.id)
+            if image:
+                tracker = tracker.filter_by(docker_image=image)
+            tracker = tracker.options(selectinload(DockerChallengeTracker.ports))
+            data = list()
+            for i in tracker:
+                data.append(
+                    {
+                        "id": i.id,
+                        "team_id": i.team_id,
+                        "user_id": i.user_id,
+                        "docker_image": i.docker_image,
+                        "timestamp": i.timestamp,
+                        "revert_time": i.revert_time,
+                        "instance_id": i.instance_id,
+                        "ports": i.port_list,
+                        "host": i.host,
+                    }
+                )
+            response = jsonify({"success": True, "data": data})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+
+@active_docker_namespace.route("/all", methods=["GET"])
+class DockerStatusAdminAPI(Resource):
+    """
+    Paginated list of every tracked container for the admin status page.
+    Accepts the same page, per_page, sort, order, owner, image, min_age and
+    max_age parameters as /admin/docker_status.
+    """
+
+    @admins_only
+    def get(self):
+        page = docker_status_page(**docker_status_args(request.args))
+        return {"success": True, "data": page["data"], "meta": page["meta"]}
 
 
 docker_namespace = Namespace(
@@ -792,9 +4387,20 @@ class DockerAPI(Resource):
 
     @admins_only
     def get(self):
-        # All docker hosts should have the same images so just use whichever
-        docker = DockerConfig.query.filter_by(id=1).first()
-        images = get_repositories(docker, tags=True, repos=docker.repositories)
+        # Offer every image found on any configured host.
+        images = set()
+        seen = set()
+        for docker in DockerConfig.query.order_by(DockerConfig.id):
+            if not docker.hostname or docker.hostname in seen:
+                continue
+            seen.add(docker.hostname)
+            try:
+                images.update(
+                    get_repositories(docker, tags=True, repos=docker.repositories)
+                )
+            except Exception:
+                log.exception("Could not list images of %s", docker.hostname)
+        images = sorted(images)
         if images:
             data = list()
             for i in images:
@@ -807,8 +4413,384 @@ class DockerAPI(Resource):
             }, 400
 
 
+@docker_namespace.route("/catalog", methods=["GET"])
+class DockerCatalogAPI(Resource):
+    """
+    Image catalog cache statistics for the admin panel.
+    """
+
+    @admins_only
+    def get(self):
+        return {"success": True, "data": image_catalog.stats()}
+
+
+@docker_namespace.route("/metrics", methods=["GET"])
+class DockerMetricsAPI(Resource):
+    """
+    Prometheus text exposition of the plugin metrics of every worker.
+    """
+
+    @admins_only
+    def get(self):
+        gauges = dict()
+        active = (
+            db.session.query(
+                DockerConfig.hostname,
+                DockerChallengeTracker.docker_image,
+                db.func.count(),
+            )
+            .join(
+                DockerConfig,
+                DockerChallengeTracker.docker_config_id == DockerConfig.id,
+            )
+            .group_by(DockerConfig.hostname, DockerChallengeTracker.docker_image)
+        )
+        for hostname, image, count in active:
+            key = (("host", str(hostname)), ("image", str(image)))
+            gauges[("docker_active_containers", key)] = count
+        for queue in (provisioner, teardown_queue):
+            for key, value in queue.stats().items():
+                if key in ("queue_depth", "running"):
+                    gauges[("docker_%s_%s" % (queue.name, key), ())] = value
+        return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
+class IdleMonitor(object):
+    """
+    Hibernates player containers nobody uses. Every run samples the network
+    I/O and CPU time of the running containers through the one-shot stats
+    API, in batches and on all hosts in parallel. A container without
+    traffic and with under 1% of a CPU since the previous sample is idle;
+    once idle for docker_idle_threshold it is paused or stopped (all of its
+    stack with it). The owner's next container or status request wakes it
+    up again.
+
+    The last sample of each container is kept in the CTFd cache, the
+    hibernation itself on the tracker row.
+    """
+
+    CPU_IDLE = 0.01
+    REPORT_KEY = "docker_idle_report"
+    WAKE = {"pause": "unpause", "stop": "start"}
+
+    @staticmethod
+    def sample_key(instance_id):
+        return "docker_idle_%s" % instance_id
+
+    @staticmethod
+    def owner_key(owner_id):
+        return "docker_hibernated_%s" % owner_id
+
+    def sample(self, client, instance_id):
+        """
+        (network bytes, CPU ns, memory bytes) of a container, or None. Only
+        talks to Docker.
+        """
+        if client is None:
+            return None
+        try:
+            r = client.request(
+                f"/containers/{instance_id}/stats?stream=false&one-shot=true"
+            )
+            if r.status_code != 200:
+                return None
+            stats = r.json()
+        except (requests.RequestException, ValueError):
+            return None
+        io = sum(
+            n.get("rx_bytes", 0) + n.get("tx_bytes", 0)
+            for n in (stats.get("networks") or dict()).values()
+        )
+        cpu = ((stats.get("cpu_stats") or dict()).get("cpu_usage") or dict()).get(
+            "total_usage", 0
+        )
+        memory = (stats.get("memory_stats") or dict()).get("usage", 0)
+        return io, cpu, memory
+
+    def members(self, client, row):
+        """
+        The containers of row, the exposed one last so a stack is up before
+        players can reach it.
+        """
+        if not row.stack_id:
+            return [row.instance_id]
+        others = stack_containers(client, row.stack_id)
+        return [i for i in others if i != row.instance_id] + [row.instance_id]
+
+    def sweep(self):
+        threshold = docker_setting("docker_idle_threshold")
+        if threshold <= 0:
+            return None
+        action = docker_setting("docker_idle_action")
+        if action not in IdleMonitor.WAKE:
+            action = "pause"
+        batch_size = docker_setting("docker_idle_batch_size")
+        timeout = threshold + max(threshold, docker_setting("docker_idle_interval"))
+        now = unix_time(datetime.utcnow())
+        report = {"timestamp": now, "sampled": 0, "failed": 0, "hibernated": 0}
+        last_id = 0
+
+        while True:
+            rows = (
+                DockerChallengeTracker.query.filter(
+                    DockerChallengeTracker.hibernated.is_(None),
+                    DockerChallengeTracker.timestamp <= now - threshold,
+                    DockerChallengeTracker.id > last_id,
+                )
+                .order_by(DockerChallengeTracker.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            targets = resolve_docker_clients(rows)
+            keys = [IdleMonitor.sample_key(row.instance_id) for row in rows]
+            before = cache.get_many(*keys)
+            with span("idle_sample", containers=len(rows)):
+                samples = run_per_host(
+                    [
+                        (client, self.sample, (client, row.instance_id))
+                        for row, client in targets
+                    ]
+                )
+            snapshots = dict()
+            idle = list()
+            for (row, client), key, old, sample in zip(targets, keys, before, samples):
+                if sample is None:
+                    report["failed"] += 1
+                    continue
+                report["sampled"] += 1
+                io, cpu, memory = sample
+                # Without an earlier sample there is nothing to compare with.
+                active = now
+                if old is not None:
+                    active = old["active"]
+                    elapsed = max(1, now - old["time"])
+                    if io != old["io"] or (
+                        cpu - old["cpu"] > IdleMonitor.CPU_IDLE * elapsed * 1e9
+                    ):
+                        active = now
+                snapshots[key] = dict(
+                    io=io, cpu=cpu, memory=memory, time=now, active=active
+                )
+                if now - active >= threshold:
+                    idle.append((row, client))
+            cache.set_many(snapshots, timeout=timeout)
+
+            for row, client in idle:
+                if self.hibernate(row, client, action):
+                    report["hibernated"] += 1
+
+        log.info(
+            "Idle check sampled %s containers, hibernated %s",
+            report["sampled"],
+            report["hibernated"],
+        )
+        cache.set(IdleMonitor.REPORT_KEY, report, timeout=0)
+        return report
+
+    def hibernate(self, row, client, action):
+        owner_id = row.team_id or row.user_id
+        # Marked first, so the event watcher ignores the die of a stop.
+        row.hibernated = action
+        db.session.commit()
+        try:
+            for instance_id in self.members(client, row):
+                r = client.request(f"/containers/{instance_id}/{action}", method="POST")
+                # 304: already stopped
+                if r.status_code >= 300 and r.status_code != 304:
+                    raise RuntimeError(
+                        "Could not %s %s: %s" % (action, instance_id, r.text)
+                    )
+        except Exception:
+            log.exception("Could not hibernate %s", row.instance_id)
+            try:
+                self.wake(row, client)
+            except Exception:
+                db.session.rollback()
+                log.exception("Could not wake %s", row.instance_id)
+            return False
+        cache.set(IdleMonitor.owner_key(owner_id), True, timeout=0)
+        mark_owners_changed([owner_id])
+        db.session.commit()
+        metrics.inc(
+            "docker_containers_hibernated_total", host=client.hostname, action=action
+        )
+        return True
+
+    def wake(self, row, client):
+        """
+        Unpauses or starts the containers of row and clears its hibernation.
+        A container that does not come back is recreated instead; returns
+        whether it was woken.
+        """
+        action = IdleMonitor.WAKE.get(row.hibernated or "stop")
+        failure = None
+        if client is not None:
+            try:
+                for instance_id in self.members(client, row):
+                    r = client.request(
+                        f"/containers/{instance_id}/{action}", method="POST"
+                    )
+                    # 304: already running
+                    if r.status_code >= 300 and r.status_code != 304:
+                        failure = "%s %s: %s" % (action, instance_id, r.status_code)
+                        break
+            except requests.RequestException as e:
+                failure = str(e)
+        if failure is not None:
+            log.warning(
+                "Could not wake %s (%s), recreating it", row.instance_id, failure
+            )
+            self.recreate(row, client)
+            return False
+        cache.delete(IdleMonitor.sample_key(row.instance_id))
+        row.hibernated = None
+        mark_owners_changed([row.team_id or row.user_id])
+        db.session.commit()
+        return True
+
+    def recreate(self, row, client):
+        """
+        Replaces a container that could not be woken: deletes it, forgets it
+        and queues a fresh launch for its owner on the same Docker config.
+        Raises RuntimeError when the container cannot be deleted, leaving
+        it hibernated for the next try.
+        """
+        owner_id = row.team_id or row.user_id
+        image = row.docker_image
+        docker_id = row.docker_config_id
+        instance_id = row.instance_id
+        if not force_delete_container(client, instance_id, row.stack_id):
+            raise RuntimeError("Could not delete unwakeable %s" % instance_id)
+        cache.delete(IdleMonitor.sample_key(instance_id))
+        remove_tracked_container(instance_id)
+        db.session.commit()
+        metrics.inc("docker_containers_wake_failed_total")
+
+        owner = (Teams if is_teams_mode() else Users).query.filter_by(id=owner_id)
+        owner = owner.first()
+        if owner is None or docker_id is None:
+            return
+        provisioner.submit(
+            provision_container,
+            client.hostname if client is not None else None,
+            key=launch_key(owner_id, image),
+            owner_id=owner_id,
+            image=image,
+            docker_id=docker_id,
+            owner_name=owner.name,
+        )
+
+    def resume(self, owner_id):
+        """
+        Wakes the hibernated containers of one team/user. Owners with
+        nothing hibernated only cost a cache read.
+        """
+        if not cache.get(IdleMonitor.owner_key(owner_id)):
+            return
+        if is_teams_mode():
+            tracker = DockerChallengeTracker.query.filter_by(team_id=owner_id)
+        else:
+            tracker = DockerChallengeTracker.query.filter_by(user_id=owner_id)
+        rows = tracker.filter(DockerChallengeTracker.hibernated.isnot(None)).all()
+        for row, client in resolve_docker_clients(rows):
+            try:
+                with span("wake", host=client.hostname if client else None):
+                    if self.wake(row, client):
+                        metrics.inc("docker_containers_woken_total")
+            except (requests.RequestException, RuntimeError):
+                db.session.rollback()
+                log.exception("Could not wake %s", row.instance_id)
+                return
+        cache.delete(IdleMonitor.owner_key(owner_id))
+
+    def stats(self):
+        """
+        Hibernated containers and the capacity they give back, per host.
+        Paused containers free their CPU, stopped ones their memory too;
+        memory is what they used when last sampled.
+        """
+        rows = (
+            db.session.query(
+                DockerConfig.hostname,
+                DockerChallengeTracker.instance_id,
+                DockerChallengeTracker.hibernated,
+                DockerChallenge.cpu_limit,
+            )
+            .join(
+                DockerConfig,
+                DockerChallengeTracker.docker_config_id == DockerConfig.id,
+            )
+            .outerjoin(
+                DockerChallenge,
+                DockerChallenge.docker_image == DockerChallengeTracker.docker_image,
+            )
+            .filter(DockerChallengeTracker.hibernated.isnot(None))
+            .all()
+        )
+        samples = cache.get_many(*[IdleMonitor.sample_key(r[1]) for r in rows])
+        hosts = dict()
+        seen = set()
+        for (hostname, instance_id, action, cpu), sample in zip(rows, samples):
+            # A challenge image used twice would join the row twice.
+            if instance_id in seen:
+                continue
+            seen.add(instance_id)
+            host = hosts.setdefault(
+                hostname, {"pause": 0, "stop": 0, "cpus": 0.0, "memory_mb": 0}
+            )
+            host[action] = host.get(action, 0) + 1
+            host["cpus"] += cpu or 0
+            if action == "stop" and sample:
+                host["memory_mb"] += sample["memory"] // (1024 * 1024)
+        return dict(
+            report=cache.get(IdleMonitor.REPORT_KEY),
+            hosts=[dict(host=h, **v) for h, v in sorted(hosts.items())],
+        )
+
+
+idle_monitor = IdleMonitor()
+
+
+background_tasks = dict()
+
+
 def load(app):
     app.db.create_all()
+    upgrade(plugin_name="docker_challenges")
+    provisioner.init_app(app)
+    teardown_queue.init_app(app)
+    event_watcher.init_app(app)
+    background_tasks["reconcile_ports"] = PeriodicTask(
+        app, "reconcile_ports", reconcile_ports, "docker_reconcile_interval"
+    )
+    background_tasks["reaper"] = PeriodicTask(
+        app, "reaper", reap_stale_containers, "docker_reaper_interval"
+    )
+    background_tasks["warm_pool"] = PeriodicTask(
+        app, "warm_pool", warm_pool.refill, "docker_warm_pool_interval"
+    )
+    background_tasks["idle"] = PeriodicTask(
+        app, "idle", idle_monitor.sweep, "docker_idle_interval"
+    )
+    background_tasks["metrics"] = PeriodicTask(
+        app,
+        "metrics",
+        metrics.publish,
+        "docker_metrics_interval",
+        exclusive=False,
+    )
+    background_tasks["events"] = PeriodicTask(
+        app,
+        "events",
+        event_watcher.sync,
+        "docker_events_interval",
+        exclusive=False,
+    )
+    app.after_request(_observe_plugin_request)
     CHALLENGE_CLASSES["docker"] = DockerChallengeType
     register_plugin_assets_directory(
         app,
@@ -816,7 +4798,10 @@ def load(app):
     )
     define_docker_admin(app)
     define_docker_status(app)
+    define_docker_cli(app)
     CTFd_API_v1.add_namespace(docker_namespace, "/docker")
     CTFd_API_v1.add_namespace(container_namespace, "/container")
     CTFd_API_v1.add_namespace(active_docker_namespace, "/docker_status")
     CTFd_API_v1.add_namespace(kill_container, "/nuke")
+    for task in background_tasks.values():
+        task.start()
@@ -40,32 +40,109 @@ CTFd._internal.challenge.submit = function(preview) {
     })
 };
 
+// view.js is evaluated again every time a challenge is opened, so the event
+// stream and countdown live on window and are only ever created once.
+window.docker_events = window.docker_events || {
+    stream: null,
+    states: {},
+    timer: null
+};
+
+function subscribe_docker_events() {
+    var events = window.docker_events;
+    if (events.stream !== null) {
+        return true;
+    }
+    if (!window.EventSource) {
+        return false;
+    }
+    events.stream = new EventSource("/api/v1/docker_status/stream");
+    events.stream.addEventListener("container", function(e) {
+        var state = JSON.parse(e.data);
+        events.states[state.docker_image] = state;
+        if (typeof DOCKER_CONTAINER !== 'undefined' && state.docker_image == DOCKER_CONTAINER) {
+            render_container_state(state);
+        }
+    });
+    return true;
+}
+
+function show_docker_container(container) {
+    if (!subscribe_docker_events()) {
+        get_docker_status(container);
+        return;
+    }
+    var state = window.docker_events.states[container];
+    if (state) {
+        render_container_state(state);
+        if (state.hibernated) {
+            // Opening the challenge wakes the container, the stream then
+            // pushes it as running again.
+            $.get("/api/v1/docker_status", { 'image': container });
+        }
+    } else {
+        render_start_button(container);
+    }
+}
+
+function render_container_state(state) {
+    clearInterval(window.docker_events.timer);
+    if (state.type == 'provisioning') {
+        $('#docker_container').html('<div class="text-center"><i class="fas fa-circle-notch fa-spin fa-1x"></i></div>');
+    } else if (state.type == 'running' || state.type == 'revert-available') {
+        render_container(state);
+    } else if (state.type == 'failed') {
+        delete window.docker_events.states[state.docker_image];
+        fail_container_start(state.docker_image, state.message);
+    } else {
+        render_start_button(state.docker_image);
+    }
+}
+
+function render_start_button(container) {
+    $('#docker_container').html('<span><a onclick="start_container(\'' + container + '\');" class=\'btn btn-dark\'><small style=\'color:white;\'><i class="fas fa-play"></i> Start Docker Instance</small></a></span>');
+}
+
+function render_container(item) {
+    var ports = String(item.ports).split(',');
+    var data = '';
+    $.each(ports, function(x, port) {
+        port = String(port)
+        data = data + 'Host: ' + item.host + ' Port: ' + port + '<br />';
+    })
+    var revert_id = String(item.instance_id).substring(0,10) + "_revert_container";
+    if (item.hibernated) {
+        data = data + '<small>Hibernated while idle, it wakes up when you open this challenge.</small><br />';
+    }
+    $('#docker_container').html('<pre>Docker Container Information:<br />' + data + '<div class="mt-2" id="' + revert_id + '"></div>');
+    var countDownDate = new Date(parseInt(item.revert_time) * 1000).getTime();
+    var countdown = function() {
+        var now = new Date().getTime();
+        var distance = countDownDate - now;
+        if (distance < 0) {
+            clearInterval(window.docker_events.timer);
+            $("#" + revert_id).html('<a onclick="start_container(\'' + item.docker_image + '\');" class=\'btn btn-dark\'><small style=\'color:white;\'><i class="fas fa-redo"></i> Revert</small></a>');
+            return;
+        }
+        var minutes = Math.floor((distance % (1000 * 60 * 60)) / (1000 * 60));
+        var seconds = Math.floor((distance % (1000 * 60)) / 1000);
+        if (seconds < 10) {
+            seconds = "0" + seconds
+        }
+        $("#" + revert_id).html('Next Revert Available in ' + minutes + ':' + seconds);
+    };
+    clearInterval(window.docker_events.timer);
+    countdown();
+    if (countDownDate > new Date().getTime()) {
+        window.docker_events.timer = setInterval(countdown, 1000);
+    }
+}
+
 function get_docker_status(container) {
-    $.get("/api/v1/docker_status", function(result) {
+    $.get("/api/v1/docker_status", { 'image': container }, function(result) {
         $.each(result['data'], function(i, item) {
             if (item.docker_image == container) {
-                var ports = String(item.ports).split(',');
-                var data = '';
-                $.each(ports, function(x, port) {
-                    port = String(port)
-                    data = data + 'Host: ' + item.host + ' Port: ' + port + '<br />';
-                })
-                $('#docker_container').html('<pre>Docker Container Information:<br />' + data + '<div class="mt-2" id="' + String(item.instance_id).substring(0,10) + '_revert_container"></div>');
-                var countDownDate = new Date(parseInt(item.revert_time) * 1000).getTime();
-                var x = setInterval(function() {
-                    var now = new Date().getTime();
-                    var distance = countDownDate - now;
-                    var minutes = Math.floor((distance % (1000 * 60 * 60)) / (1000 * 60));
-                    var seconds = Math.floor((distance % (1000 * 60)) / 1000);
-                    if (seconds < 10) {
-                        seconds = "0" + seconds
-                    }
-                    $("#" + String(item.instance_id).substring(0,10) + "_revert_container").html('Next Revert Available in ' + minutes + ':' + seconds);
-                    if (distance < 0) {
-                        clearInterval(x);
-                        $("#" + String(item.instance_id).substring(0,10) + "_revert_container").html('<a onclick="start_container(\'' + item.docker_image + '\');" class=\'btn btn-dark\'><small style=\'color:white;\'><i class="fas fa-redo"></i> Revert</small></a>');
-                    }
-                }, 1000);
+                render_container(item);
                 return false;
             };
         });
@@ -75,18 +152,57 @@ function get_docker_status(container) {
 function start_container(container) {
     $('#docker_container').html('<div class="text-center"><i class="fas fa-circle-notch fa-spin fa-1x"></i></div>');
     $.get("/api/v1/container", { 'name': container }, function(result) {
-            get_docker_status(container);
+            // With the event stream the outcome is pushed, otherwise poll.
+            if (window.docker_events.stream === null) {
+                poll_container_job(result['data']['id'], container);
+            }
         })
         .fail(function(jqxhr, settings, ex) {
+            var errors = jqxhr.responseJSON && jqxhr.responseJSON['errors'];
+            if (errors && errors.length) {
+                fail_container_start(container, errors[0]);
+                return;
+            }
+            if (jqxhr.status == 429 || jqxhr.status == 503) {
+                fail_container_start(container, "No Docker host is available right now. Please try again shortly.");
+                return;
+            }
             ezal({
                 title: "Attention!",
                 body: "You can only revert a container once per 5 minutes! Please be patient.",
                 button: "Got it!"
             });
-            $(get_docker_status(container));
+            show_docker_container(container);
         });
 }
 
+function poll_container_job(job_id, container) {
+    $.get("/api/v1/container/jobs/" + job_id, function(result) {
+            var job = result['data'];
+            if (job.status == 'done') {
+                get_docker_status(container);
+            } else if (job.status == 'failed') {
+                fail_container_start(container, job.message);
+            } else {
+                setTimeout(function() {
+                    poll_container_job(job_id, container);
+                }, 1000);
+            }
+        })
+        .fail(function(jqxhr, settings, ex) {
+            fail_container_start(container);
+        });
+}
+
+function fail_container_start(container, message) {
+    render_start_button(container);
+    ezal({
+        title: "Attention!",
+        body: message || "Your Docker Instance could not be started. Please try again.",
+        button: "Got it!"
+    });
+}
+
 var modal =
     '<div class="modal fade" tabindex="-1" role="dialog">' +
     '  <div class="modal-dialog" role="document">' +
@@ -0,0 +1,41 @@
+"""Record the Docker host of each tracked container
+
+Revision ID: 4c1f5e2b7a90
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4c1f5e2b7a90"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the column on fresh installs
+    if "docker_config_id" not in _columns(op, "docker_challenge_tracker"):
+        op.add_column(
+            "docker_challenge_tracker",
+            sa.Column("docker_config_id", sa.Integer(), nullable=True),
+        )
+        op.create_index(
+            op.f("ix_docker_challenge_tracker_docker_config_id"),
+            "docker_challenge_tracker",
+            ["docker_config_id"],
+            unique=False,
+        )
+
+
+def downgrade(op=None):
+    op.drop_index(
+        op.f("ix_docker_challenge_tracker_docker_config_id"),
+        table_name="docker_challenge_tracker",
+    )
+    op.drop_column("docker_challenge_tracker", "docker_config_id")
@@ -0,0 +1,201 @@
+"""Typed owner ids, composite tracker indexes and a container port table
+
+Revision ID: 7b2d4f8a1c63
+Revises: 9e3a1d6c2f48
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7b2d4f8a1c63"
+down_revision = "9e3a1d6c2f48"
+branch_labels = None
+depends_on = None
+
+# Single column indexes nothing filters on, several of them on certificate
+# blobs.
+UNUSED_INDEXES = {
+    "docker_config": [
+        "tls_enabled",
+        "ca_cert",
+        "client_cert",
+        "client_key",
+        "repositories",
+    ],
+    "docker_challenge_tracker": [
+        "team_id",
+        "user_id",
+        "docker_image",
+        "revert_time",
+        "ports",
+        "host",
+    ],
+}
+
+COMPOSITE_INDEXES = {
+    "ix_docker_challenge_tracker_team_image": ["team_id", "docker_image"],
+    "ix_docker_challenge_tracker_user_image": ["user_id", "docker_image"],
+}
+
+
+def _columns(op, table):
+    return dict((c["name"], c) for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def _indexes(op, table):
+    return [i["name"] for i in sa.inspect(op.get_bind()).get_indexes(table)]
+
+
+def _is_integer(column):
+    return isinstance(column["type"], sa.Integer)
+
+
+def upgrade(op=None):
+    bind = op.get_bind()
+
+    for table, columns in UNUSED_INDEXES.items():
+        existing = _indexes(op, table)
+        for column in columns:
+            name = "ix_%s_%s" % (table, column)
+            if name in existing:
+                op.drop_index(name, table_name=table)
+
+    # On SQLite every batch below rebuilds its table, and dropping the old
+    # table would cascade into the rows referencing it. So docker_config goes
+    # before the tracker gets its foreign key to it, and the port rows are
+    # only written once the tracker is done.
+    if not _is_integer(_columns(op, "docker_config")["owner_id"]):
+        with op.batch_alter_table("docker_config") as batch:
+            batch.alter_column(
+                "owner_id",
+                existing_type=sa.String(64),
+                type_=sa.Integer(),
+                postgresql_using="owner_id::integer",
+            )
+
+    tracker = _columns(op, "docker_challenge_tracker")
+    ports = list()
+    if "ports" in tracker:
+        for tracker_id, value in bind.execute(
+            sa.text("SELECT id, ports FROM docker_challenge_tracker")
+        ):
+            for port in set((value or "").split(",")):
+                if port.strip().isdigit():
+                    ports.append({"tracker_id": tracker_id, "port": int(port)})
+
+    if not _is_integer(tracker["team_id"]):
+        # Rows of deleted teams/users would violate the new foreign keys.
+        teams = set(i for i, in bind.execute(sa.text("SELECT id FROM teams")))
+        users = set(i for i, in bind.execute(sa.text("SELECT id FROM users")))
+        orphans = list()
+        for tracker_id, team_id, user_id in bind.execute(
+            sa.text("SELECT id, team_id, user_id FROM docker_challenge_tracker")
+        ):
+            try:
+                if team_id is not None and int(team_id) not in teams:
+                    orphans.append(tracker_id)
+                elif user_id is not None and int(user_id) not in users:
+                    orphans.append(tracker_id)
+            except ValueError:
+                orphans.append(tracker_id)
+        if orphans:
+            bind.execute(
+                sa.text(
+                    "DELETE FROM docker_challenge_tracker WHERE id IN :ids"
+                ).bindparams(sa.bindparam("ids", expanding=True)),
+                {"ids": orphans},
+            )
+            ports = [p for p in ports if p["tracker_id"] not in set(orphans)]
+        bind.execute(
+            sa.text(
+                "UPDATE docker_challenge_tracker SET docker_config_id = NULL "
+                "WHERE docker_config_id NOT IN (SELECT id FROM docker_config)"
+            )
+        )
+
+        with op.batch_alter_table("docker_challenge_tracker") as batch:
+            if "ports" in tracker:
+                batch.drop_column("ports")
+            for column in ("team_id", "user_id"):
+                batch.alter_column(
+                    column,
+                    existing_type=sa.String(64),
+                    type_=sa.Integer(),
+                    postgresql_using="%s::integer" % column,
+                )
+            batch.create_foreign_key(
+                "fk_docker_challenge_tracker_team_id",
+                "teams",
+                ["team_id"],
+                ["id"],
+                ondelete="CASCADE",
+            )
+            batch.create_foreign_key(
+                "fk_docker_challenge_tracker_user_id",
+                "users",
+                ["user_id"],
+                ["id"],
+                ondelete="CASCADE",
+            )
+            batch.create_foreign_key(
+                "fk_docker_challenge_tracker_docker_config_id",
+                "docker_config",
+                ["docker_config_id"],
+                ["id"],
+                ondelete="SET NULL",
+            )
+    elif "ports" in tracker:
+        with op.batch_alter_table("docker_challenge_tracker") as batch:
+            batch.drop_column("ports")
+
+    existing = _indexes(op, "docker_challenge_tracker")
+    for name, columns in COMPOSITE_INDEXES.items():
+        if name not in existing:
+            op.create_index(name, "docker_challenge_tracker", columns, unique=False)
+
+    if ports:
+        op.bulk_insert(
+            sa.table(
+                "docker_container_port",
+                sa.column("tracker_id", sa.Integer),
+                sa.column("port", sa.Integer),
+            ),
+            ports,
+        )
+
+
+def downgrade(op=None):
+    bind = op.get_bind()
+    ports = dict()
+    for tracker_id, port in bind.execute(
+        sa.text("SELECT tracker_id, port FROM docker_container_port ORDER BY port")
+    ):
+        ports.setdefault(tracker_id, list()).append(str(port))
+
+    for name in COMPOSITE_INDEXES:
+        op.drop_index(name, table_name="docker_challenge_tracker")
+    with op.batch_alter_table("docker_challenge_tracker") as batch:
+        batch.drop_constraint("fk_docker_challenge_tracker_team_id", type_="foreignkey")
+        batch.drop_constraint("fk_docker_challenge_tracker_user_id", type_="foreignkey")
+        batch.drop_constraint(
+            "fk_docker_challenge_tracker_docker_config_id", type_="foreignkey"
+        )
+        for column in ("team_id", "user_id"):
+            batch.alter_column(column, existing_type=sa.Integer(), type_=sa.String(64))
+        batch.add_column(sa.Column("ports", sa.String(128), nullable=True))
+    with op.batch_alter_table("docker_config") as batch:
+        batch.alter_column("owner_id", existing_type=sa.Integer(), type_=sa.String(64))
+
+    for tracker_id, values in ports.items():
+        bind.execute(
+            sa.text(
+                "UPDATE docker_challenge_tracker SET ports = :ports WHERE id = :id"
+            ),
+            {"ports": ",".join(values), "id": tracker_id},
+        )
+    op.execute("DELETE FROM docker_container_port")
+
+    for table, columns in UNUSED_INDEXES.items():
+        for column in columns:
+            op.create_index("ix_%s_%s" % (table, column), table, [column], unique=False)
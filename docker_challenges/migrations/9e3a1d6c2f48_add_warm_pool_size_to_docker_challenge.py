@@ -0,0 +1,31 @@
+"""Add warm pool size to docker challenges
+
+Revision ID: 9e3a1d6c2f48
+Revises: 4c1f5e2b7a90
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9e3a1d6c2f48"
+down_revision = "4c1f5e2b7a90"
+branch_labels = None
+depends_on = None
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the column on fresh installs
+    if "warm_pool_size" not in _columns(op, "docker_challenge"):
+        op.add_column(
+            "docker_challenge",
+            sa.Column("warm_pool_size", sa.Integer(), nullable=True),
+        )
+
+
+def downgrade(op=None):
+    op.drop_column("docker_challenge", "warm_pool_size")
@@ -0,0 +1,31 @@
+"""Track containers hibernated by the idle monitor
+
+Revision ID: a4d1e9b7c358
+Revises: f3c9a7e1d2b6
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a4d1e9b7c358"
+down_revision = "f3c9a7e1d2b6"
+branch_labels = None
+depends_on = None
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the column on fresh installs
+    if "hibernated" not in _columns(op, "docker_challenge_tracker"):
+        op.add_column(
+            "docker_challenge_tracker",
+            sa.Column("hibernated", sa.String(8), nullable=True),
+        )
+
+
+def downgrade(op=None):
+    op.drop_column("docker_challenge_tracker", "hibernated")
@@ -0,0 +1,38 @@
+"""Add the scheduling columns of docker hosts
+
+Revision ID: c7e2a9f4b1d3
+Revises: a4d1e9b7c358
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c7e2a9f4b1d3"
+down_revision = "a4d1e9b7c358"
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = [
+    ("pooled", sa.Boolean),
+    ("weight", sa.Float),
+    ("max_containers", sa.Integer),
+]
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the columns on fresh installs, and on
+    # installs whose docker_host table was created after they existed
+    existing = _columns(op, "docker_host")
+    for name, type_ in NEW_COLUMNS:
+        if name not in existing:
+            op.add_column("docker_host", sa.Column(name, type_(), nullable=True))
+
+
+def downgrade(op=None):
+    for name, _ in NEW_COLUMNS:
+        op.drop_column("docker_host", name)
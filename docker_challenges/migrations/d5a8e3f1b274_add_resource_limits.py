@@ -0,0 +1,46 @@
+"""Add container resource limits and host capacities
+
+Revision ID: d5a8e3f1b274
+Revises: 7b2d4f8a1c63
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "d5a8e3f1b274"
+down_revision = "7b2d4f8a1c63"
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = {
+    "docker_challenge": [
+        ("cpu_limit", sa.Float),
+        ("memory_limit", sa.Integer),
+        ("pids_limit", sa.Integer),
+        ("ulimits", lambda: sa.String(256)),
+    ],
+    "docker_host": [
+        ("cpu_capacity", sa.Float),
+        ("memory_capacity", sa.Integer),
+    ],
+}
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the columns on fresh installs
+    for table, columns in NEW_COLUMNS.items():
+        existing = _columns(op, table)
+        for name, type_ in columns:
+            if name not in existing:
+                op.add_column(table, sa.Column(name, type_(), nullable=True))
+
+
+def downgrade(op=None):
+    for table, columns in NEW_COLUMNS.items():
+        for name, _ in columns:
+            op.drop_column(table, name)
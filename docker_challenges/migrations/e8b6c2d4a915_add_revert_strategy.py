@@ -0,0 +1,31 @@
+"""Add a revert strategy to docker challenges
+
+Revision ID: e8b6c2d4a915
+Revises: d5a8e3f1b274
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "e8b6c2d4a915"
+down_revision = "d5a8e3f1b274"
+branch_labels = None
+depends_on = None
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the column on fresh installs
+    if "revert_strategy" not in _columns(op, "docker_challenge"):
+        op.add_column(
+            "docker_challenge",
+            sa.Column("revert_strategy", sa.String(16), nullable=True),
+        )
+
+
+def downgrade(op=None):
+    op.drop_column("docker_challenge", "revert_strategy")
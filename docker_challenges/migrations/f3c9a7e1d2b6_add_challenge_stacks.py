@@ -0,0 +1,38 @@
+"""Add multi-container stacks
+
+Revision ID: f3c9a7e1d2b6
+Revises: e8b6c2d4a915
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f3c9a7e1d2b6"
+down_revision = "e8b6c2d4a915"
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = {
+    "docker_challenge": [("stack", sa.Text)],
+    "docker_challenge_tracker": [("stack_id", lambda: sa.String(32))],
+}
+
+
+def _columns(op, table):
+    return [c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade(op=None):
+    # create_all() has already added the columns on fresh installs
+    for table, columns in NEW_COLUMNS.items():
+        existing = _columns(op, table)
+        for name, type_ in columns:
+            if name not in existing:
+                op.add_column(table, sa.Column(name, type_(), nullable=True))
+
+
+def downgrade(op=None):
+    for table, columns in NEW_COLUMNS.items():
+        for name, _ in columns:
+            op.drop_column(table, name)
@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+# Background tasks would race the tests for the database and the fake daemon.
+QUIET_SETTINGS = {
+    "docker_reconcile_interval": 0,
+    "docker_reaper_interval": 0,
+    "docker_warm_pool_interval": 0,
+    "docker_metrics_interval": 0,
+    "docker_events_interval": 0,
+    "docker_idle_interval": 0,
+    "docker_launch_rate": 0,
+    "docker_retries": 0,
+}
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    A CTFd app on a throwaway SQLite database, with the plugin loaded from
+    CTFd/plugins/docker_challenges like in benchmarks/lifecycle.py.
+    """
+    pytest.importorskip("CTFd")
+    from CTFd import create_app
+    from CTFd.config import TestingConfig
+    from CTFd.models import db
+    from CTFd.utils import set_config
+
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///%s" % (tmp_path / "ctfd.db")
+
+    app = create_app(Config)
+    with app.app_context():
+        set_config("setup", True)
+        set_config("user_mode", "users")
+        for key, value in QUIET_SETTINGS.items():
+            set_config(key, value)
+        # The plugin keeps module level caches across apps.
+        from CTFd.plugins.docker_challenges import owner_configs
+
+        owner_configs.invalidate()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def fake_docker():
+    """
+    benchmarks/fake_docker.py serving on a free port. The FakeDocker state is
+    server.docker.
+    """
+    from fake_docker import FakeDocker, FakeDockerServer
+
+    server = FakeDockerServer(FakeDocker(images=["test/web:1", "test/db:1"]))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def docker_config(app, fake_docker):
+    """
+    A user with a DockerConfig pointing at the fake daemon.
+    """
+    from CTFd.models import Users, db
+    from CTFd.plugins.docker_challenges import DockerConfig
+
+    user = Users(name="player", email="player@test.local", password="password")
+    db.session.add(user)
+    db.session.flush()
+    config = DockerConfig(
+        owner_id=user.id, hostname=fake_docker.hostname, tls_enabled=False
+    )
+    db.session.add(config)
+    db.session.commit()
+    return config
@@ -0,0 +1,73 @@
+import pytest
+
+plugin = pytest.importorskip("CTFd.plugins.docker_challenges")
+
+
+def track(config, image, count):
+    for i in range(count):
+        plugin.db.session.add(
+            plugin.DockerChallengeTracker(
+                user_id=config.owner_id,
+                docker_image=image,
+                instance_id="%s-%s" % (image, i),
+                docker_config_id=config.id,
+            )
+        )
+    plugin.db.session.commit()
+
+
+def test_admit_without_limits(docker_config):
+    track(docker_config, "test/web:1", 10)
+    plugin.admit(docker_config, "test/web:1", docker_config.owner_id)
+
+
+def test_admit_enforces_the_owner_quota(docker_config):
+    plugin.set_config("docker_owner_max_containers", 2)
+    track(docker_config, "test/web:1", 1)
+    track(docker_config, "test/db:1", 1)
+    with pytest.raises(plugin.AdmissionError) as e:
+        plugin.admit(docker_config, "test/other:1", docker_config.owner_id)
+    assert e.value.status == 403
+    # Relaunching a running image replaces it and does not count twice.
+    plugin.admit(docker_config, "test/web:1", docker_config.owner_id)
+    # Warm containers have no owner.
+    plugin.admit(docker_config, "test/other:1")
+
+
+def test_admit_enforces_the_host_capacity(docker_config):
+    plugin.db.session.add(
+        plugin.DockerHost(hostname=docker_config.hostname, max_containers=2)
+    )
+    plugin.db.session.commit()
+    track(docker_config, "test/web:1", 2)
+    with pytest.raises(plugin.AdmissionError) as e:
+        plugin.admit(docker_config, "test/db:1", docker_config.owner_id)
+    assert e.value.status == 503
+    plugin.admit(docker_config, "test/web:1", docker_config.owner_id, replacing=1)
+
+
+def test_admit_enforces_the_host_memory(docker_config):
+    challenge = plugin.DockerChallenge(
+        name="web",
+        category="web",
+        description="",
+        value=100,
+        type="docker",
+        docker_image="test/web:1",
+        memory_limit=256,
+    )
+    plugin.db.session.add(challenge)
+    plugin.db.session.add(
+        plugin.DockerHost(hostname=docker_config.hostname, memory_capacity=512)
+    )
+    plugin.db.session.commit()
+    track(docker_config, "test/web:1", 1)
+    plugin.admit(docker_config, "test/web:1", docker_config.owner_id)
+    track(docker_config, "test/web:1", 1)
+    with pytest.raises(plugin.AdmissionError):
+        plugin.admit(docker_config, "test/web:1", docker_config.owner_id)
+    # Hibernated (stopped) containers keep their slot but free their memory.
+    tracker = plugin.DockerChallengeTracker.query.first()
+    tracker.hibernated = "stop"
+    plugin.db.session.commit()
+    plugin.admit(docker_config, "test/web:1", docker_config.owner_id)
@@ -0,0 +1,77 @@
+import pytest
+
+plugin = pytest.importorskip("CTFd.plugins.docker_challenges")
+
+HOST = "docker.test:2376"
+
+
+@pytest.fixture
+def breaker():
+    breaker = plugin.CircuitBreaker()
+    breaker.threshold = 3
+    breaker.cooldown = 60
+    return breaker
+
+
+def expire(breaker):
+    breaker.hosts[HOST]["opened"] -= breaker.cooldown
+
+
+def test_opens_after_threshold_failures_in_a_row(breaker):
+    for _ in range(breaker.threshold - 1):
+        breaker.before_call(HOST)
+        breaker.failure(HOST)
+    breaker.success(HOST)
+    for _ in range(breaker.threshold - 1):
+        breaker.failure(HOST)
+    assert breaker.host(HOST)["state"] == plugin.CircuitBreaker.CLOSED
+    breaker.failure(HOST)
+    assert breaker.host(HOST)["state"] == plugin.CircuitBreaker.OPEN
+    assert not breaker.available(HOST)
+    with pytest.raises(plugin.DockerUnavailable):
+        breaker.before_call(HOST)
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    for _ in range(breaker.threshold):
+        breaker.failure(HOST)
+    expire(breaker)
+    assert breaker.available(HOST)
+    breaker.before_call(HOST)
+    assert breaker.host(HOST)["state"] == plugin.CircuitBreaker.HALF_OPEN
+    assert not breaker.available(HOST)
+    with pytest.raises(plugin.DockerUnavailable):
+        breaker.before_call(HOST)
+
+
+def test_probe_success_closes(breaker):
+    for _ in range(breaker.threshold):
+        breaker.failure(HOST)
+    expire(breaker)
+    breaker.before_call(HOST)
+    breaker.success(HOST)
+    assert breaker.host(HOST) == {
+        "state": plugin.CircuitBreaker.CLOSED,
+        "failures": 0,
+        "opened": None,
+        "probing": False,
+    }
+    breaker.before_call(HOST)
+
+
+def test_probe_failure_reopens(breaker):
+    for _ in range(breaker.threshold):
+        breaker.failure(HOST)
+    expire(breaker)
+    breaker.before_call(HOST)
+    breaker.failure(HOST)
+    assert breaker.host(HOST)["state"] == plugin.CircuitBreaker.OPEN
+    with pytest.raises(plugin.DockerUnavailable):
+        breaker.before_call(HOST)
+
+
+def test_hosts_are_independent(breaker):
+    for _ in range(breaker.threshold):
+        breaker.failure(HOST)
+    assert breaker.available("other.test:2376")
+    breaker.before_call("other.test:2376")
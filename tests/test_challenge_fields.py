@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+plugin = pytest.importorskip("CTFd.plugins.docker_challenges")
+
+STACK = [
+    {"image": "mysql:8", "alias": "db", "env": {"MYSQL_ROOT_PASSWORD": "x"}},
+    {"image": "registry.local/web:1", "expose": True, "env": ["DB_HOST=db"]},
+]
+
+
+def test_clean_stack_puts_the_exposed_service_first():
+    services = plugin.clean_stack(json.dumps(STACK))
+    assert services == [
+        {
+            "image": "registry.local/web:1",
+            "alias": "web",
+            "env": ["DB_HOST=db"],
+            "expose": True,
+        },
+        {"image": "mysql:8", "alias": "db", "env": ["MYSQL_ROOT_PASSWORD=x"]},
+    ]
+
+
+def test_clean_stack_ignores_single_services():
+    assert plugin.clean_stack("") == []
+    assert plugin.clean_stack(json.dumps(STACK[1:])) == []
+    assert plugin.clean_stack(json.dumps(STACK[1:] + [{"alias": "no-image"}])) == []
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "[{",
+        json.dumps({"image": "web:1"}),
+        json.dumps([dict(s, expose=False) for s in STACK]),
+        json.dumps([dict(s, expose=True) for s in STACK]),
+        # "expose" has to be the JSON true, not any truthy value
+        json.dumps([STACK[0], dict(STACK[1], expose="yes")]),
+    ],
+)
+def test_clean_stack_rejects_invalid_stacks(value):
+    with pytest.raises(plugin.StackError):
+        plugin.clean_stack(value)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("3", 3), (2, 2), ("", 0), (None, 0), ("-4", 0), ("x", 0), ("1.5", 0)],
+)
+def test_clean_challenge_fields_warm_pool_size(value, expected):
+    data = plugin.clean_challenge_fields({"warm_pool_size": value})
+    assert data["warm_pool_size"] == expected
+
+
+def test_clean_challenge_fields_revert_strategy():
+    for strategy in plugin.REVERT_STRATEGIES:
+        data = plugin.clean_challenge_fields({"revert_strategy": strategy})
+        assert data["revert_strategy"] == strategy
+    data = plugin.clean_challenge_fields({"revert_strategy": "nope"})
+    assert data["revert_strategy"] == "recreate"
+
+
+def test_clean_challenge_fields_stack():
+    data = plugin.clean_challenge_fields(
+        {"docker_image": "ignored:1", "stack": json.dumps(STACK)}
+    )
+    assert data["docker_image"] == "registry.local/web:1"
+    assert json.loads(data["stack"])[0]["expose"] is True
+    data = plugin.clean_challenge_fields({"docker_image": "web:1", "stack": ""})
+    assert data == {"docker_image": "web:1", "stack": None}
+    with pytest.raises(plugin.StackError):
+        plugin.clean_challenge_fields({"stack": "[{"})
+
+
+def test_clean_challenge_fields_resources():
+    data = plugin.clean_challenge_fields(
+        {"cpu_limit": "0.5", "memory_limit": "", "pids_limit": "x"}
+    )
+    assert data == {"cpu_limit": 0.5, "memory_limit": None, "pids_limit": None}
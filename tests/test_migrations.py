@@ -0,0 +1,224 @@
+"""
+Runs the plugin migrations on SQLite. Only needs SQLAlchemy and Alembic, the
+migration modules are loaded from their files like CTFd's plugin upgrade
+does.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+sa = pytest.importorskip("sqlalchemy")
+pytest.importorskip("alembic")
+
+from alembic.migration import MigrationContext  # noqa: E402
+from alembic.operations import Operations  # noqa: E402
+
+MIGRATIONS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "docker_challenges",
+    "migrations",
+)
+
+
+def load_migration(revision):
+    for name in os.listdir(MIGRATIONS):
+        if name.startswith(revision) and name.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(
+                name[:-3], os.path.join(MIGRATIONS, name)
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+    raise LookupError(revision)
+
+
+def old_schema(metadata):
+    """
+    The tables as they were at 9e3a1d6c2f48: string owner ids, a CSV of
+    ports and an index on every column.
+    """
+    sa.Table("teams", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    sa.Table("users", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    sa.Table(
+        "docker_config",
+        metadata,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("hostname", sa.String(64), index=True),
+        sa.Column("tls_enabled", sa.Boolean, index=True),
+        sa.Column("ca_cert", sa.String(2200), index=True),
+        sa.Column("client_cert", sa.String(2000), index=True),
+        sa.Column("client_key", sa.String(3300), index=True),
+        sa.Column("repositories", sa.String(1024), index=True),
+        sa.Column("owner_id", sa.String(64), index=True, unique=True),
+    )
+    sa.Table(
+        "docker_challenge_tracker",
+        metadata,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("team_id", sa.String(64), index=True),
+        sa.Column("user_id", sa.String(64), index=True),
+        sa.Column("docker_image", sa.String(64), index=True),
+        sa.Column("timestamp", sa.Integer, index=True),
+        sa.Column("revert_time", sa.Integer, index=True),
+        sa.Column("instance_id", sa.String(128), index=True),
+        sa.Column("ports", sa.String(128), index=True),
+        sa.Column("host", sa.String(128), index=True),
+        sa.Column("docker_config_id", sa.Integer, index=True),
+    )
+    # create_all() adds the new table before the migrations run
+    sa.Table(
+        "docker_container_port",
+        metadata,
+        sa.Column(
+            "tracker_id",
+            sa.Integer,
+            sa.ForeignKey("docker_challenge_tracker.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("port", sa.Integer, primary_key=True, autoincrement=False),
+    )
+
+
+@pytest.fixture
+def conn():
+    engine = sa.create_engine("sqlite://")
+
+    @sa.event.listens_for(engine, "connect")
+    def foreign_keys(dbapi_connection, record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    metadata = sa.MetaData()
+    old_schema(metadata)
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        conn.execute(sa.text("INSERT INTO teams (id) VALUES (1)"))
+        conn.execute(sa.text("INSERT INTO users (id) VALUES (1), (2)"))
+        conn.execute(
+            sa.text(
+                "INSERT INTO docker_config (id, hostname, owner_id) "
+                "VALUES (1, 'a:2376', '1'), (2, 'b:2376', '2')"
+            )
+        )
+        conn.execute(
+            sa.text(
+                "INSERT INTO docker_challenge_tracker "
+                "(id, team_id, user_id, docker_image, ports, docker_config_id) "
+                "VALUES "
+                "(1, NULL, '1', 'web:1', '31000,31001', 1), "
+                "(2, '1', NULL, 'web:1', '31002,31002,', 9), "
+                "(3, NULL, '3', 'web:1', '31003', 2), "
+                "(4, NULL, 'x', 'web:1', '31004', 2), "
+                "(5, NULL, '2', 'db:1', NULL, 2)"
+            )
+        )
+        yield conn
+    engine.dispose()
+
+
+def upgrade(conn, revision):
+    load_migration(revision).upgrade(op=Operations(MigrationContext.configure(conn)))
+
+
+def downgrade(conn, revision):
+    load_migration(revision).downgrade(op=Operations(MigrationContext.configure(conn)))
+
+
+def rows(conn, query):
+    return sorted(tuple(r) for r in conn.execute(sa.text(query)))
+
+
+def test_typed_owner_ids_and_container_ports(conn):
+    upgrade(conn, "7b2d4f8a1c63")
+    inspector = sa.inspect(conn)
+
+    columns = dict(
+        (c["name"], c["type"])
+        for c in inspector.get_columns("docker_challenge_tracker")
+    )
+    assert "ports" not in columns
+    assert isinstance(columns["team_id"], sa.Integer)
+    assert isinstance(columns["user_id"], sa.Integer)
+    owner_id = [
+        c["type"]
+        for c in inspector.get_columns("docker_config")
+        if c["name"] == "owner_id"
+    ][0]
+    assert isinstance(owner_id, sa.Integer)
+
+    # Trackers of missing or malformed owners are gone, dangling configs
+    # are cleared.
+    assert rows(
+        conn,
+        "SELECT id, team_id, user_id, docker_config_id FROM docker_challenge_tracker",
+    ) == [(1, None, 1, 1), (2, 1, None, None), (5, None, 2, 2)]
+    assert rows(conn, "SELECT tracker_id, port FROM docker_container_port") == [
+        (1, 31000),
+        (1, 31001),
+        (2, 31002),
+    ]
+
+    foreign_keys = set(
+        (fk["referred_table"], tuple(fk["constrained_columns"]))
+        for fk in inspector.get_foreign_keys("docker_challenge_tracker")
+    )
+    assert foreign_keys == {
+        ("teams", ("team_id",)),
+        ("users", ("user_id",)),
+        ("docker_config", ("docker_config_id",)),
+    }
+    indexes = dict(
+        (i["name"], i["column_names"])
+        for i in inspector.get_indexes("docker_challenge_tracker")
+    )
+    assert indexes["ix_docker_challenge_tracker_team_image"] == [
+        "team_id",
+        "docker_image",
+    ]
+    assert indexes["ix_docker_challenge_tracker_user_image"] == [
+        "user_id",
+        "docker_image",
+    ]
+    for table in ("docker_config", "docker_challenge_tracker"):
+        names = [i["name"] for i in inspector.get_indexes(table)]
+        for column in load_migration("7b2d4f8a1c63").UNUSED_INDEXES[table]:
+            assert "ix_%s_%s" % (table, column) not in names
+
+    # A second run, like on installs that create_all() already brought up to
+    # date, changes nothing.
+    upgrade(conn, "7b2d4f8a1c63")
+    assert len(rows(conn, "SELECT * FROM docker_container_port")) == 3
+
+
+def test_typed_owner_ids_downgrade_restores_the_ports(conn):
+    upgrade(conn, "7b2d4f8a1c63")
+    downgrade(conn, "7b2d4f8a1c63")
+    assert rows(conn, "SELECT id, ports FROM docker_challenge_tracker") == [
+        (1, "31000,31001"),
+        (2, "31002"),
+        (5, None),
+    ]
+    assert rows(conn, "SELECT * FROM docker_container_port") == []
+    columns = dict(
+        (c["name"], c["type"])
+        for c in sa.inspect(conn).get_columns("docker_challenge_tracker")
+    )
+    assert isinstance(columns["team_id"], sa.String)
+
+
+def test_host_scheduling_columns(conn):
+    conn.execute(
+        sa.text(
+            "CREATE TABLE docker_host (id INTEGER PRIMARY KEY, "
+            "hostname VARCHAR(64), port_range_start INTEGER, port_range_end INTEGER)"
+        )
+    )
+    upgrade(conn, "c7e2a9f4b1d3")
+    columns = [c["name"] for c in sa.inspect(conn).get_columns("docker_host")]
+    assert {"pooled", "weight", "max_containers"} <= set(columns)
+    upgrade(conn, "c7e2a9f4b1d3")
+    downgrade(conn, "c7e2a9f4b1d3")
+    columns = [c["name"] for c in sa.inspect(conn).get_columns("docker_host")]
+    assert not {"pooled", "weight", "max_containers"} & set(columns)
@@ -0,0 +1,85 @@
+import pytest
+
+plugin = pytest.importorskip("CTFd.plugins.docker_challenges")
+
+
+def add_host(hostname, **kwargs):
+    host = plugin.DockerHost(hostname=hostname, **kwargs)
+    plugin.db.session.add(host)
+    plugin.db.session.commit()
+    return host
+
+
+def leases(hostname):
+    return dict(
+        (lease.port, lease.instance_id)
+        for lease in plugin.DockerPortLease.query.filter_by(host=hostname)
+    )
+
+
+def test_allocate_stays_in_the_host_range(docker_config):
+    add_host(docker_config.hostname, port_range_start=31000, port_range_end=31009)
+    allocator = plugin.PortAllocator()
+    ports = [l.port for l in allocator.allocate(docker_config, 4, "a")]
+    plugin.db.session.commit()
+    assert len(set(ports)) == 4
+    assert all(31000 <= p <= 31009 for p in ports)
+    assert leases(docker_config.hostname) == dict((p, "a") for p in ports)
+
+
+def test_allocate_never_hands_out_a_leased_port(docker_config):
+    add_host(docker_config.hostname, port_range_start=31000, port_range_end=31003)
+    allocator = plugin.PortAllocator()
+    first = allocator.allocate(docker_config, 2, "a")
+    plugin.db.session.commit()
+    second = allocator.allocate(docker_config, 2, "b")
+    plugin.db.session.commit()
+    assert set(l.port for l in first).isdisjoint(l.port for l in second)
+    with pytest.raises(RuntimeError):
+        allocator.allocate(docker_config, 1, "c")
+    plugin.db.session.rollback()
+    assert len(leases(docker_config.hostname)) == 4
+
+
+def test_release_drops_only_the_instance_leases(docker_config):
+    allocator = plugin.PortAllocator()
+    kept = allocator.allocate(docker_config, 1, "a")[0].port
+    allocator.allocate(docker_config, 2, "b")
+    plugin.db.session.commit()
+    allocator.release("b")
+    plugin.db.session.commit()
+    assert leases(docker_config.hostname) == {kept: "a"}
+
+
+def test_reconcile_follows_the_published_ports(docker_config, fake_docker):
+    status, container = fake_docker.docker.create_container(
+        {"name": ["stray"]},
+        {
+            "Image": "test/web:1",
+            "Labels": {},
+            "HostConfig": {"PortBindings": {"80/tcp": [{"HostPort": "32000"}]}},
+        },
+    )
+    assert status == 201
+    fake_docker.docker.container_action(container["Id"], "start", {})
+    tracker = plugin.DockerChallengeTracker(
+        user_id=docker_config.owner_id,
+        docker_image="test/web:1",
+        instance_id="tracked",
+        docker_config_id=docker_config.id,
+    )
+    plugin.db.session.add(tracker)
+    for port, instance_id in ((32001, "tracked"), (32002, "vanished")):
+        plugin.db.session.add(
+            plugin.DockerPortLease(
+                host=docker_config.hostname, port=port, instance_id=instance_id
+            )
+        )
+    plugin.db.session.commit()
+
+    plugin.PortAllocator().reconcile(docker_config)
+
+    assert leases(docker_config.hostname) == {
+        32000: container["Id"],
+        32001: "tracked",
+    }
@@ -0,0 +1,91 @@
+import pytest
+
+plugin = pytest.importorskip("CTFd.plugins.docker_challenges")
+
+
+@pytest.fixture
+def owners(app):
+    """
+    Three users, each with a DockerConfig for a host of its own.
+    """
+    from CTFd.models import Users
+
+    configs = list()
+    for i in range(3):
+        user = Users(name="u%s" % i, email="u%s@test.local" % i, password="password")
+        plugin.db.session.add(user)
+        plugin.db.session.flush()
+        configs.append(
+            plugin.DockerConfig(
+                owner_id=user.id, hostname="host%s:2375" % i, tls_enabled=False
+            )
+        )
+    plugin.db.session.add_all(configs)
+    plugin.db.session.commit()
+    return configs
+
+
+def pool(hosts):
+    plugin.set_config("docker_scheduler", "pool")
+    for hostname, kwargs in hosts.items():
+        plugin.db.session.add(
+            plugin.DockerHost(hostname=hostname, pooled=True, **kwargs)
+        )
+    plugin.db.session.commit()
+
+
+def track(config, owner_id, count):
+    for i in range(count):
+        plugin.db.session.add(
+            plugin.DockerChallengeTracker(
+                user_id=owner_id,
+                docker_image="test/web:1",
+                instance_id="%s-%s" % (config.hostname, i),
+                docker_config_id=config.id,
+            )
+        )
+    plugin.db.session.commit()
+
+
+def test_owner_mode_uses_the_owner_config(owners):
+    scheduler = plugin.HostScheduler()
+    for config in owners:
+        assert scheduler.place(config.owner_id).id == config.id
+
+
+def test_pool_prefers_the_least_loaded_host(app, owners):
+    pool({"host0:2375": {}, "host1:2375": {}})
+    track(owners[0], owners[2].owner_id, 2)
+    track(owners[1], owners[2].owner_id, 1)
+    plugin.set_config("docker_scheduler_affinity", 0)
+    assert plugin.HostScheduler().place(owners[0].owner_id).hostname == "host1:2375"
+
+
+def test_pool_weighs_the_load(app, owners):
+    pool({"host0:2375": {"weight": 4.0}, "host1:2375": {"weight": 1.0}})
+    plugin.set_config("docker_scheduler_affinity", 0)
+    track(owners[0], owners[2].owner_id, 3)
+    track(owners[1], owners[2].owner_id, 1)
+    assert plugin.HostScheduler().place(owners[0].owner_id).hostname == "host0:2375"
+
+
+def test_pool_skips_full_hosts(app, owners):
+    pool({"host0:2375": {"max_containers": 1}, "host1:2375": {}})
+    plugin.set_config("docker_scheduler_affinity", 0)
+    track(owners[0], owners[2].owner_id, 1)
+    track(owners[1], owners[2].owner_id, 5)
+    assert plugin.HostScheduler().place(owners[0].owner_id).hostname == "host1:2375"
+
+
+def test_pool_returns_none_when_every_host_is_full(app, owners):
+    pool({"host0:2375": {"max_containers": 1}})
+    track(owners[0], owners[2].owner_id, 1)
+    assert plugin.HostScheduler().place(owners[1].owner_id) is None
+
+
+def test_pool_keeps_the_owner_on_its_host(app, owners):
+    pool({"host0:2375": {}, "host1:2375": {}})
+    plugin.set_config("docker_scheduler_affinity", 1)
+    track(owners[0], owners[2].owner_id, 3)
+    assert plugin.HostScheduler().place(owners[2].owner_id).hostname == "host0:2375"
+    assert plugin.HostScheduler().place(owners[1].owner_id).hostname == "host1:2375"